@@ -1,41 +1,215 @@
+from __future__ import annotations
+
+import io
 import os
+import re
+import hmac
+import hashlib
+import heapq
+import queue
+import socket
+import signal
+import gzip
+import html
+import json
+import itertools
+import atexit
+import base64
+import bisect
+import struct
 import logging
+import tempfile
 import sqlite3
-from typing import Dict, List, Optional, Tuple
-import telebot
-from dotenv import load_dotenv
-from telebot.types import (
-    Message, ReplyKeyboardMarkup, KeyboardButton,
-    ReplyKeyboardRemove, InlineKeyboardMarkup, InlineKeyboardButton
-)
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from typing import TYPE_CHECKING, Callable, Deque, Dict, Iterator, List, NamedTuple, Optional, Tuple
 import time
 
-load_dotenv()
+if TYPE_CHECKING:
+    import telebot
+    from telebot.types import InlineKeyboardMarkup, Message, ReplyKeyboardMarkup
+
+if __name__ == '__main__':
+    # The configuration below is read from the environment, so .env is loaded
+    # first; importing the module leaves the environment alone
+    from dotenv import load_dotenv
+    load_dotenv()
 
 # Configuration
 TOKEN = os.getenv('NSL_TOKEN')  # Token from environment variable
+# Update intake: 'sync' (long polling), 'async' (long polling on an asyncio
+# event loop) or 'webhook' (local HTTP endpoint behind a reverse proxy)
+NSL_RUNTIME = os.getenv('NSL_RUNTIME', 'sync').lower()
+NSL_RUNTIMES = ('sync', 'async', 'webhook')
+
+# Webhook mode: public URL registered with Telegram, local listen address,
+# secret token checked on every request and intake queue size
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8443))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000))
+WEBHOOK_MAX_BODY = 1024 * 1024
 DATA_DIR = os.getenv('DATA_DIR', 'data')
 LOGS_DIR = os.getenv('LOGS_DIR', 'logs')
 DB_PATH = os.path.join(DATA_DIR, 'ns_system.db')
 
-# Create directories if they don't exist
-os.makedirs(DATA_DIR, exist_ok=True)
-os.makedirs(LOGS_DIR, exist_ok=True)
-
-# Initialize bot
-bot = telebot.TeleBot(TOKEN)
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(os.path.join(LOGS_DIR, 'nsl-bot.log')),
-        logging.StreamHandler()
-    ]
-)
+# SQLite busy timeout in milliseconds
+DB_BUSY_TIMEOUT = int(os.getenv('DB_BUSY_TIMEOUT', 5000))
+# SQLite journal mode; WAL needs all processes on one host, use DELETE when
+# DATA_DIR is on a network filesystem shared by several hosts
+DB_JOURNAL_MODE = os.getenv('DB_JOURNAL_MODE', 'WAL')
+
+# How long resolved user permissions are cached, in seconds
+ACCESS_CACHE_TTL = float(os.getenv('ACCESS_CACHE_TTL', 10))
+# Users whose permissions are cached at most; expired and then the oldest entries go first
+ACCESS_CACHE_SIZE = 1024
+
+# Live follow: update interval in seconds, session timeouts and per-chat cap
+FOLLOW_INTERVAL = float(os.getenv('FOLLOW_INTERVAL', 3))
+FOLLOW_IDLE_TIMEOUT = int(os.getenv('FOLLOW_IDLE_TIMEOUT', 600))
+FOLLOW_MAX_DURATION = int(os.getenv('FOLLOW_MAX_DURATION', 3600))
+FOLLOW_MAX_PER_CHAT = int(os.getenv('FOLLOW_MAX_PER_CHAT', 3))
+# Lines shown in a follow message and max bytes read per file per update
+FOLLOW_WINDOW_LINES = 30
+FOLLOW_MAX_READ = 1024 * 1024
+
+# Log downloads: compression codec (gzip, zstd or none) and its level
+LOG_COMPRESSION = os.getenv('LOG_COMPRESSION', 'gzip').lower()
+LOG_COMPRESSION_LEVEL = int(os.getenv('LOG_COMPRESSION_LEVEL', 6))
+# Telegram bot API upload limit, larger files are sent in numbered parts
+TELEGRAM_UPLOAD_LIMIT = 50 * 1024 * 1024
+# Compressed data stays in memory up to this size, then spills to disk
+DOWNLOAD_SPOOL_SIZE = 8 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Rate limits for downloads, searches and filtered views: requests per minute
+# and burst size, per user and per bot (0 disables a limit)
+RATE_LIMIT_USER = float(os.getenv('RATE_LIMIT_USER', 6))
+RATE_LIMIT_USER_BURST = int(os.getenv('RATE_LIMIT_USER_BURST', 3))
+RATE_LIMIT_BOT = float(os.getenv('RATE_LIMIT_BOT', 12))
+RATE_LIMIT_BOT_BURST = int(os.getenv('RATE_LIMIT_BOT_BURST', 5))
+
+# Log search: lines per index block, context lines, result limit and time budget
+LOG_INDEX_DIR = os.path.join(DATA_DIR, 'index')
+LOG_INDEX_STEP = 1000
+GREP_CONTEXT = 1
+GREP_MAX_MATCHES = int(os.getenv('GREP_MAX_MATCHES', 100))
+GREP_TIME_BUDGET = float(os.getenv('GREP_TIME_BUDGET', 10))
+# Only the start of longer lines is searched
+GREP_LINE_LIMIT = 4096
+# Bytes read back before a block for the time of a record continuing into it
+GREP_LOOKBACK = 1024 * 1024
+# Filtered tail view: default and max records, max bytes scanned backwards
+FILTER_DEFAULT_RECORDS = 50
+FILTER_MAX_RECORDS = 200
+FILTER_SCAN_LIMIT = int(os.getenv('FILTER_SCAN_LIMIT', 64 * 1024 * 1024))
+# Most lines the line view buttons may ask for
+LOG_VIEW_MAX_LINES = 200
+# Search, filter and tail results are kept for paging for this many seconds
+PAGED_RESULTS_TTL = 900
+# Characters of escaped log text per message page (Telegram allows 4096 in total)
+PAGE_LIMIT = 3800
+# Button payloads over Telegram's 64-byte limit are stored server side under
+# a short token: how long tokens live and how many are kept
+CALLBACK_TOKEN_TTL = float(os.getenv('CALLBACK_TOKEN_TTL', 7 * 24 * 3600))
+CALLBACK_TOKEN_LIMIT = int(os.getenv('CALLBACK_TOKEN_LIMIT', 10000))
+
+# Handler execution: worker threads and max queued updates; heavy I/O
+# (downloads, searches) runs on a separate pool with its own queue limit
+HANDLER_WORKERS = int(os.getenv('HANDLER_WORKERS', 4))
+HANDLER_QUEUE_SIZE = int(os.getenv('HANDLER_QUEUE_SIZE', 200))
+IO_WORKERS = int(os.getenv('IO_WORKERS', 2))
+IO_QUEUE_SIZE = int(os.getenv('IO_QUEUE_SIZE', 8))
+
+# Summary dashboard: refresh interval in seconds, error/warning window in
+# minutes, bytes read from a log seen for the first time and per refresh
+SUMMARY_INTERVAL = float(os.getenv('SUMMARY_INTERVAL', 15))
+SUMMARY_WINDOW = int(os.getenv('SUMMARY_WINDOW', 60))
+SUMMARY_SEED_BYTES = 1024 * 1024
+SUMMARY_MAX_READ = 32 * 1024 * 1024
+# Bytes read across all logs per refresh; bots left over are read first next time
+SUMMARY_CYCLE_BUDGET = int(os.getenv('SUMMARY_CYCLE_BUDGET', 64 * 1024 * 1024))
+
+# Alerts to subscribed admins: errors in the last ALERT_SPIKE_WINDOW minutes
+# reaching ALERT_SPIKE_MIN and ALERT_SPIKE_FACTOR times the usual rate, minutes
+# without log writes (0 disables) and seconds between alerts of one kind per bot
+ALERT_SPIKE_WINDOW = int(os.getenv('ALERT_SPIKE_WINDOW', 5))
+ALERT_SPIKE_MIN = int(os.getenv('ALERT_SPIKE_MIN', 10))
+ALERT_SPIKE_FACTOR = float(os.getenv('ALERT_SPIKE_FACTOR', 3))
+ALERT_SILENCE = int(os.getenv('ALERT_SILENCE', 30))
+ALERT_COOLDOWN = float(os.getenv('ALERT_COOLDOWN', 900))
+
+# Error records grouped by fingerprint, kept in a database of their own:
+# groups kept per bot, groups shown in the top errors view and sample size
+ERRORS_DB_PATH = os.path.join(DATA_DIR, 'ns_errors.db')
+ERROR_GROUPS_LIMIT = int(os.getenv('ERROR_GROUPS_LIMIT', 500))
+TOP_ERRORS_COUNT = 10
+ERROR_SAMPLE_LINES = 12
+ERROR_RECORD_LINES = 200
+
+# Log ingest for bots with the 'ring' backend: UDP address (host:port) and/or
+# Unix datagram socket path, empty disables; lines kept in memory per bot
+LOG_INGEST_UDP = os.getenv('LOG_INGEST_UDP', '')
+LOG_INGEST_SOCKET = os.getenv('LOG_INGEST_SOCKET', '')
+RING_BUFFER_LINES = int(os.getenv('RING_BUFFER_LINES', 5000))
+# Log shipping from managed bots (nsl_handler.py): TCP address (host:port)
+# and/or Unix socket path, empty disables; max frame size; fsync of batches
+LOG_SHIP_TCP = os.getenv('LOG_SHIP_TCP', '')
+LOG_SHIP_SOCKET = os.getenv('LOG_SHIP_SOCKET', '')
+LOG_SHIP_MAX_FRAME = int(os.getenv('LOG_SHIP_MAX_FRAME', 4 * 1024 * 1024))
+LOG_SHIP_FSYNC = os.getenv('LOG_SHIP_FSYNC', '1') == '1'
+# Seconds a shipped batch waits for its commit before it is answered as rejected
+LOG_SHIP_WRITE_TIMEOUT = 30
+
+# Metrics export: Prometheus text file rewritten every METRICS_INTERVAL
+# seconds and/or a local HTTP endpoint serving /metrics (port 0 disables)
+METRICS_FILE = os.getenv('METRICS_FILE', '')
+METRICS_INTERVAL = float(os.getenv('METRICS_INTERVAL', 15))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+
+# Several instances sharing DATA_DIR behind one token: name of this node,
+# address (host:port) other nodes reach it on for log requests (empty: single
+# instance), shared secret of those requests and leader lease in seconds
+NSL_NODE = os.getenv('NSL_NODE', socket.gethostname())
+NSL_RPC = os.getenv('NSL_RPC', '')
+NSL_RPC_SECRET = os.getenv('NSL_RPC_SECRET', '')
+LEADER_LEASE = float(os.getenv('LEADER_LEASE', 15))
+RPC_TIMEOUT = 30
+# Seconds between attempts when polling fails, doubled up to the maximum
+POLLING_RETRY_MIN = 1
+POLLING_RETRY_MAX = 60
+
+# Block size used when reading log files backwards from the end
+TAIL_BLOCK_SIZE = 64 * 1024
+
+# Tail cache limits: number of log files kept and lines kept per file
+TAIL_CACHE_FILES = int(os.getenv('TAIL_CACHE_FILES', 32))
+TAIL_CACHE_LINES = int(os.getenv('TAIL_CACHE_LINES', 200))
+# Appends larger than this are not replayed, the tail is reloaded instead
+TAIL_CACHE_MAX_APPEND = 4 * 1024 * 1024
+
 logger = logging.getLogger('nsl-bot')
 
+
+def setup():
+    """Create data directories, configure logging and create the bot; everything else starts on first use"""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    os.makedirs(LOGS_DIR, exist_ok=True)
+    os.makedirs(LOG_INDEX_DIR, exist_ok=True)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(os.path.join(LOGS_DIR, 'nsl-bot.log')),
+            logging.StreamHandler()
+        ]
+    )
+    get_bot()
+
+
 # Rank translations
 RANK_TEXT = {
     'operator': '⚡ Оператор',
@@ -44,504 +218,4617 @@ RANK_TEXT = {
     'user': '👤 Пользователь'
 }
 
+BUSY_TEXT = "⏳ Бот сейчас перегружен, попробуйте ещё раз через несколько секунд."
 
-def get_db_connection():
-    """Get SQLite database connection"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
 
+class RateLimiter:
+    """Token buckets keyed by user or bot name"""
 
-def init_database():
-    """Initialize database with required tables"""
-    conn = get_db_connection()
-    try:
-        # Check if tables already exist
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
-        if cursor.fetchone():
-            logger.info("Database already initialized")
+    def __init__(self, per_minute: float, burst: int):
+        self.rate = per_minute / 60
+        self.burst = max(burst, 1)
+        self.buckets: Dict[str, Tuple[float, float]] = {}  # key -> (tokens, updated)
+
+    def wait_time(self, key: str, now: float) -> float:
+        """Seconds until a token is available for key, 0 if one is available now"""
+        if self.rate <= 0:
+            return 0.0
+        tokens, updated = self.buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def take(self, key: str, now: float):
+        """Take a token for key"""
+        if self.rate <= 0:
             return
+        tokens, updated = self.buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        self.buckets[key] = (tokens - 1, now)
 
-        logger.info("Initializing database...")
-
-        # Create tables (same structure as in the documentation)
-        conn.executescript('''
-            CREATE TABLE users (
-                username TEXT PRIMARY KEY,
-                user_id INTEGER NOT NULL,
-                first_name TEXT NOT NULL,
-                rank TEXT NOT NULL DEFAULT 'user',
-                banned BOOLEAN NOT NULL DEFAULT FALSE,
-                warns INTEGER NOT NULL DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-
-            CREATE TABLE bots (
-                name TEXT PRIMARY KEY,
-                exe_path TEXT NOT NULL,
-                username TEXT NOT NULL,
-                state BOOLEAN NOT NULL DEFAULT FALSE,
-                type TEXT NOT NULL DEFAULT 'Standard',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-
-            CREATE TABLE bot_ladmins (
-                bot_name TEXT NOT NULL,
-                username TEXT NOT NULL,
-                PRIMARY KEY (bot_name, username),
-                FOREIGN KEY (bot_name) REFERENCES bots (name) ON DELETE CASCADE,
-                FOREIGN KEY (username) REFERENCES users (username) ON DELETE CASCADE
-            );
-
-            CREATE TABLE global_admins (
-                username TEXT PRIMARY KEY,
-                FOREIGN KEY (username) REFERENCES users (username) ON DELETE CASCADE
-            );
-
-            CREATE TABLE operators (
-                username TEXT PRIMARY KEY,
-                FOREIGN KEY (username) REFERENCES users (username) ON DELETE CASCADE
-            );
-
-            CREATE TABLE bans (
-                username TEXT PRIMARY KEY,
-                banned_by TEXT NOT NULL,
-                banned_at INTEGER NOT NULL,
-                ban_time INTEGER NOT NULL DEFAULT 0,
-                reason TEXT,
-                FOREIGN KEY (username) REFERENCES users (username) ON DELETE CASCADE
-            );
-
-            CREATE TABLE auth_codes (
-                code TEXT PRIMARY KEY,
-                username TEXT NOT NULL,
-                created_at INTEGER NOT NULL,
-                used BOOLEAN NOT NULL DEFAULT FALSE,
-                FOREIGN KEY (username) REFERENCES users (username) ON DELETE CASCADE
-            );
-        ''')
-        conn.commit()
-        logger.info("Database initialized successfully")
+    def refund(self, key: str, now: float):
+        """Give back a token taken for work that did not run"""
+        if self.rate <= 0 or key not in self.buckets:
+            return
+        tokens, updated = self.buckets[key]
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        self.buckets[key] = (min(self.burst, tokens + 1), now)
 
-    except Exception as e:
-        logger.error(f"Error initializing database: {e}")
-        raise
-    finally:
-        conn.close()
 
+user_limiter = RateLimiter(RATE_LIMIT_USER, RATE_LIMIT_USER_BURST)
+bot_limiter = RateLimiter(RATE_LIMIT_BOT, RATE_LIMIT_BOT_BURST)
+_rate_limit_lock = threading.Lock()
 
-def get_user_rank(username: str) -> str:
-    """Get user rank from database"""
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
 
-        # Check if user is operator
-        cursor.execute("SELECT 1 FROM operators WHERE username = ?", (username,))
-        if cursor.fetchone():
-            return 'operator'
+def check_rate_limit(username: str, bot_name: str) -> Optional[str]:
+    """Take a token from the user's and the bot's bucket, return refusal text if either is empty"""
+    now = time.monotonic()
+    with _rate_limit_lock:
+        wait = max(user_limiter.wait_time(username, now), bot_limiter.wait_time(bot_name, now))
+        if wait == 0:
+            user_limiter.take(username, now)
+            bot_limiter.take(bot_name, now)
+            return None
+    logger.warning(f"Rate limited @{username} on {bot_name} for {wait:.1f}s")
+    return f"⏳ Слишком много запросов. Повторите через {int(wait) + 1} с."
 
-        # Check if user is global admin
-        cursor.execute("SELECT 1 FROM global_admins WHERE username = ?", (username,))
-        if cursor.fetchone():
-            return 'gadmin'
 
-        # Get user's rank from users table
-        cursor.execute("SELECT rank FROM users WHERE username = ?", (username,))
-        result = cursor.fetchone()
-        return result['rank'] if result else 'none'
+def refund_rate_limit(username: str, bot_name: str):
+    """Give back the tokens of a request the I/O pool refused"""
+    now = time.monotonic()
+    with _rate_limit_lock:
+        user_limiter.refund(username, now)
+        bot_limiter.refund(bot_name, now)
 
-    except Exception as e:
-        logger.error(f"Error getting user rank for {username}: {e}")
-        return 'none'
-    finally:
-        conn.close()
 
+class ThreadShards:
+    """Per-thread values written without locks and merged when read"""
 
-def get_user_bots(username: str) -> List[str]:
-    """Get list of bots that user has access to"""
-    user_rank = get_user_rank(username)
+    def __init__(self, factory: Callable[[], object], merge: Callable[[object, object], None]):
+        self._factory = factory
+        self._merge = merge
+        self.local = threading.local()
+        self._shards: List[Tuple[threading.Thread, object]] = []
+        self._retired = factory()
+        self._lock = threading.Lock()
 
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
+    def get(self):
+        """Get the shard of the current thread"""
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = self.local.shard = self._factory()
+            with self._lock:
+                self._fold()
+                self._shards.append((threading.current_thread(), shard))
+            return shard
 
-        # Operators and global admins have access to all bots
-        if user_rank in ['operator', 'gadmin']:
-            cursor.execute("SELECT name FROM bots")
-            return [row['name'] for row in cursor.fetchall()]
+    def merged(self):
+        """Get the sum of all shards"""
+        total = self._factory()
+        with self._lock:
+            self._fold()
+            self._merge(total, self._retired)
+            for _, shard in self._shards:
+                self._merge(total, shard)
+        return total
 
-        # Local admins have access only to specific bots
-        cursor.execute('''
-            SELECT b.name 
-            FROM bots b 
-            JOIN bot_ladmins bl ON b.name = bl.bot_name 
-            WHERE bl.username = ?
-        ''', (username,))
+    def _fold(self):
+        # Finished threads no longer write: keep their values, not their shards
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                self._merge(self._retired, shard)
+        self._shards = live
 
-        return [row['name'] for row in cursor.fetchall()]
 
-    except Exception as e:
-        logger.error(f"Error getting user bots for {username}: {e}")
-        return []
-    finally:
-        conn.close()
+def _add_list(total: list, shard: list):
+    """Add a list of numbers into another"""
+    for i, value in enumerate(shard):
+        total[i] += value
 
 
-def is_user_allowed(username: str, user_id: int) -> bool:
-    """Check if user is allowed to use the bot"""
-    # Users without username are not allowed
-    if not username:
-        logger.warning(f"User without username (ID: {user_id}) tried to access the bot")
-        return False
+def _add_dict(total: dict, shard: dict):
+    """Add a dict of numbers into another"""
+    for key, value in shard.copy().items():
+        total[key] = total.get(key, 0) + value
 
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
 
-        # Check if user exists and is not banned
-        cursor.execute('''
-            SELECT banned, rank FROM users WHERE username = ?
-        ''', (username,))
+class LatencyHistogram:
+    """Cumulative latency histogram with fixed buckets in seconds"""
 
-        user_data = cursor.fetchone()
-        if not user_data:
-            logger.warning(f"User @{username} (ID: {user_id}) not found in system")
-            return False
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
 
-        if user_data['banned']:
-            logger.warning(f"Banned user @{username} (ID: {user_id}) tried to access the bot")
-            return False
+    def __init__(self):
+        # Bucket counts, then the sum; the count is theirs
+        self._shards = ThreadShards(lambda: [0] * (len(self.BUCKETS) + 1), _add_list)
+        self._local = self._shards.local
 
-        # Regular users are not allowed
-        if user_data['rank'] == 'user':
-            logger.warning(f"Regular user @{username} (ID: {user_id}) tried to access the bot")
-            return False
+    def observe(self, seconds: float):
+        """Record one duration"""
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._shards.get()
+        shard[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        shard[-1] += seconds
 
-        return True
+    @property
+    def count(self) -> int:
+        """Number of recorded durations"""
+        return sum(self._shards.merged()[:-1])
 
-    except Exception as e:
-        logger.error(f"Error checking user access for {username}: {e}")
-        return False
-    finally:
-        conn.close()
+    @property
+    def total(self) -> float:
+        """Sum of recorded durations"""
+        return self._shards.merged()[-1]
 
+    def snapshot(self) -> Dict[str, object]:
+        """Get bucket counts, sum and count"""
+        values = self._shards.merged()
+        return {'buckets': dict(zip(self.BUCKETS, values)), 'sum': values[-1], 'count': sum(values[:-1])}
 
-def get_log_lines(bot_name: str, num_lines: int) -> Optional[str]:
-    """Get last N lines from bot's log file"""
-    log_file = os.path.join(LOGS_DIR, f"{bot_name}.log")
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th quantile"""
+        values = self._shards.merged()
+        rank = q * sum(values[:-1])
+        seen = 0
+        for bound, count in zip(self.BUCKETS, values):
+            seen += count
+            if seen >= rank and seen > 0:
+                return bound
+        return 0.0
 
-    try:
-        if not os.path.exists(log_file):
-            logger.warning(f"Log file for bot {bot_name} not found at {log_file}")
-            return None
 
-        with open(log_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-            last_lines = lines[-num_lines:] if len(lines) > num_lines else lines
-            return ''.join(last_lines)
-    except Exception as e:
-        logger.error(f"Error reading log file for bot {bot_name}: {e}")
-        return None
+class HistogramFamily(dict):
+    """Histograms of one metric by the value of its only label, looked up without building keys"""
 
+    def __init__(self, registry: 'MetricsRegistry', name: str, label: str):
+        super().__init__()
+        self.registry = registry
+        self.name = name
+        self.label = label
 
-def create_main_keyboard(username: str) -> ReplyKeyboardMarkup:
-    """Create main keyboard based on user's access level"""
-    user_bots = get_user_bots(username)
-    keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
+    def __missing__(self, value) -> LatencyHistogram:
+        histogram = self[value] = self.registry.histogram(self.name, **{self.label: value})
+        return histogram
 
-    if not user_bots:
-        keyboard.add(KeyboardButton("🔄 Обновить"))
-        return keyboard
 
-    # Add buttons for each bot the user has access to
-    row = []
-    for i, bot_name in enumerate(user_bots):
-        row.append(KeyboardButton(f"📊 {bot_name}"))
-        if (i + 1) % 2 == 0 or i == len(user_bots) - 1:
-            keyboard.add(*row)
-            row = []
+def _escape_label(value) -> str:
+    """Escape a label value for the Prometheus text format"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
 
-    # Add utility buttons
-    keyboard.add(KeyboardButton("🔄 Обновить"))
 
-    return keyboard
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: str = '') -> str:
+    """Format labels for the Prometheus text format"""
+    parts = [f'{key}="{_escape_label(value)}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
 
 
-def create_bot_keyboard(bot_name: str) -> InlineKeyboardMarkup:
-    """Create inline keyboard for a specific bot"""
-    keyboard = InlineKeyboardMarkup(row_width=2)
+def _metric_key(name: str, labels: Dict[str, object]) -> Tuple[str, tuple]:
+    """Key of a metric; most have a single label, which needs no sorting"""
+    return (name, tuple(labels.items()) if len(labels) < 2 else tuple(sorted(labels.items())))
 
-    keyboard.add(
-        InlineKeyboardButton("📃 20 строк", callback_data=f"log_{bot_name}_20"),
-        InlineKeyboardButton("📋 50 строк", callback_data=f"log_{bot_name}_50"),
-        InlineKeyboardButton("📥 Скачать логи", callback_data=f"download_{bot_name}")
-    )
 
-    return keyboard
+class MetricsRegistry:
+    """Counters, latency histograms and collected gauges keyed by name and labels"""
 
+    def __init__(self):
+        self.counters = ThreadShards(dict, _add_dict)
+        self.histograms: Dict[Tuple[str, tuple], LatencyHistogram] = {}
+        self.collectors: List[Callable[[], List[Tuple[str, str, Dict[str, str], float]]]] = []
+        self._lock = threading.Lock()
 
-def register_user(username: str, user_id: int, first_name: str) -> bool:
-    """Register new user in database"""
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
+    def inc(self, name: str, value: float = 1, **labels):
+        """Add to a counter"""
+        counters = self.counters.get()
+        key = _metric_key(name, labels)
+        counters[key] = counters.get(key, 0) + value
 
-        # Check if user already exists
-        cursor.execute("SELECT 1 FROM users WHERE username = ?", (username,))
-        if cursor.fetchone():
-            return True
+    def histogram(self, name: str, **labels) -> LatencyHistogram:
+        """Get or create a latency histogram"""
+        key = _metric_key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(key, LatencyHistogram())
+        return histogram
 
-        # Insert new user
-        cursor.execute('''
-            INSERT INTO users (username, user_id, first_name, rank, banned, warns)
-            VALUES (?, ?, ?, 'user', FALSE, 0)
-        ''', (username, user_id, first_name))
+    def family(self, name: str, label: str) -> HistogramFamily:
+        """Get histograms of a metric with one label by its value"""
+        return HistogramFamily(self, name, label)
 
-        conn.commit()
-        logger.info(f"Registered new user @{username} (ID: {user_id})")
-        return True
+    def register(self, name: str, histogram: LatencyHistogram, **labels):
+        """Export an existing histogram"""
+        with self._lock:
+            self.histograms[_metric_key(name, labels)] = histogram
 
-    except Exception as e:
-        logger.error(f"Error registering user @{username}: {e}")
-        return False
-    finally:
-        conn.close()
+    def observe(self, name: str, seconds: float, **labels):
+        """Record a duration"""
+        self.histogram(name, **labels).observe(seconds)
 
+    def timed(self, name: str, **labels):
+        """Decorator recording the duration of every call"""
+        def decorator(func):
+            histogram = self.histogram(name, **labels)
 
-@bot.message_handler(commands=['start'])
-def handle_start(message: Message):
-    """Handle /start command"""
-    username = message.from_user.username
-    user_id = message.from_user.id
-    first_name = message.from_user.first_name or "Unknown"
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - started)
+            wrapper.__name__ = func.__name__
+            wrapper.__doc__ = func.__doc__
+            return wrapper
+        return decorator
 
-    logger.info(f"Received /start from @{username} (ID: {user_id})")
+    def add_collector(self, collector: Callable[[], List[Tuple[str, str, Dict[str, str], float]]]):
+        """Add a function returning (type, name, labels, value) samples read at export time"""
+        self.collectors.append(collector)
 
-    # Check if user is allowed
-    if not is_user_allowed(username, user_id):
-        bot.send_message(
-            message.chat.id,
-            "❌ У вас нет доступа к этому боту.\n\n"
-            "Этот бот предназначен только для администраторов системы.",
-            reply_markup=ReplyKeyboardRemove()
-        )
-        return
+    def histogram_values(self, name: str) -> List[Tuple[tuple, LatencyHistogram]]:
+        """Get histograms of a metric by labels"""
+        with self._lock:
+            return sorted(((labels, h) for (key, labels), h in self.histograms.items() if key == name),
+                          key=lambda item: item[0])
 
-    # Register new user if needed
-    if not register_user(username, user_id, first_name):
-        bot.send_message(
-            message.chat.id,
-            "❌ Ошибка регистрации. Обратитесь к администратору."
-        )
-        return
+    def counter_values(self, name: str) -> Dict[tuple, float]:
+        """Get values of a counter by labels"""
+        return {labels: value for (key, labels), value in self.counters.merged().items() if key == name}
 
-    # Send welcome message with keyboard
-    user_bots = get_user_bots(username)
-    if not user_bots:
-        bot.send_message(
-            message.chat.id,
-            "👋 Добро пожаловать в NS Logger!\n\n"
-            "❌ У вас нет доступа ни к одному боту.\n"
-            "Обратитесь к оператору системы для получения прав доступа.",
-            reply_markup=create_main_keyboard(username)
-        )
-    else:
-        bot.send_message(
-            message.chat.id,
-            "👋 Добро пожаловать в NS Logger!\n\n"
-            "Выберите бот для просмотра логов:",
-            reply_markup=create_main_keyboard(username)
-        )
+    def render_prometheus(self) -> str:
+        """Render all metrics in the Prometheus text exposition format"""
+        lines = []
+        counters = sorted(self.counters.merged().items())
+        with self._lock:
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
 
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
 
-@bot.message_handler(commands=['me'])
-def handle_me(message: Message):
-    """Handle /me command"""
-    username = message.from_user.username
-    user_id = message.from_user.id
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            snapshot = histogram.snapshot()
+            cumulative = 0
+            for bound, count in snapshot['buckets'].items():
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else str(bound)
+                bucket_labels = _format_labels(labels, 'le="' + le + '"')
+                lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {snapshot['sum']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {snapshot['count']}")
 
-    logger.info(f"Received /me from @{username} (ID: {user_id})")
+        for collector in self.collectors:
+            try:
+                samples = collector()
+            except Exception as e:
+                logger.error(f"Error collecting metrics: {e}")
+                continue
+            for kind, name, labels, value in samples:
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name}{_format_labels(tuple(sorted(labels.items())))} {value}")
+        return '\n'.join(lines) + '\n'
 
-    # Check if user is allowed
-    if not is_user_allowed(username, user_id):
-        bot.send_message(
-            message.chat.id,
-            "❌ У вас нет доступа к этому боту.",
-            reply_markup=ReplyKeyboardRemove()
-        )
-        return
 
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
+metrics = MetricsRegistry()
+# Histograms of the hottest paths, looked up by label value
+handler_seconds = metrics.family('nsl_handler_seconds', 'handler')
+db_seconds = metrics.family('nsl_db_seconds', 'statement')
+rpc_seconds = metrics.family('nsl_rpc_seconds', 'op')
 
-        # Get user data
-        cursor.execute('''
-            SELECT user_id, first_name, rank, banned, warns 
-            FROM users WHERE username = ?
-        ''', (username,))
 
-        user_data = cursor.fetchone()
-        if not user_data:
-            bot.send_message(message.chat.id, "❌ Пользователь не найден.")
-            return
+class ErrorCounter(logging.Handler):
+    """Counts error and critical log records"""
 
-        # Prepare rank text
-        rank = get_user_rank(username)  # Get actual rank with hierarchy
-        rank_text = RANK_TEXT.get(rank, '👤 Пользователь')
+    def emit(self, record: logging.LogRecord):
+        metrics.inc('nsl_errors_total', level=record.levelname.lower())
 
-        # Prepare banned status
-        banned_status = "✅ Нет" if not user_data['banned'] else "❌ Да"
-        response = (
-            "👤 Информация о пользователе\n\n"
-            f"📧 Username: @{username}\n"
-            f"👨‍💼 Ранг: {rank_text}\n"
-            f"🆔 ID: {user_data['user_id']}\n"
-            f"📛 Имя: {user_data['first_name']}"
-        )
-        # Prepare response based on rank
-        if not rank in ['gadmin', 'operator']:
-            max_warn = int(os.getenv('MAX_WARN', 3))
-            response += (
-                f"\n📊 Ограничения: {banned_status}\n"
-                f"💢 Предупреждения: {user_data['warns']}/{max_warn}"
-            )
 
-        bot.send_message(message.chat.id, response)
+logger.addHandler(ErrorCounter(logging.ERROR))
 
-    except Exception as e:
-        logger.error(f"Error in /me command for @{username}: {e}")
-        bot.send_message(message.chat.id, "❌ Ошибка получения информации.")
-    finally:
-        conn.close()
 
+class UpdateDispatcher:
+    """Bounded worker pool running tasks in submission order per key"""
 
-@bot.message_handler(func=lambda message: message.text == "🔄 Обновить")
-def handle_refresh(message: Message):
-    """Handle refresh button"""
-    username = message.from_user.username
-    user_id = message.from_user.id
+    def __init__(self, workers: int, max_pending: int):
+        self.max_pending = max_pending
+        self.latency = LatencyHistogram()
+        self.rejected = 0
+        self._lanes: Dict[object, Deque] = {}
+        self._ready: 'queue.Queue' = queue.Queue()
+        self._pending = 0
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
 
-    logger.info(f"Received refresh from @{username} (ID: {user_id})")
+    def submit(self, key, task, *args) -> bool:
+        """Queue task behind earlier tasks with the same key, False when full"""
+        with self._lock:
+            if not self._threads:
+                # Workers start with the first update, not on import
+                self._threads = [
+                    threading.Thread(target=self._work, name=f'handler-{i}', daemon=True)
+                    for i in range(self.workers)
+                ]
+                for thread in self._threads:
+                    thread.start()
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                return False
+            self._pending += 1
+            lane = self._lanes.get(key)
+            if lane is None:
+                # Key has no running task: make it available to a worker
+                self._lanes[key] = deque([(task, args)])
+                self._ready.put(key)
+            else:
+                lane.append((task, args))
+            return True
 
-    # Check if user is allowed
-    if not is_user_allowed(username, user_id):
-        bot.send_message(
-            message.chat.id,
-            "❌ У вас нет доступа к этому боту.",
-            reply_markup=ReplyKeyboardRemove()
-        )
-        return
+    def _work(self):
+        while True:
+            key = self._ready.get()
+            if key is None:
+                return
+            with self._lock:
+                task, args = self._lanes[key][0]
 
-    user_bots = get_user_bots(username)
-    if not user_bots:
-        bot.send_message(
-            message.chat.id,
-            "🔄 Список обновлен!\n\n"
-            "❌ У вас по-прежнему нет доступа ни к одному боту.\n"
-            "Обратитесь к оператору системы для получения прав доступа.",
-            reply_markup=create_main_keyboard(username)
-        )
-    else:
-        bot.send_message(
-            message.chat.id,
-            "🔄 Список ботов обновлен!",
-            reply_markup=create_main_keyboard(username)
-        )
+            started = time.perf_counter()
+            try:
+                task(*args)
+            except Exception as e:
+                logger.error(f"Unhandled error in handler: {e}", exc_info=True)
+            self.latency.observe(time.perf_counter() - started)
 
+            with self._lock:
+                lane = self._lanes[key]
+                lane.popleft()
+                self._pending -= 1
+                if lane:
+                    self._ready.put(key)
+                else:
+                    del self._lanes[key]
 
-@bot.message_handler(func=lambda message: message.text.startswith("📊 "))
-def handle_bot_selection(message: Message):
-    """Handle bot selection from keyboard"""
-    username = message.from_user.username
-    user_id = message.from_user.id
+    def depth(self) -> int:
+        """Get number of queued and running tasks"""
+        return self._pending
 
-    # Extract bot name from button text
-    bot_name = message.text[2:]  # Remove "📊 " prefix
+    def shutdown(self, timeout: float = 10):
+        """Let queued tasks finish and stop the workers"""
+        deadline = time.monotonic() + timeout
+        while self._pending and time.monotonic() < deadline:
+            time.sleep(0.05)
+        for _ in self._threads:
+            self._ready.put(None)
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0))
 
-    logger.info(f"User @{username} selected bot {bot_name}")
 
-    # Check if user has access to this bot
-    user_bots = get_user_bots(username)
-    if bot_name not in user_bots:
-        logger.warning(f"User @{username} tried to access unauthorized bot {bot_name}")
-        bot.send_message(
-            message.chat.id,
-            f"❌ У вас нет доступа к логам бота {bot_name}."
-        )
-        return
+class IOPool:
+    """Thread pool for heavy I/O that refuses work instead of queueing without limit"""
 
-    # Send bot options
-    bot.send_message(
-        message.chat.id,
-        f"🤖 Выбран бот: {bot_name}\n\n"
-        "Выберите действие:",
-        reply_markup=create_bot_keyboard(bot_name)
-    )
+    def __init__(self, workers: int, max_pending: int):
+        self.latency = LatencyHistogram()
+        self.rejected = 0
+        self.workers = workers
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        self._pending = 0
+        self._lock = threading.Lock()
 
+    def submit(self, task, *args) -> bool:
+        """Run task on the pool, False when the pool is full"""
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            return False
+        with self._lock:
+            self._pending += 1
+            if self._executor is None:
+                # Created on first use, most sessions never download or search
+                from concurrent.futures import ThreadPoolExecutor
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='io')
+        self._executor.submit(self._run, task, args)
+        return True
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('log_'))
-def handle_log_callback(call):
-    """Handle log view callback"""
-    username = call.from_user.username
-    user_id = call.from_user.id
+    def _run(self, task, args):
+        started = time.perf_counter()
+        try:
+            task(*args)
+        except Exception as e:
+            logger.error(f"Unhandled error in I/O task: {e}", exc_info=True)
+        finally:
+            self.latency.observe(time.perf_counter() - started)
+            with self._lock:
+                self._pending -= 1
+            self._slots.release()
 
-    # Parse callback data
-    _, bot_name, num_lines_str = call.data.split('_')
-    num_lines = int(num_lines_str)
+    def depth(self) -> int:
+        """Get number of queued and running tasks"""
+        return self._pending
 
-    logger.info(f"User @{username} requested {num_lines} lines from {bot_name}")
+    def shutdown(self):
+        """Wait for running tasks and stop the pool"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
 
-    # Check if user has access to this bot
-    user_bots = get_user_bots(username)
-    if bot_name not in user_bots:
-        logger.warning(f"User @{username} tried to access unauthorized bot {bot_name}")
-        bot.answer_callback_query(call.id, "❌ У вас нет доступа к этому боту.")
-        return
 
-    # Get log lines
-    log_content = get_log_lines(bot_name, num_lines)
+def get_update_user_id(update: telebot.types.Update) -> Optional[int]:
+    """Get id of the user who sent an update"""
+    event = update.message or update.callback_query or update.edited_message
+    if event is not None and event.from_user is not None:
+        return event.from_user.id
+    return None
 
-    if not log_content:
-        bot.answer_callback_query(
-            call.id,
-            f"❌ Не удалось получить логи бота {bot_name}. Файл не найден или пуст."
+
+def timed_handler(handler: Callable) -> Callable:
+    """Wrap a handler recording its duration and errors under its name"""
+    name = getattr(handler, '__name__', 'handler')
+    histogram = handler_seconds[name]
+
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return handler(*args, **kwargs)
+        except Exception:
+            metrics.inc('nsl_handler_errors_total', handler=name)
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - started)
+    wrapper.__name__ = name
+    wrapper.__doc__ = handler.__doc__
+    return wrapper
+
+
+class DispatchingBot:
+    """TeleBot mixin running handlers on the update dispatcher, in order per user"""
+
+    def _build_handler_dict(self, handler, pass_bot=False, **filters):
+        # Handlers registered with the decorators; callbacks are timed by action in handle_callback
+        if handler.__name__ != 'handle_callback':
+            handler = timed_handler(handler)
+        return super()._build_handler_dict(handler, pass_bot, **filters)
+
+    def _exec_task(self, task, *args, **kwargs):
+        # Next step handlers and middlewares run through here, decorated handlers inside the runner
+        if task != self._run_middlewares_and_handler:
+            task = timed_handler(task)
+        super()._exec_task(task, *args, **kwargs)
+
+    def get_updates(self, offset=None, *args, **kwargs) -> List[telebot.types.Update]:
+        # The offset is shared through the database and moved on before the updates are
+        # handled, so after a failover or restart received updates are not handled again
+        stored = load_update_offset()
+        if stored is not None and (offset is None or 0 <= offset < stored):
+            offset = stored
+        updates = super().get_updates(offset, *args, **kwargs)
+        if updates:
+            save_update_offset(updates[-1].update_id + 1)
+        return updates
+
+    def process_new_updates(self, updates: List[telebot.types.Update]):
+        process = super().process_new_updates
+        for update in updates:
+            # Polling takes the next offset from last_update_id, so it has
+            # to move on before the update is actually handled
+            if update.update_id > self.last_update_id:
+                self.last_update_id = update.update_id
+
+            user_id = get_update_user_id(update)
+            key = user_id if user_id is not None else ('update', update.update_id)
+            if not update_dispatcher.submit(key, process, [update]):
+                logger.warning(f"Handler queue is full ({update_dispatcher.depth()}), rejected update from {user_id}")
+                reject_update(update)
+
+
+def reject_update(update: telebot.types.Update):
+    """Tell the user the bot is busy"""
+    try:
+        if update.callback_query:
+            bot.answer_callback_query(update.callback_query.id, BUSY_TEXT)
+        elif update.message:
+            bot.send_message(update.message.chat.id, BUSY_TEXT)
+    except Exception as e:
+        logger.error(f"Error sending busy reply: {e}")
+
+
+update_dispatcher = UpdateDispatcher(HANDLER_WORKERS, HANDLER_QUEUE_SIZE)
+io_pool = IOPool(IO_WORKERS, IO_QUEUE_SIZE)
+metrics.register('nsl_update_seconds', update_dispatcher.latency)
+metrics.register('nsl_io_task_seconds', io_pool.latency)
+metrics.add_collector(lambda: [
+    ('gauge', 'nsl_queue_depth', {'pool': 'handlers'}, update_dispatcher.depth()),
+    ('gauge', 'nsl_queue_depth', {'pool': 'io'}, io_pool.depth()),
+    ('counter', 'nsl_queue_rejected_total', {'pool': 'handlers'}, update_dispatcher.rejected),
+    ('counter', 'nsl_queue_rejected_total', {'pool': 'io'}, io_pool.rejected),
+])
+
+# Handlers added to the bot when it is created: (decorator name, filters, handler)
+BOT_HANDLERS: List[Tuple[str, dict, Callable]] = []
+# Created by get_bot()
+bot: telebot.TeleBot
+_bot_lock = threading.Lock()
+
+
+def message_handler(**filters):
+    """Register a message handler of the bot"""
+    def decorator(func):
+        BOT_HANDLERS.append(('message_handler', filters, func))
+        return func
+    return decorator
+
+
+def callback_query_handler(**filters):
+    """Register a callback query handler of the bot"""
+    def decorator(func):
+        BOT_HANDLERS.append(('callback_query_handler', filters, func))
+        return func
+    return decorator
+
+
+def get_bot() -> telebot.TeleBot:
+    """Create the bot with its handlers on first use, importing telebot"""
+    global bot
+    with _bot_lock:
+        if 'bot' not in globals():
+            import telebot
+
+            # Handlers run on update_dispatcher, not on telebot's own pool
+            bot_class = type('DispatchingTeleBot', (DispatchingBot, telebot.TeleBot), {})
+            new_bot = bot_class(TOKEN, threaded=False)
+            for decorator, filters, handler in BOT_HANDLERS:
+                getattr(new_bot, decorator)(**filters)(handler)
+            bot = new_bot
+    return bot
+
+
+def __getattr__(name: str):
+    # nsl.bot from outside the module creates the bot like setup() does
+    if name == 'bot':
+        return get_bot()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+_db_local = threading.local()
+_db_connections: List[sqlite3.Connection] = []
+_db_generation = 0
+_db_lock = threading.Lock()
+
+
+def get_db_connection() -> sqlite3.Connection:
+    """Get SQLite database connection of the current thread"""
+    conn = getattr(_db_local, 'conn', None)
+    # A connection from before close_db_connections() is closed already
+    if conn is not None and _db_local.generation == _db_generation:
+        return conn
+
+    # Connections are only used by the thread that opened them, but may be
+    # closed from the main thread on shutdown
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=256)
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA journal_mode={DB_JOURNAL_MODE}")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT}")
+
+    with _db_lock:
+        _db_local.conn = conn
+        _db_local.generation = _db_generation
+        _db_connections.append(conn)
+    return conn
+
+
+def close_db_connections():
+    """Close all connections opened by worker threads"""
+    global _db_generation
+    with _db_lock:
+        connections = list(_db_connections)
+        _db_connections.clear()
+        _db_generation += 1
+    for conn in connections:
+        try:
+            conn.close()
+        except Exception as e:
+            logger.error(f"Error closing database connection: {e}")
+
+
+def close_thread_db_connection():
+    """Close the connection of the current thread, for threads that end after serving a request"""
+    conn = getattr(_db_local, 'conn', None)
+    if conn is None:
+        return
+    _db_local.conn = None
+    with _db_lock:
+        if conn in _db_connections:
+            _db_connections.remove(conn)
+    conn.close()
+
+
+atexit.register(close_db_connections)
+
+
+# Schema migrations, applied in order. PRAGMA user_version stores how many
+# of them have been applied, so existing databases are upgraded in place
+SCHEMA_MIGRATIONS = [
+    # 1: base tables (same structure as in the documentation)
+    '''
+        CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            first_name TEXT NOT NULL,
+            rank TEXT NOT NULL DEFAULT 'user',
+            banned BOOLEAN NOT NULL DEFAULT FALSE,
+            warns INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS bots (
+            name TEXT PRIMARY KEY,
+            exe_path TEXT NOT NULL,
+            username TEXT NOT NULL,
+            state BOOLEAN NOT NULL DEFAULT FALSE,
+            type TEXT NOT NULL DEFAULT 'Standard',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS bot_ladmins (
+            bot_name TEXT NOT NULL,
+            username TEXT NOT NULL,
+            PRIMARY KEY (bot_name, username),
+            FOREIGN KEY (bot_name) REFERENCES bots (name) ON DELETE CASCADE,
+            FOREIGN KEY (username) REFERENCES users (username) ON DELETE CASCADE
+        );
+
+        CREATE TABLE IF NOT EXISTS global_admins (
+            username TEXT PRIMARY KEY,
+            FOREIGN KEY (username) REFERENCES users (username) ON DELETE CASCADE
+        );
+
+        CREATE TABLE IF NOT EXISTS operators (
+            username TEXT PRIMARY KEY,
+            FOREIGN KEY (username) REFERENCES users (username) ON DELETE CASCADE
+        );
+
+        CREATE TABLE IF NOT EXISTS bans (
+            username TEXT PRIMARY KEY,
+            banned_by TEXT NOT NULL,
+            banned_at INTEGER NOT NULL,
+            ban_time INTEGER NOT NULL DEFAULT 0,
+            reason TEXT,
+            FOREIGN KEY (username) REFERENCES users (username) ON DELETE CASCADE
+        );
+
+        CREATE TABLE IF NOT EXISTS auth_codes (
+            code TEXT PRIMARY KEY,
+            username TEXT NOT NULL,
+            created_at INTEGER NOT NULL,
+            used BOOLEAN NOT NULL DEFAULT FALSE,
+            FOREIGN KEY (username) REFERENCES users (username) ON DELETE CASCADE
+        );
+    ''',
+
+    # 2: indexes for ladmin lookups by username and for ban/auth code housekeeping
+    '''
+        CREATE INDEX IF NOT EXISTS idx_bot_ladmins_username ON bot_ladmins (username, bot_name);
+        CREATE INDEX IF NOT EXISTS idx_bans_banned_at ON bans (banned_at);
+        CREATE INDEX IF NOT EXISTS idx_auth_codes_username ON auth_codes (username, used);
+    ''',
+
+    # 3: per-bot log backend ('file', 'shards' or 'ring') and its target
+    # (directory of shards for 'shards', unused otherwise)
+    '''
+        ALTER TABLE bots ADD COLUMN log_backend TEXT NOT NULL DEFAULT 'file';
+        ALTER TABLE bots ADD COLUMN log_target TEXT;
+    ''',
+
+    # 4: users receiving anomaly alerts for the bots they have access to
+    '''
+        CREATE TABLE IF NOT EXISTS alert_subscriptions (
+            username TEXT PRIMARY KEY,
+            created_at INTEGER NOT NULL,
+            FOREIGN KEY (username) REFERENCES users (username) ON DELETE CASCADE
+        );
+    ''',
+
+    # 5: instances sharing the database, the bots whose logs each one holds
+    # and the lease of the instance receiving updates
+    '''
+        CREATE TABLE IF NOT EXISTS cluster_nodes (
+            name TEXT PRIMARY KEY,
+            rpc_address TEXT NOT NULL,
+            seen_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS cluster_bots (
+            node TEXT NOT NULL,
+            bot_name TEXT NOT NULL,
+            PRIMARY KEY (node, bot_name),
+            FOREIGN KEY (node) REFERENCES cluster_nodes (name) ON DELETE CASCADE
+        );
+        CREATE TABLE IF NOT EXISTS cluster_lease (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            node TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        );
+    ''',
+
+    # 6: offset of the next update to poll, so the instance polling after a
+    # failover or restart does not handle received updates again
+    '''
+        CREATE TABLE IF NOT EXISTS cluster_offset (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            next_update_id INTEGER NOT NULL
+        );
+    ''',
+]
+
+
+def init_database():
+    """Initialize database and apply pending schema migrations"""
+    conn = get_db_connection()
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= len(SCHEMA_MIGRATIONS):
+        logger.info("Database already initialized")
+        return
+
+    for number, migration in enumerate(SCHEMA_MIGRATIONS[version:], start=version + 1):
+        logger.info(f"Applying database migration {number}...")
+        try:
+            conn.executescript(f"BEGIN;\n{migration}\nPRAGMA user_version = {number};\nCOMMIT;")
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error applying database migration {number}: {e}")
+            raise
+
+    logger.info("Database initialized successfully")
+
+
+# Registry of all statements used at runtime. sqlite3 keeps compiled
+# statements in a per-connection cache keyed by SQL text, so running them
+# through db_execute() compiles each one once per connection and reuses it
+STATEMENTS = {
+    # First row carries the user's rank, following rows list accessible bots
+    'user_access': '''
+        WITH access AS (
+            SELECT CASE
+                       WHEN EXISTS (SELECT 1 FROM operators WHERE username = :username) THEN 'operator'
+                       WHEN EXISTS (SELECT 1 FROM global_admins WHERE username = :username) THEN 'gadmin'
+                       ELSE COALESCE(u.rank, 'none')
+                   END AS rank,
+                   u.rank AS user_rank,
+                   u.banned AS banned
+            FROM (SELECT :username AS username) q
+            LEFT JOIN users u ON u.username = q.username
+        )
+        SELECT a.rank, a.user_rank, a.banned, NULL AS bot_name, 0 AS pos
+        FROM access a
+        UNION ALL
+        SELECT a.rank, a.user_rank, a.banned, b.name, b.rowid
+        FROM access a JOIN bots b
+        WHERE a.rank IN ('operator', 'gadmin')
+        UNION ALL
+        SELECT a.rank, a.user_rank, a.banned, b.name, b.rowid
+        FROM access a
+        JOIN bot_ladmins bl ON bl.username = :username
+        JOIN bots b ON b.name = bl.bot_name
+        WHERE a.rank NOT IN ('operator', 'gadmin')
+        ORDER BY pos
+    ''',
+    'user_exists': "SELECT 1 FROM users WHERE username = ?",
+    'insert_user': '''
+        INSERT INTO users (username, user_id, first_name, rank, banned, warns)
+        VALUES (?, ?, ?, 'user', FALSE, 0)
+    ''',
+    'all_bots': "SELECT name FROM bots",
+    'bot_log_backend': "SELECT log_backend, log_target FROM bots WHERE name = ?",
+    'ring_bots': "SELECT name FROM bots WHERE log_backend = 'ring'",
+    'bot_backends': "SELECT name, log_backend, log_target FROM bots",
+    'node_heartbeat': '''
+        INSERT INTO cluster_nodes (name, rpc_address, seen_at) VALUES (?, ?, ?)
+        ON CONFLICT (name) DO UPDATE SET rpc_address = excluded.rpc_address, seen_at = excluded.seen_at
+    ''',
+    'clear_node_bots': "DELETE FROM cluster_bots WHERE node = ?",
+    'add_node_bot': "INSERT OR IGNORE INTO cluster_bots (node, bot_name) VALUES (?, ?)",
+    'live_bot_nodes': '''
+        SELECT b.bot_name, n.name, n.rpc_address
+        FROM cluster_bots b JOIN cluster_nodes n ON n.name = b.node
+        WHERE n.seen_at >= ?
+        ORDER BY n.seen_at
+    ''',
+    # Taken over only when free, expired or already ours; params (node, expires_at, now)
+    'acquire_lease': '''
+        INSERT INTO cluster_lease (id, node, expires_at) VALUES (1, ?, ?)
+        ON CONFLICT (id) DO UPDATE SET node = excluded.node, expires_at = excluded.expires_at
+        WHERE cluster_lease.node = excluded.node OR cluster_lease.expires_at < ?
+    ''',
+    'lease_holder': "SELECT node, expires_at FROM cluster_lease WHERE id = 1",
+    'release_lease': "DELETE FROM cluster_lease WHERE id = 1 AND node = ?",
+    'update_offset': "SELECT next_update_id FROM cluster_offset WHERE id = 1",
+    # Never moves back, e.g. when a node that lost the lease finishes its last poll
+    'save_update_offset': '''
+        INSERT INTO cluster_offset (id, next_update_id) VALUES (1, ?)
+        ON CONFLICT (id) DO UPDATE SET next_update_id = MAX(next_update_id, excluded.next_update_id)
+    ''',
+    'alert_subscribers': '''
+        SELECT s.username, u.user_id
+        FROM alert_subscriptions s JOIN users u ON u.username = s.username
+        WHERE NOT u.banned
+    ''',
+    'alert_subscribed': "SELECT 1 FROM alert_subscriptions WHERE username = ?",
+    'subscribe_alerts': "INSERT OR IGNORE INTO alert_subscriptions (username, created_at) VALUES (?, ?)",
+    'unsubscribe_alerts': "DELETE FROM alert_subscriptions WHERE username = ?",
+    'user_info': '''
+        SELECT user_id, first_name, rank, banned, warns
+        FROM users WHERE username = ?
+    ''',
+}
+
+
+def db_execute(name: str, params=()) -> sqlite3.Cursor:
+    """Execute a registered statement on the current thread's connection"""
+    started = time.perf_counter()
+    try:
+        return get_db_connection().execute(STATEMENTS[name], params)
+    finally:
+        db_seconds[name].observe(time.perf_counter() - started)
+
+
+def load_update_offset() -> Optional[int]:
+    """Offset of the next update to poll stored in the database, None if unknown"""
+    try:
+        row = db_execute('update_offset').fetchone()
+    except sqlite3.Error as e:
+        logger.error(f"Error loading update offset: {e}")
+        return None
+    return row[0] if row else None
+
+
+def save_update_offset(offset: int):
+    """Store the offset of the next update to poll"""
+    try:
+        db_execute('save_update_offset', (offset,))
+        get_db_connection().commit()
+    except sqlite3.Error as e:
+        get_db_connection().rollback()
+        logger.error(f"Error saving update offset: {e}")
+
+
+class UserAccess(NamedTuple):
+    """Resolved permissions of a user"""
+    rank: str                 # Effective rank with hierarchy applied
+    user_rank: Optional[str]  # Rank stored in users table, None if not registered
+    banned: bool
+    bots: Tuple[str, ...]
+
+
+# Username -> (expires, access), in expiry order
+_access_cache: 'OrderedDict[str, Tuple[float, UserAccess]]' = OrderedDict()
+_access_generation = 0
+_access_lock = threading.Lock()
+# Lookups answered from the cache and not, counted under _access_lock
+_access_counts = {'hit': 0, 'miss': 0}
+metrics.add_collector(lambda: [
+    ('counter', 'nsl_access_cache_requests_total', {'result': result}, count)
+    for result, count in _access_counts.items()
+])
+
+
+def _cached_user_access(username: str, now: float) -> Tuple[Optional[UserAccess], int]:
+    """Get cached permissions of a user and the cache generation to store fresh ones under"""
+    with _access_lock:
+        cached = _access_cache.get(username)
+        if cached and cached[0] > now:
+            _access_counts['hit'] += 1
+            return cached[1], _access_generation
+        _access_counts['miss'] += 1
+        generation = _access_generation
+    return None, generation
+
+
+def _store_user_access(username: str, rows: List[sqlite3.Row], generation: int, now: float) -> UserAccess:
+    """Build permissions from the user_access rows and cache them"""
+    access = UserAccess(
+        rank=rows[0]['rank'],
+        user_rank=rows[0]['user_rank'],
+        banned=bool(rows[0]['banned']),
+        bots=tuple(row['bot_name'] for row in rows[1:])
+    )
+
+    with _access_lock:
+        # Don't store a result that was invalidated while it was being read
+        if generation == _access_generation:
+            _access_cache[username] = (now + ACCESS_CACHE_TTL, access)
+            _access_cache.move_to_end(username)
+            while _access_cache and (len(_access_cache) > ACCESS_CACHE_SIZE
+                                     or next(iter(_access_cache.values()))[0] <= now):
+                _access_cache.popitem(last=False)
+    return access
+
+
+def resolve_user_access(username: str) -> Optional[UserAccess]:
+    """Get user's rank, ban status and accessible bots with a single query"""
+    now = time.monotonic()
+    access, generation = _cached_user_access(username, now)
+    if access is not None:
+        return access
+
+    try:
+        rows = db_execute('user_access', {'username': username}).fetchall()
+    except Exception as e:
+        logger.error(f"Error resolving access for {username}: {e}")
+        return None
+    return _store_user_access(username, rows, generation, now)
+
+
+def invalidate_user_access(username: Optional[str] = None):
+    """Drop cached permissions of a user, or of all users"""
+    global _access_generation
+    with _access_lock:
+        _access_generation += 1
+        if username is None:
+            _access_cache.clear()
+        else:
+            _access_cache.pop(username, None)
+
+
+def get_user_rank(username: str) -> str:
+    """Get user rank from database"""
+    access = resolve_user_access(username)
+    return access.rank if access else 'none'
+
+
+def get_user_bots(username: str) -> List[str]:
+    """Get list of bots that user has access to"""
+    access = resolve_user_access(username)
+    return list(access.bots) if access else []
+
+
+def is_user_allowed(username: str, user_id: int) -> bool:
+    """Check if user is allowed to use the bot"""
+    # Users without username are not allowed
+    if not username:
+        logger.warning(f"User without username (ID: {user_id}) tried to access the bot")
+        return False
+    return check_user_allowed(username, user_id, resolve_user_access(username))
+
+
+def check_user_allowed(username: str, user_id: int, access: Optional[UserAccess]) -> bool:
+    """Check resolved permissions of a user allowed to use the bot"""
+    if access is None:
+        return False
+
+    if access.user_rank is None:
+        logger.warning(f"User @{username} (ID: {user_id}) not found in system")
+        return False
+
+    if access.banned:
+        logger.warning(f"Banned user @{username} (ID: {user_id}) tried to access the bot")
+        return False
+
+    # Regular users are not allowed
+    if access.user_rank == 'user':
+        logger.warning(f"Regular user @{username} (ID: {user_id}) tried to access the bot")
+        return False
+
+    return True
+
+
+def read_tail_bytes(f, size: int, num_lines: int) -> bytes:
+    """Read raw bytes of the last N lines, seeking backwards from EOF in blocks"""
+    if size <= 0 or num_lines <= 0:
+        return b''
+
+    # Collect blocks from the end until we have seen more than N line breaks,
+    # so the first (possibly partial) line can be dropped safely
+    chunks = []
+    newlines = 0
+    pos = size
+    while pos > 0 and newlines <= num_lines:
+        read_size = min(TAIL_BLOCK_SIZE, pos)
+        pos -= read_size
+        f.seek(pos)
+        block = f.read(read_size)
+        chunks.append(block)
+        newlines += block.count(b'\n')
+    metrics.inc('nsl_log_bytes_read_total', size - pos, op='tail')
+
+    # Lines are cut on b'\n' boundaries only, so multi-byte UTF-8
+    # sequences split between blocks are rejoined before decoding
+    lines = b''.join(reversed(chunks)).split(b'\n')
+    if lines[-1] == b'':
+        # File ends with a newline: no trailing partial line
+        lines.pop()
+        tail = lines[-num_lines:]
+        return b'\n'.join(tail) + b'\n' if tail else b''
+    return b'\n'.join(lines[-num_lines:])
+
+
+def decode_log_bytes(data: bytes) -> str:
+    """Decode raw log bytes, normalizing CRLF line endings"""
+    return data.decode('utf-8', errors='replace').replace('\r\n', '\n')
+
+
+def split_log_lines(data: bytes, start: int) -> Tuple[List[Tuple[int, str]], bytes]:
+    """Split raw bytes into (offset, line) pairs and a trailing partial line"""
+    lines = []
+    pos = 0
+    while True:
+        end = data.find(b'\n', pos)
+        if end < 0:
+            return lines, data[pos:]
+        lines.append((start + pos, decode_log_bytes(data[pos:end + 1])))
+        pos = end + 1
+
+
+class TailEntry:
+    """Cached tail of a single log file"""
+
+    __slots__ = ('lock', 'inode', 'size', 'mtime', 'lines', 'pending', 'marker')
+
+    def __init__(self, max_lines: int):
+        self.lock = threading.Lock()
+        self.inode = None
+        self.size = 0
+        self.mtime = 0
+        self.lines: Deque[Tuple[int, str]] = deque(maxlen=max_lines)
+        self.pending = b''
+        self.marker = b''
+
+    def reload(self, f, st: os.stat_result):
+        """Re-read the tail of the file from scratch"""
+        raw = read_tail_bytes(f, st.st_size, self.lines.maxlen)
+        lines, self.pending = split_log_lines(raw, st.st_size - len(raw))
+        self.lines.clear()
+        self.lines.extend(lines)
+        self._update(st, raw)
+
+    def append(self, f, st: os.stat_result) -> bool:
+        """Read only the bytes appended since the last refresh"""
+        # The last bytes read before must still be in place, otherwise the
+        # file was truncated and rewritten past the old size in between
+        f.seek(self.size - len(self.marker))
+        if f.read(len(self.marker)) != self.marker:
+            return False
+        data = self.pending + f.read(st.st_size - self.size)
+        metrics.inc('nsl_log_bytes_read_total', st.st_size - self.size, op='tail')
+        lines, self.pending = split_log_lines(data, self.size - len(self.pending))
+        self.lines.extend(lines)
+        self._update(st, data)
+        return True
+
+    def extend(self, data: bytes, st: os.stat_result):
+        """Add bytes just written at the end of the file without reading them back"""
+        data = self.pending + data
+        lines, self.pending = split_log_lines(data, self.size - len(self.pending))
+        self.lines.extend(lines)
+        self._update(st, data)
+
+    def _update(self, st: os.stat_result, data: bytes):
+        self.inode = st.st_ino
+        self.size = st.st_size
+        self.mtime = st.st_mtime_ns
+        self.marker = data[-64:]
+
+    def tail(self, num_lines: int) -> 'TailSnapshot':
+        """Get last N cached lines, including a trailing partial line"""
+        lines = list(self.lines)
+        if self.pending:
+            lines.append((self.size - len(self.pending), decode_log_bytes(self.pending)))
+        return TailSnapshot(self.inode, self.size, lines[-num_lines:])
+
+
+class TailSnapshot(NamedTuple):
+    """Last lines of a log file with their byte offsets"""
+    inode: int
+    end: int                      # Offset right after the last line
+    lines: List[Tuple[int, str]]  # (offset, line) pairs
+
+
+class TailCache:
+    """LRU cache of log file tails refreshed from appended bytes"""
+
+    def __init__(self, max_files: int, max_lines: int):
+        self.max_files = max_files
+        self.max_lines = max_lines
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[str, TailEntry]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry(self, path: str) -> TailEntry:
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                entry = self._entries[path] = TailEntry(self.max_lines)
+                while len(self._entries) > self.max_files:
+                    self._entries.popitem(last=False)
+            else:
+                self._entries.move_to_end(path)
+            return entry
+
+    def get_lines(self, path: str, num_lines: int) -> List[str]:
+        """Get last N lines of a file, re-reading as little as possible"""
+        return [line for _, line in self.get_tail(path, num_lines).lines]
+
+    @metrics.timed('nsl_log_read_seconds', op='tail')
+    def get_tail(self, path: str, num_lines: int) -> TailSnapshot:
+        """Get last N lines of a file with their offsets"""
+        if num_lines > self.max_lines:
+            # Too many lines to keep cached, read directly
+            self.misses += 1
+            with open(path, 'rb') as f:
+                st = os.fstat(f.fileno())
+                raw = read_tail_bytes(f, st.st_size, num_lines)
+            lines, pending = split_log_lines(raw, st.st_size - len(raw))
+            if pending:
+                lines.append((st.st_size - len(pending), decode_log_bytes(pending)))
+            return TailSnapshot(st.st_ino, st.st_size, lines)
+
+        st = os.stat(path)
+        entry = self._entry(path)
+        with entry.lock:
+            if (entry.inode == st.st_ino and entry.size == st.st_size
+                    and entry.mtime == st.st_mtime_ns):
+                self.hits += 1
+                return entry.tail(num_lines)
+
+            with open(path, 'rb') as f:
+                # Same file that only grew: replay the appended bytes,
+                # otherwise it was rotated, truncated or rewritten
+                if (entry.inode == st.st_ino and entry.size < st.st_size
+                        and st.st_size - entry.size <= TAIL_CACHE_MAX_APPEND
+                        and entry.append(f, st)):
+                    self.hits += 1
+                else:
+                    self.misses += 1
+                    entry.reload(f, st)
+            return entry.tail(num_lines)
+
+    def feed(self, path: str, offset: int, data: bytes, st: os.stat_result):
+        """Extend a cached tail with bytes written at offset, if nothing else changed the file"""
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is None:
+            return
+        with entry.lock:
+            if (entry.inode == st.st_ino and entry.size == offset
+                    and st.st_size == offset + len(data)):
+                entry.extend(data, st)
+
+    def stats(self) -> Dict[str, int]:
+        """Get cache counters"""
+        return {'files': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+tail_cache = TailCache(TAIL_CACHE_FILES, TAIL_CACHE_LINES)
+metrics.add_collector(lambda: [
+    ('gauge', 'nsl_tail_cache_files', {}, len(tail_cache._entries)),
+    ('counter', 'nsl_tail_cache_requests_total', {'result': 'hit'}, tail_cache.hits),
+    ('counter', 'nsl_tail_cache_requests_total', {'result': 'miss'}, tail_cache.misses),
+])
+
+
+def get_log_path(bot_name: str) -> str:
+    """Get path of bot's log file"""
+    return os.path.join(LOGS_DIR, f"{bot_name}.log")
+
+
+def get_log_tail(bot_name: str, num_lines: int) -> Optional[TailSnapshot]:
+    """Get last N lines from bot's log file with their offsets"""
+    log_file = get_log_path(bot_name)
+
+    try:
+        if not os.path.exists(log_file):
+            logger.warning(f"Log file for bot {bot_name} not found at {log_file}")
+            return None
+
+        return tail_cache.get_tail(log_file, num_lines)
+    except Exception as e:
+        logger.error(f"Error reading log file for bot {bot_name}: {e}")
+        return None
+
+
+class FollowSession:
+    """Chat subscribed to live updates of a bot's log"""
+
+    def __init__(self, chat_id: int, username: str, bot_name: str):
+        self.chat_id = chat_id
+        self.username = username
+        self.bot_name = bot_name
+        self.message_id: Optional[int] = None
+        self.lines: Deque[str] = deque(maxlen=FOLLOW_WINDOW_LINES)
+        self.dirty = False
+        self.started = time.monotonic()
+        self.last_update = self.started
+
+    def render(self) -> str:
+        """Render follow message text, keeping the newest lines that fit"""
+        header = f"▶️ Логи бота {html.escape(self.bot_name)} (в реальном времени):\n\n"
+        body = []
+        length = len(header) + len('<code></code>')
+        for line in reversed(self.lines):
+            line = html.escape(line, quote=False)
+            if length + len(line) > 4000:
+                break
+            body.append(line)
+            length += len(line)
+        if not body:
+            return header + "<i>Ожидание новых записей...</i>"
+        return header + f"<code>{''.join(reversed(body))}</code>"
+
+
+class FollowWatch:
+    """Single watcher of a log file shared by all its follow sessions"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.inode = None
+        self.offset = 0
+        self.pending = b''
+        self.sessions: List[FollowSession] = []
+
+    def poll(self) -> List[str]:
+        """Read lines appended since the last poll"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return []
+
+        if self.inode is None:
+            # New watch: start from the current end of the file
+            self.inode, self.offset = st.st_ino, st.st_size
+            return []
+        if st.st_ino != self.inode or st.st_size < self.offset:
+            # Rotated or truncated: follow the new file from its start
+            self.inode, self.offset, self.pending = st.st_ino, 0, b''
+        if st.st_size == self.offset:
+            return []
+
+        with open(self.path, 'rb') as f:
+            start = max(self.offset, st.st_size - FOLLOW_MAX_READ)
+            if start != self.offset:
+                self.pending = b''
+            f.seek(start)
+            data = self.pending + f.read(st.st_size - start)
+        self.offset = st.st_size
+        lines, self.pending = split_log_lines(data, 0)
+        return [line for _, line in lines]
+
+
+class LogFollower:
+    """Fans appended log lines out to follow sessions in batched updates"""
+
+    def __init__(self):
+        self._watches: Dict[str, FollowWatch] = {}
+        self._sessions: Dict[Tuple[int, str], FollowSession] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def subscribe(self, chat_id: int, username: str, bot_name: str) -> Optional[FollowSession]:
+        """Subscribe chat to a bot's log, None if the chat reached its cap"""
+        with self._lock:
+            key = (chat_id, bot_name)
+            if key not in self._sessions:
+                active = sum(1 for c, _ in self._sessions if c == chat_id)
+                if active >= FOLLOW_MAX_PER_CHAT:
+                    return None
+            else:
+                self._remove(key)
+
+            session = FollowSession(chat_id, username, bot_name)
+            path = get_log_path(bot_name)
+            watch = self._watches.get(path)
+            if watch is None:
+                watch = self._watches[path] = FollowWatch(path)
+            watch.sessions.append(session)
+            self._sessions[key] = session
+
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='log-follower', daemon=True)
+                self._thread.start()
+            return session
+
+    def unsubscribe(self, chat_id: int, bot_name: str) -> Optional[FollowSession]:
+        """Stop following a bot's log in a chat"""
+        with self._lock:
+            return self._remove((chat_id, bot_name))
+
+    def _remove(self, key: Tuple[int, str]) -> Optional[FollowSession]:
+        session = self._sessions.pop(key, None)
+        if session is None:
+            return None
+        path = get_log_path(session.bot_name)
+        watch = self._watches.get(path)
+        if watch is not None:
+            watch.sessions.remove(session)
+            if not watch.sessions:
+                del self._watches[path]
+        return session
+
+    def _run(self):
+        while True:
+            time.sleep(FOLLOW_INTERVAL)
+            if not self.tick():
+                return
+
+    def tick(self) -> bool:
+        """Read new lines and update or stop sessions, False once nothing is followed"""
+        with self._lock:
+            watches = list(self._watches.values())
+            if not watches:
+                self._thread = None
+                return False
+
+        # One stat and at most one read per file, whatever the number of subscribers
+        for watch in watches:
+            try:
+                lines = watch.poll()
+            except Exception as e:
+                logger.error(f"Error following log file {watch.path}: {e}")
+                continue
+            if lines:
+                with self._lock:
+                    for session in watch.sessions:
+                        session.lines.extend(lines)
+                        session.dirty = True
+
+        with self._lock:
+            sessions = list(self._sessions.values())
+        now = time.monotonic()
+        for session in sessions:
+            if session.bot_name not in get_user_bots(session.username):
+                self.unsubscribe(session.chat_id, session.bot_name)
+                stop_follow_message(session, "⏹ Слежение остановлено: доступ к боту отозван.")
+            elif (now - session.last_update > FOLLOW_IDLE_TIMEOUT
+                    or now - session.started > FOLLOW_MAX_DURATION):
+                self.unsubscribe(session.chat_id, session.bot_name)
+                stop_follow_message(session, "⏹ Слежение остановлено по таймауту.")
+            elif session.dirty and session.message_id is not None:
+                session.dirty = False
+                session.last_update = now
+                self._send(session)
+        return True
+
+    def _send(self, session: FollowSession):
+        from telebot.apihelper import ApiTelegramException
+
+        try:
+            bot.edit_message_text(
+                session.render(),
+                session.chat_id,
+                session.message_id,
+                parse_mode='HTML',
+                reply_markup=create_follow_keyboard(session.bot_name)
+            )
+        except ApiTelegramException as e:
+            if 'message is not modified' in str(e):
+                return
+            logger.error(f"Error updating follow message for {session.bot_name}: {e}")
+            self.unsubscribe(session.chat_id, session.bot_name)
+        except Exception as e:
+            logger.error(f"Error updating follow message for {session.bot_name}: {e}")
+
+
+log_follower = LogFollower()
+
+
+def stop_follow_message(session: FollowSession, note: str):
+    """Replace follow message keyboard with a final note"""
+    if session.message_id is None:
+        return
+    try:
+        bot.edit_message_text(
+            session.render() + f"\n\n{note}",
+            session.chat_id,
+            session.message_id,
+            parse_mode='HTML'
+        )
+    except Exception as e:
+        logger.error(f"Error stopping follow message for {session.bot_name}: {e}")
+
+
+def read_file_chunks(path: str) -> Iterator[bytes]:
+    """Read a file in download-sized chunks"""
+    with open(path, 'rb') as src:
+        while True:
+            chunk = src.read(DOWNLOAD_CHUNK_SIZE)
+            if not chunk:
+                return
+            metrics.inc('nsl_log_bytes_read_total', len(chunk), op='download')
+            yield chunk
+
+
+@metrics.timed('nsl_log_read_seconds', op='compress')
+def compress_log_stream(chunks: Iterator[bytes], name: str) -> Tuple[tempfile.SpooledTemporaryFile, str]:
+    """Stream-compress log data into a spooled temp file, return it and the file suffix"""
+    codec = LOG_COMPRESSION
+    if codec == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            logger.warning("zstandard is not installed, falling back to gzip")
+            codec = 'gzip'
+
+    spool = tempfile.SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_SIZE)
+    try:
+        if codec == 'zstd':
+            compressor = zstandard.ZstdCompressor(level=LOG_COMPRESSION_LEVEL)
+            with compressor.stream_writer(spool, closefd=False) as out:
+                for chunk in chunks:
+                    out.write(chunk)
+            suffix = '.zst'
+        elif codec == 'gzip':
+            with gzip.GzipFile(filename=name, mode='wb', fileobj=spool,
+                               compresslevel=LOG_COMPRESSION_LEVEL) as out:
+                for chunk in chunks:
+                    out.write(chunk)
+            suffix = '.gz'
+        else:
+            for chunk in chunks:
+                spool.write(chunk)
+            suffix = ''
+    except Exception:
+        spool.close()
+        raise
+
+    spool.seek(0)
+    return spool, suffix
+
+
+def compress_log_file(path: str) -> Tuple[tempfile.SpooledTemporaryFile, str]:
+    """Stream-compress a log file into a spooled temp file, return it and the file suffix"""
+    return compress_log_stream(read_file_chunks(path), os.path.basename(path))
+
+
+class FilePart(io.RawIOBase):
+    """Read-only view of a byte range of a file, so a part is uploaded without copying it first"""
+
+    def __init__(self, f, start: int, size: int):
+        super().__init__()
+        self._file = f
+        self._pos = start
+        self._end = start + size
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        remaining = self._end - self._pos
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        if size <= 0:
+            return b''
+        self._file.seek(self._pos)
+        data = self._file.read(size)
+        self._pos += len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def send_spool(chat_id: int, spool, file_name: str, caption: str) -> List[Tuple[str, str]]:
+    """Send a spooled file, split into parts over the upload limit; return (file_id, caption) of each part"""
+    documents = []
+    size = spool.seek(0, os.SEEK_END)
+    spool.seek(0)
+    metrics.inc('nsl_bytes_sent_total', size)
+
+    if size <= TELEGRAM_UPLOAD_LIMIT:
+        message = bot.send_document(chat_id, spool, caption=caption, visible_file_name=file_name)
+        documents.append((message.document.file_id, caption))
+        return documents
+
+    parts = -(-size // TELEGRAM_UPLOAD_LIMIT)
+    for part in range(1, parts + 1):
+        part_caption = f"{caption} (часть {part}/{parts})"
+        if part == 1:
+            part_caption += f"\nСоберите файл командой: cat {file_name}.* > {file_name}"
+        start = (part - 1) * TELEGRAM_UPLOAD_LIMIT
+        message = bot.send_document(
+            chat_id,
+            FilePart(spool, start, min(TELEGRAM_UPLOAD_LIMIT, size - start)),
+            caption=part_caption,
+            visible_file_name=f"{file_name}.{part:03d}"
+        )
+        documents.append((message.document.file_id, part_caption))
+    return documents
+
+
+def send_log_file(chat_id: int, bot_name: str, path: str) -> List[Tuple[str, str]]:
+    """Send compressed log file, split into parts over the upload limit; return (file_id, caption) of each part"""
+    started = time.monotonic()
+    spool, suffix = compress_log_file(path)
+    with spool:
+        size = spool.seek(0, os.SEEK_END)
+        documents = send_spool(chat_id, spool, f"{bot_name}.log{suffix}", f"📁 Логи бота {bot_name}")
+
+    logger.info(
+        f"Sent logs of {bot_name}: {os.path.getsize(path)} bytes compressed to {size} bytes "
+        f"in {time.monotonic() - started:.2f}s"
+    )
+    return documents
+
+
+# Standard log record prefix: "%(asctime)s - %(name)s - %(levelname)s - "
+LOG_TIMESTAMP_RE = re.compile(r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),\d{3} - ')
+LOG_RECORD_RE = re.compile(r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}):\d{2},\d{3} - (.+?) - ([A-Z]+) - ')
+LOG_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+DURATION_RE = re.compile(r'^(\d+)([smhd])$')
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_log_timestamp(line: str) -> Optional[float]:
+    """Parse asctime at the start of a log line into a UNIX timestamp"""
+    match = LOG_TIMESTAMP_RE.match(line)
+    if not match:
+        return None
+    try:
+        return time.mktime(time.strptime(match.group(1), LOG_TIMESTAMP_FORMAT))
+    except ValueError:
+        return None
+
+
+def parse_duration(text: str) -> Optional[int]:
+    """Parse duration like 15m, 2h or 1d into seconds"""
+    match = DURATION_RE.match(text.lower())
+    if not match:
+        return None
+    return int(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+
+# Rotated segments of a bot's log: bot.log.1, bot.log.2.gz (higher number is
+# older) and dated bot.log-20240131 / bot.log.2024-01-31, optionally gzipped
+ROTATED_SUFFIX_RE = re.compile(r'^(?:[.-](\d{4}-?\d{2}-?\d{2}|\d+))?(\.gz)?$')
+LOG_TIMESTAMP_BYTES_RE = re.compile(rb'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3} - ')
+# Lines read from the start and the end of a segment to find its time span
+SEGMENT_PROBE_LINES = 200
+
+
+class LogSegment(NamedTuple):
+    """One file of a bot's log with the time span of its records"""
+    path: str
+    compressed: bool
+    size: int
+    first: Optional[float]  # Timestamp of the first record, None if unknown
+    last: Optional[float]   # Timestamp of the last record, None if unknown
+
+
+# Segment metadata by path, valid while (inode, size, mtime_ns) is unchanged
+_segment_info: Dict[str, Tuple[Tuple[int, int, int], LogSegment]] = {}
+_segment_info_lock = threading.Lock()
+
+
+def open_log_segment(path: str):
+    """Open a log segment for binary reading, decompressing .gz as a stream"""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def _line_timestamp(line: bytes) -> Optional[float]:
+    """Timestamp of a raw log line, None for continuation lines"""
+    if not LOG_TIMESTAMP_BYTES_RE.match(line):
+        return None
+    return parse_log_timestamp(line[:26].decode('ascii'))
+
+
+def _segment_span(path: str, compressed: bool, size: int) -> Tuple[Optional[float], Optional[float]]:
+    """Find timestamps of the first and the last record of a segment"""
+    first = last = None
+    with open_log_segment(path) as f:
+        for i, line in enumerate(f):
+            if i >= SEGMENT_PROBE_LINES:
+                break
+            first = _line_timestamp(line)
+            if first is not None:
+                break
+
+        if compressed:
+            # Archives can only be read forwards, remember the last record line
+            candidate = None
+            for line in f:
+                if line[:1].isdigit():
+                    candidate = line
+            last = _line_timestamp(candidate) if candidate else None
+        else:
+            for line in reversed(read_tail_bytes(f, size, SEGMENT_PROBE_LINES).split(b'\n')):
+                last = _line_timestamp(line)
+                if last is not None:
+                    break
+    return first, last if last is not None else first
+
+
+def get_log_segment(path: str) -> Optional[LogSegment]:
+    """Get segment metadata, computing the time span only when the file changed"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    version = (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    with _segment_info_lock:
+        cached = _segment_info.get(path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    compressed = path.endswith('.gz')
+    try:
+        first, last = _segment_span(path, compressed, st.st_size)
+    except (OSError, EOFError) as e:
+        logger.error(f"Error reading log segment {path}: {e}")
+        first = last = None
+    segment = LogSegment(path, compressed, st.st_size, first, last)
+    with _segment_info_lock:
+        _segment_info[path] = (version, segment)
+    return segment
+
+
+class LogSource:
+    """A bot's log: the current file and its rotated segments"""
+
+    def __init__(self, bot_name: str):
+        self.bot_name = bot_name
+        self.path = get_log_path(bot_name)
+
+    def segment_paths(self) -> List[str]:
+        """Paths of all segments, oldest first, the current file last"""
+        prefix = os.path.basename(self.path)
+        found = []
+        try:
+            with os.scandir(LOGS_DIR) as entries:
+                for entry in entries:
+                    if not entry.name.startswith(prefix):
+                        continue
+                    match = ROTATED_SUFFIX_RE.match(entry.name[len(prefix):])
+                    if not match or not entry.is_file():
+                        continue
+                    suffix = match.group(1)
+                    if suffix is None:
+                        order = (2, 0)
+                    elif len(suffix) >= 8:
+                        order = (0, int(suffix.replace('-', '')))
+                    else:
+                        order = (1, -int(suffix))
+                    found.append((order, entry.path))
+        except FileNotFoundError:
+            return []
+        return [path for _, path in sorted(found)]
+
+    def rotated_segments(self) -> List[LogSegment]:
+        """Metadata of rotated segments, oldest first"""
+        segments = (get_log_segment(path) for path in self.segment_paths() if path != self.path)
+        return [segment for segment in segments if segment is not None]
+
+    def rotated_tail(self, num_lines: int) -> List[str]:
+        """Last N lines stored in rotated segments, before the current file"""
+        lines: List[str] = []
+        for segment in reversed(self.rotated_segments()):
+            need = num_lines - len(lines)
+            if need <= 0:
+                break
+            try:
+                with open_log_segment(segment.path) as f:
+                    if segment.compressed:
+                        raw = b''.join(deque(f, maxlen=need))
+                    else:
+                        raw = read_tail_bytes(f, segment.size, need)
+            except (OSError, EOFError) as e:
+                logger.error(f"Error reading log segment {segment.path}: {e}")
+                continue
+            lines[:0] = decode_log_bytes(raw).splitlines()[-need:]
+        return lines
+
+    def iter_range(self, start: float, end: float) -> Iterator[bytes]:
+        """Raw lines of records written between start and end, across segments"""
+        start_key, end_key = range_keys(start, end)
+
+        for path in self.segment_paths():
+            segment = get_log_segment(path)
+            if segment is None:
+                continue
+            if segment.first is not None and segment.first > end:
+                return
+            if segment.last is not None and segment.last < start:
+                continue
+
+            inside = False
+            try:
+                with open_log_segment(path) as f:
+                    for line in f:
+                        if LOG_TIMESTAMP_BYTES_RE.match(line):
+                            key = line[:23]
+                            if key > end_key:
+                                return
+                            inside = key >= start_key
+                        if inside:
+                            yield line
+            except (OSError, EOFError) as e:
+                logger.error(f"Error reading log segment {path}: {e}")
+
+    def iter_all(self) -> Iterator[bytes]:
+        """Raw lines of every segment, oldest first"""
+        for path in self.segment_paths():
+            try:
+                with open_log_segment(path) as f:
+                    yield from f
+            except (OSError, EOFError) as e:
+                logger.error(f"Error reading log segment {path}: {e}")
+
+
+def group_records(lines) -> Iterator[Tuple[bytes, bytes]]:
+    """Group raw lines into (timestamp key, record) pairs, continuation lines stay with their record"""
+    key = b''
+    record: List[bytes] = []
+    for line in lines:
+        if LOG_TIMESTAMP_BYTES_RE.match(line):
+            if record:
+                yield key, b''.join(record)
+            key, record = line[:23], [line]
+        else:
+            record.append(line)
+    if record:
+        yield key, b''.join(record)
+
+
+def range_keys(start: float, end: float) -> Tuple[bytes, bytes]:
+    """Timestamp keys bounding a period; asctime sorts like the time it encodes"""
+    return (time.strftime(LOG_TIMESTAMP_FORMAT, time.localtime(start)).encode(),
+            time.strftime(LOG_TIMESTAMP_FORMAT, time.localtime(end)).encode() + b',999')
+
+
+class LogBackend(ABC):
+    """Source of a bot's log records"""
+
+    def __init__(self, bot_name: str, target: Optional[str]):
+        self.bot_name = bot_name
+        self.target = target
+
+    @abstractmethod
+    def tail(self, num_lines: int) -> List[str]:
+        """Last N lines, oldest first"""
+
+    @abstractmethod
+    def iter_range(self, start: float, end: float) -> Iterator[bytes]:
+        """Raw bytes of records written between start and end, oldest first"""
+
+    @abstractmethod
+    def iter_all(self) -> Iterator[bytes]:
+        """Raw bytes of everything stored, lines without a timestamp included"""
+
+
+class FileLogBackend(LogBackend):
+    """Single log file in LOGS_DIR with its rotated segments"""
+
+    def tail(self, num_lines: int) -> List[str]:
+        snapshot = get_log_tail(self.bot_name, num_lines)
+        lines = [line.rstrip('\n') for _, line in snapshot.lines] if snapshot else []
+        if len(lines) < num_lines:
+            lines[:0] = LogSource(self.bot_name).rotated_tail(num_lines - len(lines))
+        return lines
+
+    def iter_range(self, start: float, end: float) -> Iterator[bytes]:
+        return LogSource(self.bot_name).iter_range(start, end)
+
+    def iter_all(self) -> Iterator[bytes]:
+        return LogSource(self.bot_name).iter_all()
+
+
+class ShardLogBackend(LogBackend):
+    """Directory of per-process log files, merged by record time"""
+
+    def shard_paths(self) -> List[str]:
+        """Paths of .log files in the shard directory"""
+        directory = os.path.join(LOGS_DIR, self.target or self.bot_name)
+        try:
+            with os.scandir(directory) as entries:
+                return sorted(e.path for e in entries if e.name.endswith('.log') and e.is_file())
+        except FileNotFoundError:
+            return []
+
+    def tail(self, num_lines: int) -> List[str]:
+        # Each shard holds at most N of the newest lines, so N per shard is enough
+        shards = []
+        for path in self.shard_paths():
+            try:
+                with open(path, 'rb') as f:
+                    raw = read_tail_bytes(f, os.fstat(f.fileno()).st_size, num_lines)
+            except OSError as e:
+                logger.error(f"Error reading log shard {path}: {e}")
+                continue
+            shards.append(list(group_records(raw.splitlines(keepends=True))))
+
+        lines: List[str] = []
+        for _, record in heapq.merge(*shards, key=lambda r: r[0]):
+            lines.extend(decode_log_bytes(record).splitlines())
+        return lines[-num_lines:]
+
+    def _shard_range(self, path: str, start_key: bytes, end_key: bytes) -> Iterator[Tuple[bytes, bytes]]:
+        """Records of one shard inside the period"""
+        try:
+            with open(path, 'rb') as f:
+                for key, record in group_records(f):
+                    if key > end_key:
+                        return
+                    if key >= start_key:
+                        yield key, record
+        except OSError as e:
+            logger.error(f"Error reading log shard {path}: {e}")
+
+    def iter_range(self, start: float, end: float) -> Iterator[bytes]:
+        start_key, end_key = range_keys(start, end)
+        shards = [self._shard_range(path, start_key, end_key) for path in self.shard_paths()]
+        for _, record in heapq.merge(*shards, key=lambda r: r[0]):
+            yield record
+
+    def iter_all(self) -> Iterator[bytes]:
+        # Keys are asctime digits, so these bounds take every record and the lines before the first one
+        shards = [self._shard_range(path, b'', b'~') for path in self.shard_paths()]
+        for _, record in heapq.merge(*shards, key=lambda r: r[0]):
+            yield record
+
+
+class RingLogBackend(LogBackend):
+    """Records pushed by the bot over the ingest socket, kept in memory only"""
+
+    def __init__(self, bot_name: str, target: Optional[str]):
+        super().__init__(bot_name, target)
+        self.lock = threading.Lock()
+        self.lines: Deque[bytes] = deque(maxlen=RING_BUFFER_LINES)
+
+    def push(self, data: bytes):
+        """Store received log lines"""
+        lines = data.splitlines(keepends=True)
+        if lines and not lines[-1].endswith(b'\n'):
+            lines[-1] += b'\n'
+        with self.lock:
+            self.lines.extend(lines)
+
+    def tail(self, num_lines: int) -> List[str]:
+        with self.lock:
+            start = max(len(self.lines) - num_lines, 0)
+            lines = list(itertools.islice(self.lines, start, None))
+        return [decode_log_bytes(line).rstrip('\n') for line in lines]
+
+    def iter_range(self, start: float, end: float) -> Iterator[bytes]:
+        start_key, end_key = range_keys(start, end)
+        with self.lock:
+            lines = list(self.lines)
+        for key, record in group_records(lines):
+            if start_key <= key <= end_key:
+                yield record
+
+    def iter_all(self) -> Iterator[bytes]:
+        with self.lock:
+            lines = list(self.lines)
+        yield from lines
+
+
+LOG_BACKENDS = {'file': FileLogBackend, 'shards': ShardLogBackend, 'ring': RingLogBackend}
+
+# Backend objects by bot name, replaced when the bot's configuration changes
+_log_backends: Dict[str, LogBackend] = {}
+_log_backends_lock = threading.Lock()
+
+
+def get_log_backend(bot_name: str) -> LogBackend:
+    """Get the log backend of a bot, reading through the node holding its logs when that is another one"""
+    address = cluster.route(bot_name)
+    if address:
+        return RemoteLogBackend(bot_name, address)
+    return get_local_log_backend(bot_name)
+
+
+def get_local_log_backend(bot_name: str) -> LogBackend:
+    """Get the log backend configured for a bot, 'file' if unknown"""
+    try:
+        row = db_execute('bot_log_backend', (bot_name,)).fetchone()
+    except sqlite3.Error as e:
+        logger.error(f"Error reading log backend of {bot_name}: {e}")
+        row = None
+    kind, target = row if row else ('file', None)
+    if kind not in LOG_BACKENDS:
+        logger.warning(f"Unknown log backend {kind!r} for bot {bot_name}, using file")
+        kind = 'file'
+
+    with _log_backends_lock:
+        backend = _log_backends.get(bot_name)
+        if type(backend) is not LOG_BACKENDS[kind] or backend.target != target:
+            backend = _log_backends[bot_name] = LOG_BACKENDS[kind](bot_name, target)
+        return backend
+
+
+class LogIngestServer:
+    """Receives log datagrams for bots with the 'ring' backend
+
+    A datagram is the bot name on the first line followed by one or more log lines.
+    """
+
+    def __init__(self):
+        self.sockets: List[socket.socket] = []
+        self.rings: Dict[str, RingLogBackend] = {}
+        self.last_refresh = 0.0
+
+    def start(self):
+        """Open configured sockets and start receiver threads"""
+        if LOG_INGEST_UDP:
+            host, _, port = LOG_INGEST_UDP.rpartition(':')
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((host or '127.0.0.1', int(port)))
+            self.sockets.append(sock)
+            logger.info(f"Log ingest listening on udp://{host or '127.0.0.1'}:{port}")
+        if LOG_INGEST_SOCKET:
+            if os.path.exists(LOG_INGEST_SOCKET):
+                os.unlink(LOG_INGEST_SOCKET)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(LOG_INGEST_SOCKET)
+            self.sockets.append(sock)
+            logger.info(f"Log ingest listening on {LOG_INGEST_SOCKET}")
+
+        for sock in self.sockets:
+            threading.Thread(target=self._run, args=(sock,), name='nsl-ingest', daemon=True).start()
+
+    def _ring(self, bot_name: str) -> Optional[RingLogBackend]:
+        """Ring buffer of a bot, re-reading ring bots from the database at most every 10s"""
+        ring = self.rings.get(bot_name)
+        now = time.monotonic()
+        if ring is None and now - self.last_refresh > 10:
+            self.last_refresh = now
+            try:
+                names = [row[0] for row in db_execute('ring_bots')]
+            except sqlite3.Error as e:
+                logger.error(f"Error loading ring log bots: {e}")
+                return None
+            self.rings = {name: get_local_log_backend(name) for name in names}
+            ring = self.rings.get(bot_name)
+        return ring if isinstance(ring, RingLogBackend) else None
+
+    def _run(self, sock: socket.socket):
+        while True:
+            try:
+                data = sock.recv(65536)
+            except OSError:
+                return
+            name, _, payload = data.partition(b'\n')
+            ring = self._ring(name.decode('utf-8', errors='replace').strip())
+            if ring is not None and payload:
+                ring.push(payload)
+
+
+log_ingest = LogIngestServer()
+
+
+class ShipEntry:
+    """Shipped records queued for a bot's log
+
+    The writer claims an entry before writing it; a frame handler that gave
+    up waiting cancels it, so a frame answered as rejected is never written.
+    """
+
+    def __init__(self, bot_name: str, data: bytes):
+        self.bot_name = bot_name
+        self.data = data
+        self.done = threading.Event()
+        self.committed = False
+        self._claimed = False
+        self._cancelled = False
+        self._lock = threading.Lock()
+
+    def claim(self) -> bool:
+        """Take the entry for writing, False if it was cancelled"""
+        with self._lock:
+            self._claimed = not self._cancelled
+            return self._claimed
+
+    def cancel(self) -> bool:
+        """Cancel the entry, False if the writer already claimed it"""
+        with self._lock:
+            self._cancelled = not self._claimed
+            return self._cancelled
+
+
+class LogShipWriter:
+    """Appends shipped records to bots' log files, committing queued batches with one fsync"""
+
+    def __init__(self):
+        self.queue: 'queue.Queue' = queue.Queue()
+        self.files: Dict[str, object] = {}
+        self.retired: list = []
+        self.bots: set = set()
+        self.last_refresh = 0.0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name='nsl-ship-writer', daemon=True)
+
+    def known(self, bot_name: str) -> bool:
+        """Check that a bot is registered, re-reading the bot list at most every 10s"""
+        with self.lock:
+            now = time.monotonic()
+            if bot_name not in self.bots and now - self.last_refresh > 10:
+                self.last_refresh = now
+                try:
+                    self.bots = {row[0] for row in db_execute('all_bots')}
+                except sqlite3.Error as e:
+                    logger.error(f"Error loading bots for log shipping: {e}")
+            return bot_name in self.bots
+
+    def write(self, bot_name: str, data: bytes) -> bool:
+        """Queue data for a bot's log and wait until it is committed, False if it was not in time"""
+        entry = ShipEntry(bot_name, data)
+        self.queue.put(entry)
+        if not entry.done.wait(LOG_SHIP_WRITE_TIMEOUT) and entry.cancel():
+            logger.error(f"Shipped logs of {bot_name} not written in {LOG_SHIP_WRITE_TIMEOUT}s, dropped")
+            return False
+        # Claimed in time: the entry is being written and is done with its batch
+        entry.done.wait()
+        return entry.committed
+
+    def _file(self, bot_name: str):
+        """Open log file of a bot, reopening it after rotation"""
+        path = get_log_path(bot_name)
+        f = self.files.get(path)
+        if f is not None:
+            try:
+                if os.stat(path).st_ino == os.fstat(f.fileno()).st_ino:
+                    return path, f
+            except FileNotFoundError:
+                pass
+            # Earlier records of the batch may sit in the old file's buffer,
+            # it is closed once the batch is synced
+            self.retired.append(f)
+        f = self.files[path] = open(path, 'ab')
+        return path, f
+
+    def _run(self):
+        while True:
+            # Everything queued while the previous batch was syncing is committed together
+            batch = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self._commit(batch)
+            except Exception as e:
+                logger.error(f"Error committing shipped logs: {e}", exc_info=True)
+            finally:
+                for f in self.retired:
+                    try:
+                        f.close()
+                    except OSError:
+                        pass
+                self.retired.clear()
+                # Writers are never left waiting, whatever happened to the batch
+                for entry in batch:
+                    entry.done.set()
+
+    def _commit(self, batch: list):
+        """Write and sync a batch, marking the entries that were committed"""
+        written = []
+        for entry in batch:
+            if not entry.claim():
+                continue
+            try:
+                path, f = self._file(entry.bot_name)
+                offset = f.seek(0, os.SEEK_END)
+                f.write(entry.data)
+                written.append((path, f, offset, entry))
+            except OSError as e:
+                logger.error(f"Error writing shipped logs of {entry.bot_name}: {e}")
+
+        failed = set()
+        for f in {id(f): f for _, f, _, _ in written}.values():
+            try:
+                f.flush()
+                if LOG_SHIP_FSYNC:
+                    os.fsync(f.fileno())
+            except OSError as e:
+                logger.error(f"Error syncing shipped logs: {e}")
+                failed.add(id(f))
+
+        # Keep cached tails hot so the next log view needs no read
+        appended: Dict[int, list] = {}
+        for path, f, offset, entry in written:
+            if id(f) in failed:
+                continue
+            entry.committed = True
+            appended.setdefault(id(f), [path, f, offset, []])[3].append(entry.data)
+        for path, f, offset, chunks in appended.values():
+            try:
+                tail_cache.feed(path, offset, b''.join(chunks), os.fstat(f.fileno()))
+            except OSError:
+                pass
+
+
+class LogShipServer:
+    """Local stream listener for records shipped by managed bots
+
+    Each frame is a 4-byte big-endian length followed by JSON
+    {"bot": name, "records": [formatted lines]}; every frame is answered with
+    one byte, 0 once the records are committed and 1 if they were rejected.
+    """
+
+    def __init__(self):
+        self.writer = LogShipWriter()
+        self.servers = []
+
+    def start(self):
+        """Open configured listeners and start the writer"""
+        import socketserver
+
+        if not LOG_SHIP_TCP and not LOG_SHIP_SOCKET:
+            return
+        writer = self.writer
+
+        class FrameHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                while True:
+                    header = self.rfile.read(4)
+                    if len(header) < 4:
+                        return
+                    (length,) = struct.unpack('>I', header)
+                    if length > LOG_SHIP_MAX_FRAME:
+                        logger.warning(f"Shipped log frame of {length} bytes rejected, closing connection")
+                        return
+                    status = 1
+                    try:
+                        frame = json.loads(self.rfile.read(length))
+                        bot_name = frame['bot']
+                        records = [str(record).rstrip('\n') for record in frame['records']]
+                        if records and writer.known(bot_name):
+                            data = ('\n'.join(records) + '\n').encode('utf-8')
+                            status = 0 if writer.write(bot_name, data) else 1
+                    except (ValueError, KeyError, TypeError) as e:
+                        logger.warning(f"Invalid shipped log frame: {e}")
+                    self.wfile.write(bytes([status]))
+
+            def finish(self):
+                try:
+                    super().finish()
+                finally:
+                    # Each connection has its own thread, which ends with it
+                    close_thread_db_connection()
+
+        if LOG_SHIP_TCP:
+            host, _, port = LOG_SHIP_TCP.rpartition(':')
+            self.servers.append(socketserver.ThreadingTCPServer((host or '127.0.0.1', int(port)), FrameHandler))
+            logger.info(f"Log shipping listening on tcp://{host or '127.0.0.1'}:{port}")
+        if LOG_SHIP_SOCKET:
+            if os.path.exists(LOG_SHIP_SOCKET):
+                os.unlink(LOG_SHIP_SOCKET)
+            self.servers.append(socketserver.ThreadingUnixStreamServer(LOG_SHIP_SOCKET, FrameHandler))
+            logger.info(f"Log shipping listening on {LOG_SHIP_SOCKET}")
+
+        self.writer.thread.start()
+        for server in self.servers:
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name='nsl-ship', daemon=True).start()
+
+
+log_shipping = LogShipServer()
+
+
+RPC_DATA = 0
+RPC_END = 1
+RPC_ERROR = 2
+RPC_NOT_FOUND = 3
+
+
+def rpc_call(address: str, op: str, bot_name: str, *args) -> Iterator[bytes]:
+    """Run a log operation on another node and yield the chunks it streams back"""
+    host, _, port = address.rpartition(':')
+    started = time.perf_counter()
+    request = json.dumps({'secret': NSL_RPC_SECRET, 'op': op, 'bot': bot_name, 'args': args}).encode('utf-8')
+    with socket.create_connection((host, int(port)), RPC_TIMEOUT) as sock:
+        sock.sendall(struct.pack('>I', len(request)) + request)
+        reader = sock.makefile('rb')
+        while True:
+            header = reader.read(5)
+            if len(header) < 5:
+                raise ConnectionError(f"connection to {address} closed")
+            kind, length = struct.unpack('>BI', header)
+            payload = reader.read(length)
+            if kind == RPC_END:
+                break
+            if kind == RPC_ERROR:
+                raise RuntimeError(f"{address}: {payload.decode('utf-8', 'replace')}")
+            if kind == RPC_NOT_FOUND:
+                raise FileNotFoundError(f"{address}: {payload.decode('utf-8', 'replace')}")
+            metrics.inc('nsl_rpc_bytes_total', len(payload), op=op)
+            yield payload
+    rpc_seconds[op].observe(time.perf_counter() - started)
+
+
+class RemoteLogBackend(LogBackend):
+    """Log of a bot held by another node, read over its RPC listener"""
+
+    def tail(self, num_lines: int) -> List[str]:
+        try:
+            data = b''.join(rpc_call(self.target, 'tail', self.bot_name, num_lines))
+        except (OSError, RuntimeError) as e:
+            logger.error(f"Error reading log of {self.bot_name} from {self.target}: {e}")
+            return []
+        return data.decode('utf-8').split('\n') if data else []
+
+    def iter_range(self, start: float, end: float) -> Iterator[bytes]:
+        return rpc_call(self.target, 'range', self.bot_name, start, end)
+
+    def iter_all(self) -> Iterator[bytes]:
+        return rpc_call(self.target, 'all', self.bot_name)
+
+
+class RPCServer:
+    """Listener answering log requests of other nodes from local backends
+
+    A request is a 4-byte big-endian length followed by JSON
+    {"secret", "op", "bot", "args"}; the answer is a stream of frames, each a
+    kind byte (0 data, 1 end, 2 error, 3 no log) and a 4-byte length before the
+    payload. Log queries answer with one JSON data frame.
+    """
+
+    def __init__(self):
+        self.server = None
+
+    def start(self, address: str):
+        """Listen on host:port"""
+        import socketserver
+
+        class RequestHandler(socketserver.StreamRequestHandler):
+            def send(self, kind: int, payload: bytes = b''):
+                self.wfile.write(struct.pack('>BI', kind, len(payload)) + payload)
+
+            def handle(self):
+                header = self.rfile.read(4)
+                if len(header) < 4:
+                    return
+                (length,) = struct.unpack('>I', header)
+                if length > 64 * 1024:
+                    return
+                try:
+                    request = json.loads(self.rfile.read(length))
+                    op, bot_name, args = request['op'], request['bot'], request['args']
+                except (ValueError, KeyError, TypeError) as e:
+                    logger.warning(f"Invalid RPC request from {self.client_address[0]}: {e}")
+                    return
+                if not hmac.compare_digest(str(request.get('secret', '')).encode(), NSL_RPC_SECRET.encode()):
+                    logger.warning(f"RPC request with invalid secret from {self.client_address[0]}")
+                    self.send(RPC_ERROR, b'invalid secret')
+                    return
+
+                try:
+                    backend = get_local_log_backend(bot_name)
+                    if op == 'tail':
+                        self.send(RPC_DATA, '\n'.join(backend.tail(int(args[0]))).encode('utf-8'))
+                    elif op == 'range':
+                        for chunk in chunk_lines(backend.iter_range(float(args[0]), float(args[1]))):
+                            self.send(RPC_DATA, chunk)
+                    elif op == 'all':
+                        for chunk in chunk_lines(backend.iter_all()):
+                            self.send(RPC_DATA, chunk)
+                    elif op in LOG_QUERIES:
+                        self.send(RPC_DATA, json.dumps(LOG_QUERIES[op](bot_name, *args)).encode('utf-8'))
+                    else:
+                        self.send(RPC_ERROR, f"unknown operation {op}".encode())
+                        return
+                    self.send(RPC_END)
+                except FileNotFoundError as e:
+                    self.send(RPC_NOT_FOUND, str(e).encode('utf-8'))
+                except OSError:
+                    # The requesting node went away
+                    return
+                except Exception as e:
+                    logger.error(f"Error serving RPC {op} for {bot_name}: {e}")
+                    self.send(RPC_ERROR, str(e).encode('utf-8'))
+
+            def finish(self):
+                try:
+                    super().finish()
+                finally:
+                    # Each request has its own thread, which ends with it
+                    close_thread_db_connection()
+
+        class Server(socketserver.ThreadingTCPServer):
+            # A restarted node binds again at once instead of waiting out TIME_WAIT
+            allow_reuse_address = True
+            daemon_threads = True
+
+        host, _, port = address.rpartition(':')
+        self.server = Server((host or '127.0.0.1', int(port)), RequestHandler)
+        threading.Thread(target=self.server.serve_forever, name='nsl-rpc', daemon=True).start()
+        logger.info(f"RPC listening on tcp://{host or '127.0.0.1'}:{port}")
+
+
+class ClusterNode:
+    """Membership, leader lease and log routing of instances sharing the database
+
+    Every LEADER_LEASE / 3 seconds a node records itself and the bots whose
+    logs it holds, and renews or tries to take the leader lease. Only the
+    leader polls Telegram; log requests for bots held by other live nodes go
+    to them over RPC.
+    """
+
+    def __init__(self):
+        self.enabled = bool(NSL_RPC)
+        self.leader = threading.Event()
+        self.lease_expires = 0.0
+        self.local_bots: set = set()
+        self.routes: Dict[str, str] = {}
+        self.rpc = RPCServer()
+        self._published: Optional[set] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start the RPC listener and the membership thread"""
+        if not self.enabled or self._thread is not None:
+            return
+        if not NSL_RPC_SECRET:
+            raise RuntimeError("NSL_RPC requires NSL_RPC_SECRET")
+        self.rpc.start(NSL_RPC)
+        self.tick()
+        self._thread = threading.Thread(target=self._run, name='nsl-cluster', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(LEADER_LEASE / 3)
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"Error in cluster membership of node {NSL_NODE}: {e}", exc_info=True)
+                self.step_down("lease could not be renewed")
+            # A tick that failed or took too long leaves an expired lease behind
+            if self.leader.is_set() and time.time() >= self.lease_expires:
+                self.step_down("lease expired")
+
+    def tick(self):
+        """Publish this node, renew or take the lease and reload routes"""
+        now = time.time()
+        try:
+            self.heartbeat(now)
+            self.elect(now)
+            self.routes = {
+                row['bot_name']: row['rpc_address']
+                for row in db_execute('live_bot_nodes', (now - LEADER_LEASE,)).fetchall()
+                if row['name'] != NSL_NODE
+            }
+        except sqlite3.Error as e:
+            get_db_connection().rollback()
+            logger.error(f"Error updating cluster state of node {NSL_NODE}: {e}")
+            self.step_down("lease could not be renewed")
+
+    def find_local_bots(self) -> set:
+        """Bots whose logs are on this node"""
+        files, directories = set(), set()
+        with os.scandir(LOGS_DIR) as it:
+            for entry in it:
+                if entry.is_dir():
+                    directories.add(entry.name)
+                elif entry.name.endswith('.log'):
+                    files.add(entry.name[:-4])
+
+        bots = set()
+        for row in db_execute('bot_backends').fetchall():
+            name, kind, target = row
+            if (kind == 'shards' and (target or name) in directories
+                    or kind == 'ring' and log_ingest.sockets
+                    or kind not in ('shards', 'ring') and name in files):
+                bots.add(name)
+        return bots
+
+    def heartbeat(self, now: float):
+        """Record this node and its bots"""
+        conn = get_db_connection()
+        bots = self.find_local_bots()
+        db_execute('node_heartbeat', (NSL_NODE, NSL_RPC, now))
+        if bots != self._published:
+            db_execute('clear_node_bots', (NSL_NODE,))
+            for bot_name in bots:
+                db_execute('add_node_bot', (NSL_NODE, bot_name))
+            logger.info(f"Node {NSL_NODE} holds logs of {len(bots)} bots")
+        conn.commit()
+        self.local_bots = self._published = bots
+
+    def elect(self, now: float):
+        """Renew the lease if this node holds it, take it over if it expired"""
+        conn = get_db_connection()
+        db_execute('acquire_lease', (NSL_NODE, now + LEADER_LEASE, now))
+        conn.commit()
+        holder = db_execute('lease_holder').fetchone()
+        if holder is not None and holder['node'] == NSL_NODE:
+            self.lease_expires = holder['expires_at']
+            if not self.leader.is_set():
+                logger.info(f"Node {NSL_NODE} became the leader")
+                self.leader.set()
+        else:
+            self.step_down(f"lease taken by {holder['node'] if holder else 'nobody'}")
+
+    def step_down(self, reason: str):
+        """Stop receiving updates"""
+        if self.leader.is_set():
+            logger.warning(f"Node {NSL_NODE} is no longer the leader: {reason}")
+            self.leader.clear()
+        # Also stops polling that started just before the lease was lost
+        bot.stop_polling()
+
+    def release(self):
+        """Give the lease up on shutdown so another node takes over at once"""
+        if not self.enabled or not self.leader.is_set():
+            return
+        try:
+            db_execute('release_lease', (NSL_NODE,))
+            get_db_connection().commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error releasing leader lease: {e}")
+
+    def route(self, bot_name: str) -> Optional[str]:
+        """RPC address of the node holding a bot's logs, None when they are here or unknown"""
+        if not self.enabled or bot_name in self.local_bots:
+            return None
+        return self.routes.get(bot_name)
+
+
+cluster = ClusterNode()
+metrics.add_collector(lambda: [
+    ('gauge', 'nsl_cluster_leader', {'node': NSL_NODE}, 1 if cluster.leader.is_set() else 0),
+] if cluster.enabled else [])
+
+
+class LogIndex:
+    """Sidecar index of a log file: offset and first timestamp of every block of lines"""
+
+    HEADER = struct.Struct('<8sQQQ')  # magic, inode, indexed bytes, indexed lines
+    ENTRY = struct.Struct('<QQd')     # line number, byte offset, first timestamp
+    MAGIC = b'NSLIDX1\0'
+
+    def __init__(self, log_path: str, index_path: str):
+        self.log_path = log_path
+        self.index_path = index_path
+        self.lock = threading.Lock()
+        self.inode = 0
+        self.indexed = 0
+        self.lines = 0
+        self.entries: List[Tuple[int, int, float]] = []
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'rb') as f:
+                data = f.read()
+            magic, self.inode, self.indexed, self.lines = self.HEADER.unpack_from(data)
+            if magic != self.MAGIC:
+                raise ValueError("bad magic")
+            self.entries = list(self.ENTRY.iter_unpack(data[self.HEADER.size:]))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Discarding log index {self.index_path}: {e}")
+            self._reset(0)
+
+    def _reset(self, inode: int):
+        self.inode = inode
+        self.indexed = 0
+        self.lines = 0
+        self.entries = []
+        with open(self.index_path, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.inode, 0, 0))
+
+    def update(self):
+        """Index lines appended since the last update"""
+        st = os.stat(self.log_path)
+        if st.st_ino != self.inode or st.st_size < self.indexed:
+            # New, rotated or truncated log: index from scratch
+            self._reset(st.st_ino)
+        if st.st_size == self.indexed:
+            return
+
+        new_entries = []
+        with open(self.log_path, 'rb') as f:
+            f.seek(self.indexed)
+            remaining = st.st_size - self.indexed
+            carry = b''
+            while remaining > 0:
+                chunk = f.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                metrics.inc('nsl_log_bytes_read_total', len(chunk), op='index')
+                data = carry + chunk
+                end = data.rfind(b'\n') + 1
+                # Only complete lines are indexed, the partial one waits for the next update
+                new_entries.extend(self._scan(data[:end], self.indexed))
+                self.indexed += end
+                carry = data[end:]
+
+        self.entries.extend(new_entries)
+        with open(self.index_path, 'r+b') as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.inode, self.indexed, self.lines))
+            f.seek(0, os.SEEK_END)
+            f.write(b''.join(self.ENTRY.pack(*entry) for entry in new_entries))
+
+    def _scan(self, data: bytes, base: int) -> List[Tuple[int, int, float]]:
+        entries = []
+        pos = 0
+        while pos < len(data):
+            if self.lines % LOG_INDEX_STEP == 0:
+                # Continuation lines (tracebacks) inherit the previous block's timestamp
+                timestamp = parse_log_timestamp(data[pos:pos + 32].decode('utf-8', errors='replace'))
+                if timestamp is None:
+                    last = entries[-1] if entries else (self.entries[-1] if self.entries else None)
+                    timestamp = last[2] if last else 0.0
+                entries.append((self.lines, base + pos, timestamp))
+
+            skip = LOG_INDEX_STEP - self.lines % LOG_INDEX_STEP
+            available = data.count(b'\n', pos)
+            if available < skip:
+                self.lines += available
+                break
+            for _ in range(skip):
+                pos = data.index(b'\n', pos) + 1
+            self.lines += skip
+        return entries
+
+    def blocks(self, since: Optional[float] = None) -> List[Tuple[int, int]]:
+        """Get (start, end) byte ranges of indexed blocks that may hold records after since"""
+        first = 0
+        if since is not None:
+            timestamps = [entry[2] for entry in self.entries]
+            first = max(bisect.bisect_right(timestamps, since) - 1, 0)
+        offsets = [entry[1] for entry in self.entries[first:]] + [self.indexed]
+        return [(offsets[i], offsets[i + 1]) for i in range(len(offsets) - 1)]
+
+
+_log_indexes: Dict[str, LogIndex] = {}
+_log_indexes_lock = threading.Lock()
+
+
+def get_log_index(bot_name: str) -> LogIndex:
+    """Get sidecar index of bot's log file"""
+    with _log_indexes_lock:
+        index = _log_indexes.get(bot_name)
+        if index is None:
+            index = _log_indexes[bot_name] = LogIndex(
+                get_log_path(bot_name),
+                os.path.join(LOG_INDEX_DIR, f"{bot_name}.idx")
+            )
+        return index
+
+
+def record_time_before(f, offset: int) -> str:
+    """asctime of the last record starting before offset, '' if none is close enough"""
+    start = max(offset - GREP_LOOKBACK, 0)
+    f.seek(start)
+    data = f.read(offset - start)
+    metrics.inc('nsl_log_bytes_read_total', len(data), op='search')
+    lines = decode_log_bytes(data).splitlines()
+    if start > 0:
+        # The first line may be cut
+        lines = lines[1:]
+    for line in reversed(lines):
+        if LOG_TIMESTAMP_RE.match(line):
+            return line[:19]
+    return ''
+
+
+@metrics.timed('nsl_log_read_seconds', op='search')
+def search_log(bot_name: str, query: str, since: Optional[float] = None) -> Tuple[List[str], bool]:
+    """Search bot's log newest blocks first; return matching lines with context and completeness flag"""
+    # Plain substring matching: a user's regex could backtrack for minutes
+    # inside a single match while holding the GIL, stalling every thread
+    needle = query.lower()
+    deadline = time.monotonic() + GREP_TIME_BUDGET
+    index = get_log_index(bot_name)
+    with index.lock:
+        index.update()
+        blocks = index.blocks(since)
+
+    since_text = time.strftime(LOG_TIMESTAMP_FORMAT, time.localtime(since)) if since else None
+    results: List[List[str]] = []
+    matches = 0
+    complete = True
+    with open(index.log_path, 'rb') as f:
+        for start, end in reversed(blocks):
+            if time.monotonic() > deadline:
+                complete = False
+                break
+
+            f.seek(start)
+            lines = decode_log_bytes(f.read(end - start)).splitlines()
+            metrics.inc('nsl_log_bytes_read_total', end - start, op='search')
+            selected = set()
+            record_time = ''
+            if since_text and lines and not LOG_TIMESTAMP_RE.match(lines[0]):
+                # The block starts inside a record of the previous one
+                record_time = record_time_before(f, start)
+            for i, line in enumerate(lines):
+                if LOG_TIMESTAMP_RE.match(line):
+                    record_time = line[:19]
+                if since_text and record_time < since_text:
+                    continue
+                if needle in line[:GREP_LINE_LIMIT].lower():
+                    if matches >= GREP_MAX_MATCHES:
+                        complete = False
+                        break
+                    matches += 1
+                    selected.update(range(max(i - GREP_CONTEXT, 0), min(i + GREP_CONTEXT + 1, len(lines))))
+
+            block = []
+            previous = None
+            for i in sorted(selected):
+                if previous is not None and i != previous + 1:
+                    block.append('--')
+                block.append(lines[i])
+                previous = i
+            if block:
+                results.append(block)
+            if not complete:
+                break
+
+    output = []
+    for block in reversed(results):
+        if output:
+            output.append('--')
+        output.extend(block)
+    return output, complete
+
+
+def escape_to_fit(text: str, limit: int) -> str:
+    """Escape text for HTML, cutting it before escaping so no entity is split"""
+    escaped = html.escape(text, quote=False)
+    if len(escaped) <= limit:
+        return escaped
+
+    parts = []
+    length = 1  # Room for the ellipsis
+    for char in text:
+        char = html.escape(char, quote=False)
+        if length + len(char) > limit:
+            break
+        parts.append(char)
+        length += len(char)
+    return ''.join(parts) + '…'
+
+
+def paginate_lines(lines: List[str], limit: int = PAGE_LIMIT) -> List[str]:
+    """Escape lines for HTML and pack them into pages that fit the limit"""
+    pages = []
+    page = []
+    length = 0
+    for line in lines:
+        line = escape_to_fit(line, limit)
+        if page and length + len(line) + 1 > limit:
+            pages.append('\n'.join(page))
+            page, length = [], 0
+        page.append(line)
+        length += len(line) + 1
+    if page:
+        pages.append('\n'.join(page))
+    return pages
+
+
+def pack_line_ranges(snapshot: TailSnapshot, limit: int = PAGE_LIMIT) -> List[Tuple[int, int]]:
+    """Split tail lines on line boundaries into byte ranges whose escaped text fits the limit"""
+    ranges = []
+    end = snapshot.end
+    start = None
+    length = 0
+    # Pack from the newest line so the last page, shown first, is a full one
+    for offset, line in reversed(snapshot.lines):
+        line_length = len(html.escape(line, quote=False)) + 1
+        if start is not None and length + line_length > limit:
+            ranges.append((start, end))
+            end, length = start, 0
+        start = offset
+        length += line_length
+    if start is not None:
+        ranges.append((start, end))
+    return ranges[::-1]
+
+
+class PagedResult(NamedTuple):
+    """Result pages kept for page turns"""
+    expires: float
+    chat_id: int                              # Chat the result was sent to
+    bot_name: str                             # Bot whose logs the result shows
+    title: str
+    pages: list                               # Escaped text or (start, end) byte ranges of source
+    source: Optional[Tuple[str, int]] = None  # (path, inode) of the file ranges point into
+
+
+_paged_results: Dict[int, PagedResult] = {}
+_paged_results_lock = threading.Lock()
+_paged_counter = 0
+
+
+def store_paged_result(chat_id: int, bot_name: str, title: str, pages: list,
+                       source: Optional[Tuple[str, int]] = None) -> int:
+    """Keep result pages for paging, return result id"""
+    global _paged_counter
+    now = time.monotonic()
+    with _paged_results_lock:
+        for result_id in [k for k, v in _paged_results.items() if v.expires < now]:
+            del _paged_results[result_id]
+        _paged_counter += 1
+        _paged_results[_paged_counter] = PagedResult(
+            now + PAGED_RESULTS_TTL, chat_id, bot_name, title, pages, source
+        )
+        return _paged_counter
+
+
+def get_paged_result(result_id: int) -> Optional[PagedResult]:
+    """Get a stored result, None if it expired"""
+    with _paged_results_lock:
+        result = _paged_results.get(result_id)
+    if result is None or result.expires < time.monotonic():
+        return None
+    return result
+
+
+def read_page_range(source: Tuple[str, int], start: int, end: int) -> Optional[str]:
+    """Read a page by its byte range, None if the file was rotated or truncated since"""
+    path, inode = source
+    try:
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            if st.st_ino != inode or st.st_size < end:
+                return None
+            f.seek(start)
+            return escape_to_fit(decode_log_bytes(f.read(end - start)).rstrip('\n'), PAGE_LIMIT)
+    except FileNotFoundError:
+        return None
+
+
+def render_paged_result(result_id: int, page: int) -> Optional[Tuple[str, InlineKeyboardMarkup]]:
+    """Render a page of a stored result"""
+    result = get_paged_result(result_id)
+    if result is None or not 0 <= page < len(result.pages):
+        return None
+
+    if isinstance(result.pages[page], tuple):
+        # One seek and one read per page turn
+        text = read_page_range(result.source, *result.pages[page])
+        if text is None:
+            return None
+    else:
+        text = result.pages[page]
+
+    from telebot.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+    keyboard = InlineKeyboardMarkup(row_width=3)
+    if len(result.pages) > 1:
+        keyboard.add(
+            InlineKeyboardButton("◀️", callback_data=encode_callback('result', '', result_id, max(page - 1, 0))),
+            InlineKeyboardButton(f"{page + 1}/{len(result.pages)}", callback_data=encode_callback('result', '', result_id, page)),
+            InlineKeyboardButton("▶️", callback_data=encode_callback('result', '', result_id, min(page + 1, len(result.pages) - 1)))
+        )
+    return f"{result.title}\n\n<code>{text}</code>", keyboard
+
+
+def run_search(chat_id: int, message_id: int, bot_name: str, query: str):
+    """Run a log search off the polling thread and show the first page"""
+    args = query.split(maxsplit=1)
+    since = None
+    window = parse_duration(args[0]) if len(args) > 1 else None
+    if window:
+        since = time.time() - window
+        query = args[1]
+
+    try:
+        lines, complete = run_log_query('search', bot_name, query, since)
+    except FileNotFoundError:
+        bot.edit_message_text("❌ Файл логов не найден", chat_id, message_id)
+        return
+    except Exception as e:
+        logger.error(f"Error searching logs of {bot_name}: {e}")
+        bot.edit_message_text("❌ Ошибка при поиске по логам", chat_id, message_id)
+        return
+
+    if not lines:
+        bot.edit_message_text(f"🔍 Ничего не найдено в логах бота {bot_name}.", chat_id, message_id)
+        return
+
+    title = f"🔍 Поиск «{html.escape(query)}» в логах бота {html.escape(bot_name)}"
+    if not complete:
+        title += " (показаны последние совпадения)"
+    result_id = store_paged_result(chat_id, bot_name, title, paginate_lines(lines))
+    text, keyboard = render_paged_result(result_id, 0)
+    bot.edit_message_text(text, chat_id, message_id, parse_mode='HTML', reply_markup=keyboard)
+
+
+def start_search(message: Message, bot_name: str, query: str):
+    """Check access and queue a log search"""
+    username = message.from_user.username
+
+    logger.info(f"User @{username} searched logs of {bot_name} for {query!r}")
+
+    if bot_name not in get_user_bots(username):
+        logger.warning(f"User @{username} tried to search logs of unauthorized bot {bot_name}")
+        bot.send_message(message.chat.id, f"❌ У вас нет доступа к логам бота {bot_name}.")
+        return
+
+    refusal = check_rate_limit(username, bot_name)
+    if refusal:
+        bot.send_message(message.chat.id, refusal)
+        return
+
+    reply = bot.send_message(message.chat.id, f"🔍 Поиск в логах бота {bot_name}...")
+    if not io_pool.submit(run_search, message.chat.id, reply.message_id, bot_name, query):
+        refund_rate_limit(username, bot_name)
+        bot.edit_message_text(BUSY_TEXT, message.chat.id, reply.message_id)
+
+
+LOG_LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40, 'CRITICAL': 50}
+
+
+class LogRecordView(NamedTuple):
+    """Log record with its continuation lines (e.g. a traceback)"""
+    timestamp: str  # asctime up to seconds, empty for lines before the first record
+    name: str
+    level: str
+    text: str
+
+
+class LogFilter(NamedTuple):
+    """Tail view filter by level, time window and logger name"""
+    level: Optional[str] = None    # Minimum level
+    window: Optional[int] = None   # Seconds back from now
+    name: Optional[str] = None     # Logger name, children included
+
+    def matches(self, record: LogRecordView) -> bool:
+        """Check if a record passes the filter"""
+        if self.level and LOG_LEVELS.get(record.level, 0) < LOG_LEVELS[self.level]:
+            return False
+        if self.name and record.name != self.name and not record.name.startswith(self.name + '.'):
+            return False
+        return True
+
+    def describe(self) -> str:
+        """Describe filter for message titles"""
+        parts = []
+        if self.level:
+            parts.append(f"{self.level}+")
+        if self.window:
+            parts.append(f"за {format_age(self.window)}")
+        if self.name:
+            parts.append(f"логгер {self.name}")
+        return ', '.join(parts) or 'все записи'
+
+
+def iter_lines_reverse(f, size: int, limit: int) -> Iterator[Tuple[int, bytes]]:
+    """Yield (offset, line) pairs from the end of a file backwards, reading at most limit bytes"""
+    pos = size
+    carry = b''
+    at_end = True
+    while pos > 0 and size - pos < limit:
+        read_size = min(TAIL_BLOCK_SIZE, pos)
+        pos -= read_size
+        f.seek(pos)
+        lines = (f.read(read_size) + carry).split(b'\n')
+        metrics.inc('nsl_log_bytes_read_total', read_size, op='filter')
+        if at_end and lines[-1] == b'':
+            # File ends with a newline: there is no empty last line
+            lines.pop()
+        at_end = False
+
+        # The first piece may continue in the previous block
+        carry = lines[0]
+        offset = pos + len(carry) + 1
+        starts = []
+        for line in lines[1:]:
+            starts.append(offset)
+            offset += len(line) + 1
+        for start, line in zip(reversed(starts), reversed(lines[1:])):
+            yield start, line
+    if pos == 0 and (carry or not at_end):
+        yield 0, carry
+
+
+def iter_records_reverse(f, size: int, limit: int) -> Iterator[LogRecordView]:
+    """Yield log records from newest to oldest, grouping multi-line records"""
+    continuation = []
+    offset = size
+    for offset, raw in iter_lines_reverse(f, size, limit):
+        line = raw.decode('utf-8', errors='replace').rstrip('\r')
+        match = LOG_RECORD_RE.match(line)
+        if match is None:
+            continuation.append(line)
+            continue
+        text = '\n'.join([line] + continuation[::-1])
+        continuation = []
+        yield LogRecordView(line[:19], match.group(2), match.group(3), text)
+
+    # Lines before the first record are only complete at the start of the file
+    if continuation and offset == 0:
+        yield LogRecordView('', '', '', '\n'.join(reversed(continuation)))
+
+
+@metrics.timed('nsl_log_read_seconds', op='filter')
+def get_filtered_records(bot_name: str, count: int, log_filter: LogFilter) -> List[str]:
+    """Get last N records of bot's log passing the filter, oldest first"""
+    since_text = None
+    if log_filter.window:
+        since_text = time.strftime(LOG_TIMESTAMP_FORMAT, time.localtime(time.time() - log_filter.window))
+
+    records = []
+    with open(get_log_path(bot_name), 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        for record in iter_records_reverse(f, size, FILTER_SCAN_LIMIT):
+            # Records are read newest first, so the window ends at the first older one
+            if since_text and record.timestamp and record.timestamp < since_text:
+                break
+            if log_filter.matches(record):
+                records.append(record.text)
+                if len(records) >= count:
+                    break
+    records.reverse()
+    return records
+
+
+def parse_log_filter(args: List[str]) -> Optional[Tuple[int, LogFilter]]:
+    """Parse record count and filter from command arguments, None if the count is not positive"""
+    count = FILTER_DEFAULT_RECORDS
+    level = window = name = None
+    for arg in args:
+        if arg.lstrip('-').isdigit():
+            count = int(arg)
+            if count < 1:
+                return None
+            count = min(count, FILTER_MAX_RECORDS)
+        elif arg.upper() in LOG_LEVELS:
+            level = arg.upper()
+        elif parse_duration(arg):
+            window = parse_duration(arg)
+        else:
+            name = arg
+    return count, LogFilter(level, window, name)
+
+
+def send_filtered_logs(chat_id: int, bot_name: str, count: int, log_filter: LogFilter):
+    """Send filtered tail of bot's log, paged"""
+    try:
+        records = run_log_query('filter', bot_name, count, log_filter)
+    except FileNotFoundError:
+        bot.send_message(chat_id, "❌ Файл логов не найден")
+        return
+    except Exception as e:
+        logger.error(f"Error filtering logs of {bot_name}: {e}")
+        bot.send_message(chat_id, "❌ Ошибка при чтении логов")
+        return
+
+    if not records:
+        bot.send_message(chat_id, f"📄 В логах бота {bot_name} нет записей ({log_filter.describe()}).")
+        return
+
+    title = (
+        f"📄 Логи бота {html.escape(bot_name)} "
+        f"(последние {len(records)} записей, {html.escape(log_filter.describe())}):"
+    )
+    result_id = store_paged_result(chat_id, bot_name, title, paginate_lines('\n'.join(records).split('\n')))
+    text, keyboard = render_paged_result(result_id, 0)
+    bot.send_message(chat_id, text, parse_mode='HTML', reply_markup=keyboard)
+
+
+EXPORT_TIME_FORMATS = ('%Y-%m-%dT%H:%M', '%Y-%m-%d')
+
+
+def parse_export_time(text: str) -> Optional[Tuple[float, bool]]:
+    """Parse 2024-01-31 or 2024-01-31T14:00 into (timestamp, whether it is a whole day)"""
+    for time_format in EXPORT_TIME_FORMATS:
+        try:
+            return time.mktime(time.strptime(text, time_format)), time_format == '%Y-%m-%d'
+        except ValueError:
+            continue
+    return None
+
+
+def parse_export_range(args: List[str]) -> Optional[Tuple[float, float]]:
+    """Parse export period: a window like 6h, or a start and an optional end time"""
+    if not args or len(args) > 2:
+        return None
+    now = time.time()
+
+    window = parse_duration(args[0])
+    if window is not None and len(args) == 1:
+        return now - window, now
+
+    start = parse_export_time(args[0])
+    if start is None:
+        return None
+    if len(args) == 1:
+        return start[0], now
+    end = parse_export_time(args[1])
+    if end is None:
+        return None
+    # A date as the end of the period includes that whole day
+    return start[0], end[0] + 86400 if end[1] else end[0]
+
+
+def chunk_lines(lines: Iterator[bytes]) -> Iterator[bytes]:
+    """Join raw lines into download-sized chunks"""
+    chunk = []
+    size = 0
+    for line in lines:
+        chunk.append(line)
+        size += len(line)
+        if size >= DOWNLOAD_CHUNK_SIZE:
+            yield b''.join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield b''.join(chunk)
+
+
+def export_log_range(chat_id: int, bot_name: str, start: float, end: float):
+    """Send records of a period collected from all log segments, compressed; start 0 exports everything"""
+    if start > 0:
+        period = (
+            f"за {time.strftime('%Y-%m-%d %H:%M', time.localtime(start))} — "
+            f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(end))}"
+        )
+        file_name = f"{bot_name}-{time.strftime('%Y%m%d-%H%M', time.localtime(start))}.log"
+    else:
+        period = "за всё время"
+        file_name = f"{bot_name}.log"
+    try:
+        started = time.monotonic()
+        backend = get_log_backend(bot_name)
+        lines = backend.iter_range(start, end) if start > 0 else backend.iter_all()
+        first = next(lines, None)
+        if first is None:
+            bot.send_message(chat_id, f"📄 В логах бота {bot_name} нет записей {period}.")
+            return
+
+        spool, suffix = compress_log_stream(chunk_lines(itertools.chain([first], lines)), file_name)
+        with spool:
+            size = spool.seek(0, os.SEEK_END)
+            send_spool(chat_id, spool, file_name + suffix, f"📁 Логи бота {bot_name} {period}")
+        logger.info(f"Exported logs of {bot_name} as {file_name}: {size} bytes in {time.monotonic() - started:.2f}s")
+    except Exception as e:
+        logger.error(f"Error exporting logs of {bot_name}: {e}")
+        bot.send_message(chat_id, "❌ Ошибка при выгрузке логов")
+
+
+# Final line of a traceback, e.g. "ValueError: invalid literal"
+EXCEPTION_LINE_RE = re.compile(r'^([A-Za-z_][\w.]*(?:Error|Exception|Exit|Interrupt|Fault))(?::\s*(.*))?$')
+# Variable parts of error messages, replaced so repeats share one signature
+SIGNATURE_VARIABLE_RE = re.compile(r"0x[0-9a-fA-F]+|\d+|'[^']*'|\"[^\"]*\"")
+SIGNATURE_LIMIT = 1000
+
+
+def error_signature(line: str) -> Optional[str]:
+    """Signature of an error record or a traceback's exception line, None for other lines"""
+    match = LOG_RECORD_RE.match(line)
+    if match:
+        if match.group(3) not in ('ERROR', 'CRITICAL'):
+            return None
+        text = f"{match.group(2)}: {line[match.end():]}"
+    else:
+        match = EXCEPTION_LINE_RE.match(line.strip())
+        if not match:
+            return None
+        text = line.strip()
+    return SIGNATURE_VARIABLE_RE.sub('*', text.rstrip())[:160]
+
+
+TRACEBACK_FRAME_RE = re.compile(r'^\s*File "([^"]+)", line \d+, in (\S+)')
+
+
+def error_fingerprint(record: str) -> Tuple[int, str]:
+    """Fingerprint and title of an error record: exception type and stack frames, or the masked message"""
+    lines = record.rstrip('\n').split('\n')
+    frames = []
+    exception = None
+    for line in lines[1:]:
+        match = TRACEBACK_FRAME_RE.match(line)
+        if match:
+            # Line numbers change with every release, files and functions rarely do
+            frames.append(f"{os.path.basename(match.group(1))}:{match.group(2)}")
+            continue
+        match = EXCEPTION_LINE_RE.match(line.strip())
+        if match:
+            exception = match.group(1)
+
+    if exception:
+        key = '|'.join([exception] + frames)
+        title = f"{exception} в {frames[-1]}" if frames else exception
+    else:
+        key = title = error_signature(lines[0]) or SIGNATURE_VARIABLE_RE.sub('*', lines[0])[:160]
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True), title
+
+
+class LogStats:
+    """Rolling statistics of a log file, updated from appended bytes"""
+
+    def __init__(self):
+        self.inode = None
+        self.offset = 0
+        self.pending = b''
+        self.size = 0
+        self.mtime = 0.0
+        self.last_line = ''
+        self.last_growth: Optional[float] = None
+        # Minute number -> [errors, warnings]
+        self.minutes: Dict[int, List[int]] = {}
+        self._minute_cache: Dict[str, int] = {}
+        # Error signatures seen so far, least recently seen first, and ones first seen since the last check
+        self.signatures: 'OrderedDict[str, None]' = OrderedDict()
+        self.new_signatures: List[str] = []
+        # Error records with their tracebacks, read since the last take; the
+        # record still being read and where it starts
+        self.error_records: List[str] = []
+        self._record: List[str] = []
+        self._record_offset = 0
+        # Where to resume reading on first sight, end of the history read then
+        self.resume: Optional[Tuple[int, int]] = None
+        self.seed_end = 0
+
+    def update(self, path: str, st: os.stat_result, max_read: int = SUMMARY_MAX_READ) -> int:
+        """Read bytes appended since the last update, return number of bytes read"""
+        # What is already in the log on first sight is history, not news
+        seeding = self.inode is None
+        if st.st_ino != self.inode or st.st_size < self.offset:
+            # First sight, rotation or truncation: start near the end of the file
+            self.finish_error()
+            self.inode = st.st_ino
+            self.offset = max(st.st_size - SUMMARY_SEED_BYTES, 0)
+            self.pending = b''
+            skip_partial = self.offset > 0
+            self.seed_end = st.st_size if seeding else 0
+            if seeding:
+                # Continue from where the previous run stopped if that is
+                # close enough to the end, so errors are not counted twice
+                if (self.resume and self.resume[0] == st.st_ino
+                        and st.st_size - SUMMARY_MAX_READ <= self.resume[1] <= st.st_size):
+                    self.offset = self.resume[1]
+                    skip_partial = False
+        else:
+            skip_partial = False
+        if not seeding and st.st_size != self.size:
+            self.last_growth = time.time()
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        if st.st_size == self.offset or max_read <= 0:
+            if st.st_size == self.offset:
+                # Nothing appended for a whole refresh, the last record is complete
+                self.finish_error()
+            return 0
+
+        start = self.offset - len(self.pending)
+        with open(path, 'rb') as f:
+            f.seek(self.offset)
+            data = self.pending + f.read(min(st.st_size - self.offset, max_read))
+        read = len(data) - len(self.pending)
+        lines, self.pending = split_log_lines(data, start)
+        if skip_partial and lines:
+            lines = lines[1:]
+        self.feed((line for _, line in lines), report_new=self.offset >= self.seed_end)
+        self.collect_errors(lines)
+        self.offset += read
+        if lines:
+            self.last_line = lines[-1][1].rstrip('\n')
+        return read
+
+    def collect_errors(self, lines: List[Tuple[int, str]]):
+        """Assemble error records with their continuation lines"""
+        for offset, line in lines:
+            match = LOG_RECORD_RE.match(line)
+            if match:
+                self.finish_error()
+                if match.group(3) in ('ERROR', 'CRITICAL'):
+                    self._record, self._record_offset = [line], offset
+            elif self._record and len(self._record) < ERROR_RECORD_LINES:
+                self._record.append(line)
+
+    def finish_error(self):
+        """Move the error record being read to the complete ones"""
+        if self._record:
+            self.error_records.append(''.join(self._record))
+            self._record = []
+
+    def take_errors(self) -> Tuple[List[str], int]:
+        """Take complete error records and the offset reading them can resume from"""
+        records, self.error_records = self.error_records, []
+        resume = self._record_offset if self._record else self.offset - len(self.pending)
+        return records, resume
+
+    def feed(self, lines, report_new: bool = True):
+        """Count errors and warnings of log records and collect new error signatures"""
+        for line in lines:
+            match = LOG_RECORD_RE.match(line)
+            if not match or match.group(3) in ('ERROR', 'CRITICAL'):
+                signature = error_signature(line)
+                if signature in self.signatures:
+                    self.signatures.move_to_end(signature)
+                elif signature is not None:
+                    # Forget the errors not seen for the longest time, not the recurring ones
+                    if len(self.signatures) >= SIGNATURE_LIMIT:
+                        self.signatures.popitem(last=False)
+                    self.signatures[signature] = None
+                    if report_new:
+                        self.new_signatures.append(signature)
+            if not match:
+                continue
+            level = match.group(3)
+            if level in ('ERROR', 'CRITICAL'):
+                kind = 0
+            elif level == 'WARNING':
+                kind = 1
+            else:
+                continue
+            minute = self._minute(match.group(1))
+            if minute is not None:
+                self.minutes.setdefault(minute, [0, 0])[kind] += 1
+
+        # Drop minutes that left the window
+        oldest = int(time.time() // 60) - SUMMARY_WINDOW
+        for minute in [m for m in self.minutes if m < oldest]:
+            del self.minutes[minute]
+
+    def _minute(self, text: str) -> Optional[int]:
+        minute = self._minute_cache.get(text)
+        if minute is None:
+            try:
+                minute = int(time.mktime(time.strptime(text, '%Y-%m-%d %H:%M')) // 60)
+            except ValueError:
+                return None
+            if len(self._minute_cache) > 4 * SUMMARY_WINDOW:
+                self._minute_cache.clear()
+            self._minute_cache[text] = minute
+        return minute
+
+    def counts(self, window: int = SUMMARY_WINDOW) -> Tuple[int, int]:
+        """Get errors and warnings of the last N minutes"""
+        oldest = int(time.time() // 60) - window
+        errors = warnings = 0
+        for minute, (minute_errors, minute_warnings) in self.minutes.items():
+            if minute >= oldest:
+                errors += minute_errors
+                warnings += minute_warnings
+        return errors, warnings
+
+
+ERROR_INDEX_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS error_groups (
+        bot_name TEXT NOT NULL,
+        fingerprint INTEGER NOT NULL,
+        title TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        first_seen REAL NOT NULL,
+        last_seen REAL NOT NULL,
+        sample TEXT NOT NULL,
+        PRIMARY KEY (bot_name, fingerprint)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS error_groups_count ON error_groups (bot_name, count);
+    CREATE INDEX IF NOT EXISTS error_groups_last_seen ON error_groups (bot_name, last_seen);
+    CREATE TABLE IF NOT EXISTS error_cursors (
+        bot_name TEXT PRIMARY KEY,
+        inode INTEGER NOT NULL,
+        offset INTEGER NOT NULL
+    );
+'''
+
+
+class ErrorIndex:
+    """Error groups of every bot by fingerprint, updated incrementally by the log aggregator"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._cursors: Dict[str, Tuple[int, int]] = {}
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open the database on first use"""
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute(f"PRAGMA journal_mode={DB_JOURNAL_MODE}")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT}")
+            conn.executescript(ERROR_INDEX_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def cursor(self, bot_name: str) -> Optional[Tuple[int, int]]:
+        """(inode, offset) of a bot's log up to which errors were recorded"""
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT inode, offset FROM error_cursors WHERE bot_name = ?", (bot_name,)
+            ).fetchone()
+        if row is None:
+            return None
+        self._cursors[bot_name] = (row['inode'], row['offset'])
+        return self._cursors[bot_name]
+
+    def add(self, bot_name: str, records: List[str], inode: int, offset: int):
+        """Count error records into their groups and save the log position in one transaction"""
+        if not records and self._cursors.get(bot_name) == (inode, offset):
+            return
+
+        # Fold the batch first so each group is written once
+        groups: Dict[int, list] = {}
+        for record in records:
+            fingerprint, title = error_fingerprint(record)
+            seen = parse_log_timestamp(record) or time.time()
+            sample = '\n'.join(record.rstrip('\n').split('\n')[:ERROR_SAMPLE_LINES])
+            group = groups.get(fingerprint)
+            if group is None:
+                groups[fingerprint] = [title, 1, seen, seen, sample]
+            else:
+                group[1] += 1
+                group[2] = min(group[2], seen)
+                if seen >= group[3]:
+                    group[3], group[4] = seen, sample
+
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany('''
+                    INSERT INTO error_groups (bot_name, fingerprint, title, count, first_seen, last_seen, sample)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (bot_name, fingerprint) DO UPDATE SET
+                        count = count + excluded.count,
+                        first_seen = MIN(first_seen, excluded.first_seen),
+                        last_seen = MAX(last_seen, excluded.last_seen),
+                        sample = CASE WHEN excluded.last_seen >= last_seen THEN excluded.sample ELSE sample END
+                ''', [(bot_name, fingerprint, *group) for fingerprint, group in groups.items()])
+                if groups:
+                    # Forget the groups not seen for the longest time
+                    conn.execute('''
+                        DELETE FROM error_groups WHERE bot_name = ? AND last_seen < (
+                            SELECT last_seen FROM error_groups WHERE bot_name = ?
+                            ORDER BY last_seen DESC LIMIT 1 OFFSET ?
+                        )
+                    ''', (bot_name, bot_name, ERROR_GROUPS_LIMIT - 1))
+                conn.execute(
+                    "INSERT OR REPLACE INTO error_cursors (bot_name, inode, offset) VALUES (?, ?, ?)",
+                    (bot_name, inode, offset)
+                )
+        self._cursors[bot_name] = (inode, offset)
+
+    def top(self, bot_name: str, limit: int = TOP_ERRORS_COUNT) -> Tuple[List[sqlite3.Row], int, int]:
+        """Most frequent error groups of a bot, number of groups and of errors"""
+        with self._lock:
+            conn = self._connect()
+            rows = conn.execute(
+                "SELECT * FROM error_groups WHERE bot_name = ? ORDER BY count DESC LIMIT ?", (bot_name, limit)
+            ).fetchall()
+            groups, total = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(count), 0) FROM error_groups WHERE bot_name = ?", (bot_name,)
+            ).fetchone()
+        return rows, groups, total
+
+
+error_index = ErrorIndex(ERRORS_DB_PATH)
+
+
+def top_errors(bot_name: str, limit: int = TOP_ERRORS_COUNT) -> Tuple[List[dict], int, int]:
+    """Most frequent error groups of a bot as dicts, number of groups and of errors"""
+    rows, groups, total = error_index.top(bot_name, limit)
+    return [dict(row) for row in rows], groups, total
+
+
+# Queries answered from the files of the node holding a bot's logs; their
+# arguments and results pass through JSON when they run on another node
+LOG_QUERIES: Dict[str, Callable] = {
+    'search': search_log,
+    'filter': lambda bot_name, count, log_filter: get_filtered_records(bot_name, count, LogFilter(*log_filter)),
+    'errors': top_errors,
+}
+
+
+def run_log_query(op: str, bot_name: str, *args):
+    """Run a log query here or, when another node holds the bot's logs, on that node"""
+    address = cluster.route(bot_name)
+    if address:
+        return json.loads(b''.join(rpc_call(address, op, bot_name, *args)))
+    return LOG_QUERIES[op](bot_name, *args)
+
+
+class LogAggregator:
+    """Background thread keeping LogStats of every registered bot up to date"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stats: Dict[str, LogStats] = {}
+        self.listeners: List[Callable[[Dict[str, LogStats]], None]] = []
+        self._cursor = 0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start the background thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='log-aggregator', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Error refreshing log statistics: {e}")
+            time.sleep(max(self.interval - (time.monotonic() - started), 1))
+
+    def refresh(self):
+        """Update statistics of all registered bots"""
+        bot_names = [row['name'] for row in db_execute('all_bots').fetchall()]
+
+        # One directory scan instead of a stat call per bot
+        entries = {}
+        with os.scandir(LOGS_DIR) as it:
+            for entry in it:
+                if entry.name.endswith('.log'):
+                    entries[entry.name[:-4]] = entry
+
+        # Reads share one budget per refresh; bots left over when it runs
+        # out are read first on the next refresh
+        budget = SUMMARY_CYCLE_BUDGET
+        start = self._cursor % len(bot_names) if bot_names else 0
+        skipped = False
+        for i, bot_name in enumerate(bot_names[start:] + bot_names[:start]):
+            entry = entries.get(bot_name)
+            if entry is None:
+                continue
+            with self._lock:
+                stats = self.stats.get(bot_name)
+            if budget <= 0:
+                if not skipped:
+                    skipped = True
+                    self._cursor = start + i
+                # Size and times still come from the scan, so alerts never see stale ones
+                if stats is not None:
+                    try:
+                        stats.update(entry.path, entry.stat(), 0)
+                    except OSError as e:
+                        logger.error(f"Error reading log statistics of {bot_name}: {e}")
+                continue
+            try:
+                if stats is None:
+                    stats = LogStats()
+                    stats.resume = error_index.cursor(bot_name)
+                    with self._lock:
+                        self.stats[bot_name] = stats
+                budget -= stats.update(entry.path, entry.stat(), min(SUMMARY_MAX_READ, budget))
+                records, resume = stats.take_errors()
+                error_index.add(bot_name, records, stats.inode, resume)
+            except Exception as e:
+                logger.error(f"Error reading log statistics of {bot_name}: {e}")
+
+        with self._lock:
+            for bot_name in set(self.stats) - set(bot_names):
+                del self.stats[bot_name]
+            stats = dict(self.stats)
+
+        for listener in self.listeners:
+            try:
+                listener(stats)
+            except Exception as e:
+                logger.error(f"Error in log statistics listener: {e}")
+
+    def get(self, bot_name: str) -> Optional[LogStats]:
+        """Get statistics of a bot's log"""
+        with self._lock:
+            return self.stats.get(bot_name)
+
+
+log_aggregator = LogAggregator(SUMMARY_INTERVAL)
+
+
+def format_size(size: int) -> str:
+    """Format byte count for humans"""
+    for unit in ('Б', 'КБ', 'МБ', 'ГБ'):
+        if size < 1024 or unit == 'ГБ':
+            return f"{size:.0f} {unit}" if unit == 'Б' else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def format_age(seconds: float) -> str:
+    """Format elapsed time for humans"""
+    seconds = max(int(seconds), 0)
+    if seconds < 60:
+        return f"{seconds} с"
+    if seconds < 3600:
+        return f"{seconds // 60} мин"
+    if seconds < 86400:
+        return f"{seconds // 3600} ч"
+    return f"{seconds // 86400} д"
+
+
+def render_summary(bot_names: List[str]) -> str:
+    """Render summary of bots' logs that fits into one message"""
+    header = f"📈 Сводка по логам (ошибки/предупреждения за {SUMMARY_WINDOW} мин):\n\n"
+    now = time.time()
+    rows = []
+    for bot_name in bot_names:
+        stats = log_aggregator.get(bot_name)
+        name = html.escape(bot_name)
+        if stats is None:
+            rows.append(((0, 0), f"⚪ <b>{name}</b> — нет данных", ''))
+            continue
+        errors, warnings = stats.counts()
+        icon = '🔴' if errors else '🟡' if warnings else '🟢'
+        row = (
+            f"{icon} <b>{name}</b> — {format_size(stats.size)}, "
+            f"запись {format_age(now - stats.mtime)} назад, ❗{errors} ⚠️{warnings}"
+        )
+        last_line = html.escape(stats.last_line[:80], quote=False)
+        rows.append(((errors, warnings), row, f"\n<code>{last_line}</code>" if last_line else ''))
+
+    # Bots with errors first, so they survive truncation
+    rows = [(row, line) for _, row, line in sorted(rows, key=lambda r: r[0], reverse=True)]
+
+    # Drop last lines first, then whole rows, to stay within one message
+    for with_lines in (True, False):
+        text = header + '\n'.join(row + (line if with_lines else '') for row, line in rows)
+        if len(text) <= 4000:
+            return text
+
+    text = header
+    for i, (row, _) in enumerate(rows):
+        if len(text) + len(row) + 40 > 4000:
+            return text + f"… и ещё {len(rows) - i} ботов"
+        text += row + '\n'
+    return text
+
+
+class AlertMonitor:
+    """Detects error spikes, new error signatures and silent logs after each statistics refresh"""
+
+    def __init__(self):
+        self.last_sent: Dict[Tuple[str, str], float] = {}
+        self.silent: set = set()
+
+    def check(self, stats: Dict[str, LogStats]):
+        """Find anomalies in fresh statistics and send alerts"""
+        now = time.time()
+        alerts = []
+        for bot_name, bot_stats in stats.items():
+            name = html.escape(bot_name)
+
+            recent, _ = bot_stats.counts(ALERT_SPIKE_WINDOW)
+            if recent >= ALERT_SPIKE_MIN:
+                total, _ = bot_stats.counts(SUMMARY_WINDOW)
+                # Errors expected in the spike window at the rate of the rest of the summary window
+                usual = (total - recent) * ALERT_SPIKE_WINDOW / max(SUMMARY_WINDOW - ALERT_SPIKE_WINDOW, 1)
+                if recent >= ALERT_SPIKE_FACTOR * max(usual, 1):
+                    alerts.append((bot_name, 'spike', (
+                        f"🚨 Всплеск ошибок в логах бота <b>{name}</b>: "
+                        f"{recent} за {ALERT_SPIKE_WINDOW} мин (обычно около {usual:.0f})"
+                    )))
+
+            signatures, bot_stats.new_signatures = bot_stats.new_signatures, []
+            if signatures:
+                text = f"🆕 Новые ошибки в логах бота <b>{name}</b>:\n" + '\n'.join(
+                    f"<code>{html.escape(signature, quote=False)}</code>" for signature in signatures[:3]
+                )
+                if len(signatures) > 3:
+                    text += f"\n… и ещё {len(signatures) - 3}"
+                alerts.append((bot_name, 'signature', text))
+
+            if ALERT_SILENCE and bot_stats.last_growth is not None:
+                quiet = now - max(bot_stats.last_growth, bot_stats.mtime)
+                if quiet < ALERT_SILENCE * 60:
+                    self.silent.discard(bot_name)
+                elif bot_name not in self.silent:
+                    # One alert per silence, repeated only after the log was written again
+                    self.silent.add(bot_name)
+                    alerts.append((bot_name, 'silence', (
+                        f"🔇 Бот <b>{name}</b> не пишет в лог уже {format_age(quiet)}"
+                    )))
+
+        alerts = [alert for alert in alerts if self._allow(alert[0], alert[1], now)]
+        if alerts:
+            self.send(alerts)
+
+    def _allow(self, bot_name: str, kind: str, now: float) -> bool:
+        """Throttle alerts of one kind per bot"""
+        if now - self.last_sent.get((bot_name, kind), 0) < ALERT_COOLDOWN:
+            return False
+        self.last_sent[(bot_name, kind)] = now
+        return True
+
+    def send(self, alerts: List[Tuple[str, str, str]]):
+        """Send alerts to subscribed users who have access to the bots"""
+        try:
+            subscribers = db_execute('alert_subscribers').fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Error loading alert subscribers: {e}")
+            return
+
+        for row in subscribers:
+            user_bots = set(get_user_bots(row['username']))
+            for bot_name, kind, text in alerts:
+                if bot_name not in user_bots:
+                    continue
+                try:
+                    bot.send_message(row['user_id'], text, parse_mode='HTML')
+                    metrics.inc('nsl_alerts_sent_total', kind=kind)
+                except Exception as e:
+                    logger.error(f"Error sending {kind} alert for {bot_name} to @{row['username']}: {e}")
+        for bot_name, kind, _ in alerts:
+            logger.info(f"Alert {kind} for {bot_name}")
+
+
+alert_monitor = AlertMonitor()
+log_aggregator.listeners.append(alert_monitor.check)
+
+
+def format_ms(seconds: float) -> str:
+    """Format a duration in milliseconds"""
+    return f"{seconds * 1000:.1f} мс" if seconds != float('inf') else "> 10 с"
+
+
+def render_stats() -> str:
+    """Render performance metrics for operators"""
+    text = "📊 <b>Статистика NS Logger</b>\n\n"
+
+    def timings(name: str, label: str) -> str:
+        rows = []
+        errors = metrics.counter_values('nsl_handler_errors_total')
+        for labels, histogram in metrics.histogram_values(name):
+            if not histogram.count:
+                continue
+            key = dict(labels).get(label, '')
+            row = (
+                f"{html.escape(key)}: {histogram.count}, "
+                f"ср. {format_ms(histogram.total / histogram.count)}, p95 ≤ {format_ms(histogram.quantile(0.95))}"
+            )
+            error_count = errors.get(labels, 0) if name == 'nsl_handler_seconds' else 0
+            if error_count:
+                row += f", ошибок {int(error_count)}"
+            rows.append(row)
+        return '\n'.join(rows) if rows else "нет данных"
+
+    text += "<b>⏱ Обработчики</b> (вызовы, среднее, p95):\n" + timings('nsl_handler_seconds', 'handler') + "\n\n"
+    text += "<b>🗄 База данных</b>:\n" + timings('nsl_db_seconds', 'statement') + "\n\n"
+    text += "<b>📖 Чтение логов</b>:\n" + timings('nsl_log_read_seconds', 'op') + "\n\n"
+
+    read = sum(metrics.counter_values('nsl_log_bytes_read_total').values())
+    sent = sum(metrics.counter_values('nsl_bytes_sent_total').values())
+    errors = sum(metrics.counter_values('nsl_errors_total').values())
+    cache = tail_cache.stats()
+    requests = cache['hits'] + cache['misses']
+    hit_rate = f"{cache['hits'] * 100 / requests:.0f}%" if requests else "—"
+    text += (
+        f"📥 Прочитано из логов: {format_size(read)}\n"
+        f"📤 Отправлено файлов: {format_size(sent)}\n"
+        f"💾 Кэш хвостов: {hit_rate} попаданий ({cache['hits']}/{requests})\n"
+        f"📬 Очереди: обработчики {update_dispatcher.depth()} (отклонено {update_dispatcher.rejected}), "
+        f"ввод-вывод {io_pool.depth()} (отклонено {io_pool.rejected})\n"
+        f"❗ Ошибок в журнале: {int(errors)}"
+    )
+    return text
+
+
+class MetricsExporter:
+    """Writes metrics to a Prometheus text file and/or serves them over HTTP"""
+
+    def __init__(self):
+        self.httpd = None
+
+    def start(self):
+        """Start configured exports"""
+        if METRICS_FILE:
+            threading.Thread(target=self._write_loop, name='nsl-metrics-file', daemon=True).start()
+            logger.info(f"Writing metrics to {METRICS_FILE} every {METRICS_INTERVAL:.0f}s")
+        if METRICS_PORT:
+            self._serve()
+
+    def write_file(self):
+        """Replace the metrics file atomically"""
+        path = METRICS_FILE if os.path.isabs(METRICS_FILE) else os.path.join(DATA_DIR, METRICS_FILE)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(metrics.render_prometheus())
+        os.replace(temp_path, path)
+
+    def _write_loop(self):
+        while True:
+            try:
+                self.write_file()
+            except Exception as e:
+                logger.error(f"Error writing metrics file: {e}")
+            time.sleep(METRICS_INTERVAL)
+
+    def _serve(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(f"Metrics {self.client_address[0]}: {format % args}")
+
+        self.httpd = ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), MetricsHandler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, name='nsl-metrics-http', daemon=True).start()
+        logger.info(f"Serving metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+    def stop(self):
+        """Stop serving metrics over HTTP"""
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+
+metrics_exporter = MetricsExporter()
+
+
+# Inline button payloads. Each one is an action code, integer parameters,
+# a bot name and an optional string argument packed into bytes and sent as
+# base64url. Payloads that don't fit callback_data are kept in a token table
+CALLBACK_ACTIONS = ('log', 'filter', 'download', 'follow', 'unfollow', 'search', 'result', 'errors')
+CALLBACK_CODES = {action: code for code, action in enumerate(CALLBACK_ACTIONS)}
+# Allowed (min, max) of each parameter by action; payloads are client-supplied,
+# so callbacks with another parameter count or out of range values are rejected
+CALLBACK_PARAMS: Dict[str, Tuple[Tuple[int, int], ...]] = {
+    'log': ((1, LOG_VIEW_MAX_LINES),),  # Lines
+    'result': ((1, 2 ** 63), (0, 2 ** 31)),  # Result id, page
+}
+CALLBACK_INLINE = '.'
+CALLBACK_TOKEN = '~'
+CALLBACK_DATA_LIMIT = 64
+
+
+class CallbackAction(NamedTuple):
+    """Decoded inline button payload"""
+    action: str
+    bot_name: str = ''
+    params: Tuple[int, ...] = ()
+    arg: str = ''
+
+
+def _pack_varint(value: int) -> bytes:
+    """Pack a non-negative integer as a varint"""
+    if value < 0:
+        raise ValueError(f"Negative callback parameter: {value}")
+    out = bytearray()
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _unpack_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    """Unpack a varint at pos, return (value, next pos)"""
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _b64encode(data: bytes) -> str:
+    """Encode bytes as unpadded base64url"""
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text: str) -> bytes:
+    """Decode unpadded base64url"""
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def pack_callback(action: CallbackAction) -> bytes:
+    """Pack a callback action into bytes"""
+    bot_name = action.bot_name.encode('utf-8')
+    return b''.join([
+        bytes([CALLBACK_CODES[action.action], len(action.params)]),
+        *(_pack_varint(param) for param in action.params),
+        _pack_varint(len(bot_name)),
+        bot_name,
+        action.arg.encode('utf-8')
+    ])
+
+
+def unpack_callback(data: bytes) -> CallbackAction:
+    """Unpack bytes built by pack_callback, raises on malformed input"""
+    action = CALLBACK_ACTIONS[data[0]]
+    pos = 2
+    params = []
+    for _ in range(data[1]):
+        param, pos = _unpack_varint(data, pos)
+        params.append(param)
+    length, pos = _unpack_varint(data, pos)
+    if pos + length > len(data):
+        raise ValueError("Truncated callback payload")
+    bot_name = data[pos:pos + length].decode('utf-8')
+    arg = data[pos + length:].decode('utf-8')
+    return CallbackAction(action, bot_name, tuple(params), arg)
+
+
+class CallbackTokens:
+    """Server-side payloads of buttons too large for callback_data"""
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.tokens: 'OrderedDict[int, Tuple[float, bytes]]' = OrderedDict()
+        self.ids: Dict[bytes, int] = {}
+        self.counter = 0
+
+    def put(self, payload: bytes) -> int:
+        """Store a payload, return its token; equal payloads share a token"""
+        now = time.monotonic()
+        with self.lock:
+            token = self.ids.get(payload)
+            if token is None:
+                self.counter += 1
+                token = self.counter
+                self.ids[payload] = token
+            self.tokens[token] = (now + self.ttl, payload)
+            self.tokens.move_to_end(token)
+            while len(self.tokens) > self.max_size:
+                self._evict()
+            while self.tokens and next(iter(self.tokens.values()))[0] < now:
+                self._evict()
+            return token
+
+    def get(self, token: int) -> Optional[bytes]:
+        """Get a stored payload, None if it expired or was evicted"""
+        with self.lock:
+            entry = self.tokens.get(token)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            return entry[1]
+
+    def _evict(self):
+        """Drop the least recently stored token"""
+        _, (_, payload) = self.tokens.popitem(last=False)
+        del self.ids[payload]
+
+
+callback_tokens = CallbackTokens(CALLBACK_TOKEN_TTL, CALLBACK_TOKEN_LIMIT)
+
+
+def encode_callback(action: str, bot_name: str = '', *params: int, arg: str = '') -> str:
+    """Encode button payload into callback_data"""
+    payload = pack_callback(CallbackAction(action, bot_name, params, arg))
+    data = CALLBACK_INLINE + _b64encode(payload)
+    if len(data) <= CALLBACK_DATA_LIMIT:
+        return data
+    return CALLBACK_TOKEN + _b64encode(_pack_varint(callback_tokens.put(payload)))
+
+
+def check_callback_params(action: CallbackAction) -> bool:
+    """Check parameter count and ranges of a decoded action"""
+    ranges = CALLBACK_PARAMS.get(action.action, ())
+    return len(action.params) == len(ranges) and all(
+        low <= param <= high for param, (low, high) in zip(action.params, ranges)
+    )
+
+
+def decode_callback(data: str) -> Optional[CallbackAction]:
+    """Decode callback_data, None if it is malformed or its token expired"""
+    try:
+        if data.startswith(CALLBACK_INLINE):
+            payload = _b64decode(data[1:])
+        elif data.startswith(CALLBACK_TOKEN):
+            token, _ = _unpack_varint(_b64decode(data[1:]), 0)
+            payload = callback_tokens.get(token)
+            if payload is None:
+                return None
+        else:
+            return None
+        return unpack_callback(payload)
+    except (ValueError, IndexError, UnicodeDecodeError):
+        return None
+
+
+class LogUpload(NamedTuple):
+    """Uploaded log file version and the Telegram documents it was sent as"""
+    version: Tuple[int, int, int]     # (inode, size, mtime_ns)
+    documents: List[Tuple[str, str]]  # (file_id, caption)
+
+
+# Last upload of each log file, resent by file_id while the file is unchanged,
+# and chats waiting for an upload of a file version already in progress
+_log_uploads: Dict[str, LogUpload] = {}
+_pending_downloads: Dict[Tuple[str, Tuple[int, int, int]], List[int]] = {}
+_downloads_lock = threading.Lock()
+
+
+def resend_log_file(chat_id: int, documents: List[Tuple[str, str]]):
+    """Send already uploaded log file parts by file_id"""
+    for file_id, caption in documents:
+        bot.send_document(chat_id, file_id, caption=caption)
+
+
+def deliver_log_file(chat_id: int, bot_name: str, path: str):
+    """Send log file, reusing an upload of the same file version; report failures to the chat"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        bot.send_message(chat_id, "❌ Файл логов не найден")
+        return
+    version = (st.st_ino, st.st_size, st.st_mtime_ns)
+    key = (path, version)
+
+    with _downloads_lock:
+        upload = _log_uploads.get(path)
+        if upload is None or upload.version != version:
+            if key in _pending_downloads:
+                # Same file version is being uploaded, it is resent here when done
+                _pending_downloads[key].append(chat_id)
+                metrics.inc('nsl_downloads_total', mode='coalesced')
+                return
+            _pending_downloads[key] = []
+
+    if upload is not None and upload.version == version:
+        try:
+            resend_log_file(chat_id, upload.documents)
+            metrics.inc('nsl_downloads_total', mode='file_id')
+            logger.info(f"Resent unchanged logs of {bot_name} by file_id")
+        except Exception as e:
+            logger.error(f"Error resending log file: {e}")
+            with _downloads_lock:
+                _log_uploads.pop(path, None)
+            bot.send_message(chat_id, "❌ Ошибка при отправке файла")
+        return
+
+    documents = None
+    try:
+        documents = send_log_file(chat_id, bot_name, path)
+        metrics.inc('nsl_downloads_total', mode='upload')
+    except Exception as e:
+        logger.error(f"Error sending log file: {e}")
+        bot.send_message(chat_id, "❌ Ошибка при отправке файла")
+    finally:
+        with _downloads_lock:
+            waiting = _pending_downloads.pop(key)
+            if documents:
+                _log_uploads[path] = LogUpload(version, documents)
+
+    for waiting_chat_id in waiting:
+        try:
+            if not documents:
+                raise RuntimeError("upload failed")
+            resend_log_file(waiting_chat_id, documents)
+        except Exception as e:
+            logger.error(f"Error sending log file: {e}")
+            bot.send_message(waiting_chat_id, "❌ Ошибка при отправке файла")
+
+
+def create_main_keyboard(username: str) -> ReplyKeyboardMarkup:
+    """Create main keyboard based on user's access level"""
+    from telebot.types import KeyboardButton, ReplyKeyboardMarkup
+
+    user_bots = get_user_bots(username)
+    keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
+
+    if not user_bots:
+        keyboard.add(KeyboardButton("🔄 Обновить"))
+        return keyboard
+
+    # Add buttons for each bot the user has access to
+    row = []
+    for i, bot_name in enumerate(user_bots):
+        row.append(KeyboardButton(f"📊 {bot_name}"))
+        if (i + 1) % 2 == 0 or i == len(user_bots) - 1:
+            keyboard.add(*row)
+            row = []
+
+    # Add utility buttons
+    keyboard.add(KeyboardButton("📈 Сводка"), KeyboardButton("🔄 Обновить"))
+
+    return keyboard
+
+
+def create_bot_keyboard(bot_name: str) -> InlineKeyboardMarkup:
+    """Create inline keyboard for a specific bot"""
+    from telebot.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+    keyboard = InlineKeyboardMarkup(row_width=2)
+
+    keyboard.add(
+        InlineKeyboardButton("📃 20 строк", callback_data=encode_callback('log', bot_name, 20)),
+        InlineKeyboardButton("📋 50 строк", callback_data=encode_callback('log', bot_name, 50)),
+        InlineKeyboardButton("📥 Скачать логи", callback_data=encode_callback('download', bot_name)),
+        InlineKeyboardButton("▶️ Следить", callback_data=encode_callback('follow', bot_name)),
+        InlineKeyboardButton("🔍 Поиск", callback_data=encode_callback('search', bot_name)),
+        InlineKeyboardButton("🔴 Ошибки", callback_data=encode_callback('filter', bot_name, arg='error')),
+        InlineKeyboardButton("🟡 Предупреждения", callback_data=encode_callback('filter', bot_name, arg='warning')),
+        InlineKeyboardButton("⏱ 15 минут", callback_data=encode_callback('filter', bot_name, arg='15m')),
+        InlineKeyboardButton("🧯 Топ ошибок", callback_data=encode_callback('errors', bot_name))
+    )
+
+    return keyboard
+
+
+def create_follow_keyboard(bot_name: str) -> InlineKeyboardMarkup:
+    """Create inline keyboard for a live follow message"""
+    from telebot.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+    keyboard = InlineKeyboardMarkup()
+    keyboard.add(InlineKeyboardButton("⏹ Остановить", callback_data=encode_callback('unfollow', bot_name)))
+    return keyboard
+
+
+def register_user(username: str, user_id: int, first_name: str) -> bool:
+    """Register new user in database"""
+    conn = get_db_connection()
+    try:
+        # Check if user already exists
+        if db_execute('user_exists', (username,)).fetchone():
+            return True
+
+        # Insert new user
+        db_execute('insert_user', (username, user_id, first_name))
+
+        conn.commit()
+        invalidate_user_access(username)
+        logger.info(f"Registered new user @{username} (ID: {user_id})")
+        return True
+
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Error registering user @{username}: {e}")
+        return False
+
+
+@message_handler(commands=['start'])
+def handle_start(message: Message):
+    """Handle /start command"""
+    username = message.from_user.username
+    user_id = message.from_user.id
+    first_name = message.from_user.first_name or "Unknown"
+
+    logger.info(f"Received /start from @{username} (ID: {user_id})")
+
+    # Check if user is allowed
+    if not is_user_allowed(username, user_id):
+        from telebot.types import ReplyKeyboardRemove
+        bot.send_message(
+            message.chat.id,
+            "❌ У вас нет доступа к этому боту.\n\n"
+            "Этот бот предназначен только для администраторов системы.",
+            reply_markup=ReplyKeyboardRemove()
+        )
+        return
+
+    # Register new user if needed
+    if not register_user(username, user_id, first_name):
+        bot.send_message(
+            message.chat.id,
+            "❌ Ошибка регистрации. Обратитесь к администратору."
+        )
+        return
+
+    # Send welcome message with keyboard
+    user_bots = get_user_bots(username)
+    if not user_bots:
+        bot.send_message(
+            message.chat.id,
+            "👋 Добро пожаловать в NS Logger!\n\n"
+            "❌ У вас нет доступа ни к одному боту.\n"
+            "Обратитесь к оператору системы для получения прав доступа.",
+            reply_markup=create_main_keyboard(username)
+        )
+    else:
+        bot.send_message(
+            message.chat.id,
+            "👋 Добро пожаловать в NS Logger!\n\n"
+            "Выберите бот для просмотра логов:",
+            reply_markup=create_main_keyboard(username)
+        )
+
+
+@message_handler(commands=['me'])
+def handle_me(message: Message):
+    """Handle /me command"""
+    username = message.from_user.username
+    user_id = message.from_user.id
+
+    logger.info(f"Received /me from @{username} (ID: {user_id})")
+
+    # Check if user is allowed
+    if not is_user_allowed(username, user_id):
+        from telebot.types import ReplyKeyboardRemove
+        bot.send_message(
+            message.chat.id,
+            "❌ У вас нет доступа к этому боту.",
+            reply_markup=ReplyKeyboardRemove()
+        )
+        return
+
+    try:
+        # Get user data
+        user_data = db_execute('user_info', (username,)).fetchone()
+        if not user_data:
+            bot.send_message(message.chat.id, "❌ Пользователь не найден.")
+            return
+
+        # Prepare rank text
+        rank = get_user_rank(username)  # Get actual rank with hierarchy
+        rank_text = RANK_TEXT.get(rank, '👤 Пользователь')
+
+        # Prepare banned status
+        banned_status = "✅ Нет" if not user_data['banned'] else "❌ Да"
+        response = (
+            "👤 Информация о пользователе\n\n"
+            f"📧 Username: @{username}\n"
+            f"👨‍💼 Ранг: {rank_text}\n"
+            f"🆔 ID: {user_data['user_id']}\n"
+            f"📛 Имя: {user_data['first_name']}"
+        )
+        # Prepare response based on rank
+        if not rank in ['gadmin', 'operator']:
+            max_warn = int(os.getenv('MAX_WARN', 3))
+            response += (
+                f"\n📊 Ограничения: {banned_status}\n"
+                f"💢 Предупреждения: {user_data['warns']}/{max_warn}"
+            )
+
+        bot.send_message(message.chat.id, response)
+
+    except Exception as e:
+        logger.error(f"Error in /me command for @{username}: {e}")
+        bot.send_message(message.chat.id, "❌ Ошибка получения информации.")
+
+
+@message_handler(func=lambda message: message.text == "🔄 Обновить")
+def handle_refresh(message: Message):
+    """Handle refresh button"""
+    username = message.from_user.username
+    user_id = message.from_user.id
+
+    logger.info(f"Received refresh from @{username} (ID: {user_id})")
+
+    # Check if user is allowed
+    if not is_user_allowed(username, user_id):
+        from telebot.types import ReplyKeyboardRemove
+        bot.send_message(
+            message.chat.id,
+            "❌ У вас нет доступа к этому боту.",
+            reply_markup=ReplyKeyboardRemove()
+        )
+        return
+
+    user_bots = get_user_bots(username)
+    if not user_bots:
+        bot.send_message(
+            message.chat.id,
+            "🔄 Список обновлен!\n\n"
+            "❌ У вас по-прежнему нет доступа ни к одному боту.\n"
+            "Обратитесь к оператору системы для получения прав доступа.",
+            reply_markup=create_main_keyboard(username)
+        )
+    else:
+        bot.send_message(
+            message.chat.id,
+            "🔄 Список ботов обновлен!",
+            reply_markup=create_main_keyboard(username)
+        )
+
+
+@message_handler(commands=['stats'])
+def handle_stats(message: Message):
+    """Handle /stats command"""
+    username = message.from_user.username
+    user_id = message.from_user.id
+
+    logger.info(f"Received /stats command from @{username} (ID: {user_id})")
+
+    # Performance metrics are for operators and global admins only
+    if not is_user_allowed(username, user_id) or get_user_rank(username) not in ('operator', 'gadmin'):
+        bot.send_message(message.chat.id, "❌ Статистика доступна только операторам и глобальным администраторам.")
+        return
+
+    bot.send_message(message.chat.id, render_stats(), parse_mode='HTML')
+
+
+@message_handler(commands=['alerts'])
+def handle_alerts(message: Message):
+    """Handle /alerts command"""
+    username = message.from_user.username
+    user_id = message.from_user.id
+
+    logger.info(f"Received /alerts command from @{username} (ID: {user_id})")
+
+    # Check if user is allowed
+    if not is_user_allowed(username, user_id):
+        bot.send_message(message.chat.id, "❌ У вас нет доступа к этому боту.")
+        return
+
+    if not get_user_bots(username):
+        bot.send_message(message.chat.id, "❌ У вас нет доступа ни к одному боту.")
+        return
+
+    args = message.text.split()[1:]
+    conn = get_db_connection()
+    try:
+        if not args:
+            subscribed = db_execute('alert_subscribed', (username,)).fetchone() is not None
+            bot.send_message(
+                message.chat.id,
+                ("🔔 Оповещения включены." if subscribed else "🔕 Оповещения выключены.")
+                + "\nИспользование: /alerts on | off"
+            )
+            return
+
+        if args[0].lower() == 'on':
+            db_execute('subscribe_alerts', (username, int(time.time())))
+            text = "🔔 Оповещения о всплесках ошибок, новых ошибках и тишине в логах ваших ботов включены."
+        elif args[0].lower() == 'off':
+            db_execute('unsubscribe_alerts', (username,))
+            text = "🔕 Оповещения выключены."
+        else:
+            bot.send_message(message.chat.id, "❌ Использование: /alerts on | off")
+            return
+
+        conn.commit()
+        logger.info(f"User @{username} turned alerts {args[0].lower()}")
+        bot.send_message(message.chat.id, text)
+
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Error changing alerts of @{username}: {e}")
+        bot.send_message(message.chat.id, "❌ Ошибка при изменении оповещений.")
+
+
+@message_handler(func=lambda message: message.text == "📈 Сводка")
+def handle_summary(message: Message):
+    """Handle summary button"""
+    username = message.from_user.username
+    user_id = message.from_user.id
+
+    logger.info(f"Received summary request from @{username} (ID: {user_id})")
+
+    # Check if user is allowed
+    if not is_user_allowed(username, user_id):
+        from telebot.types import ReplyKeyboardRemove
+        bot.send_message(
+            message.chat.id,
+            "❌ У вас нет доступа к этому боту.",
+            reply_markup=ReplyKeyboardRemove()
+        )
+        return
+
+    user_bots = get_user_bots(username)
+    if not user_bots:
+        bot.send_message(message.chat.id, "❌ У вас нет доступа ни к одному боту.")
+        return
+
+    bot.send_message(message.chat.id, render_summary(user_bots), parse_mode='HTML')
+
+
+@message_handler(func=lambda message: message.text.startswith("📊 "))
+def handle_bot_selection(message: Message):
+    """Handle bot selection from keyboard"""
+    username = message.from_user.username
+    user_id = message.from_user.id
+
+    # Extract bot name from button text
+    bot_name = message.text[2:]  # Remove "📊 " prefix
+
+    logger.info(f"User @{username} selected bot {bot_name}")
+
+    # Check if user has access to this bot
+    user_bots = get_user_bots(username)
+    if bot_name not in user_bots:
+        logger.warning(f"User @{username} tried to access unauthorized bot {bot_name}")
+        bot.send_message(
+            message.chat.id,
+            f"❌ У вас нет доступа к логам бота {bot_name}."
+        )
+        return
+
+    # Send bot options
+    bot.send_message(
+        message.chat.id,
+        f"🤖 Выбран бот: {bot_name}\n\n"
+        "Выберите действие:",
+        reply_markup=create_bot_keyboard(bot_name)
+    )
+
+
+# Callback handlers by action, all inline buttons go through handle_callback
+CALLBACK_HANDLERS: Dict[str, Callable] = {}
+
+
+def callback_handler(action: str):
+    """Register a handler for a callback action"""
+    def decorator(func):
+        CALLBACK_HANDLERS[action] = func
+        return func
+    return decorator
+
+
+@callback_query_handler(func=lambda call: True)
+def handle_callback(call):
+    """Decode callback data and dispatch it to the action's handler"""
+    action = decode_callback(call.data)
+    handler = CALLBACK_HANDLERS.get(action.action) if action else None
+    if handler is None:
+        bot.answer_callback_query(call.id, "⌛ Кнопка устарела, откройте меню заново.")
+        return
+    if not check_callback_params(action):
+        logger.warning(f"Rejected callback {action} from @{call.from_user.username}")
+        bot.answer_callback_query(call.id, "⌛ Кнопка устарела, откройте меню заново.")
+        return
+
+    started = time.perf_counter()
+    try:
+        handler(call, action)
+    except Exception:
+        metrics.inc('nsl_handler_errors_total', handler=handler.__name__)
+        raise
+    finally:
+        handler_seconds[handler.__name__].observe(time.perf_counter() - started)
+
+
+@callback_handler('log')
+def handle_log_callback(call, action: CallbackAction):
+    """Handle log view callback"""
+    username = call.from_user.username
+    user_id = call.from_user.id
+
+    bot_name = action.bot_name
+    num_lines = action.params[0]
+
+    logger.info(f"User @{username} requested {num_lines} lines from {bot_name}")
+
+    # Check if user has access to this bot
+    user_bots = get_user_bots(username)
+    if bot_name not in user_bots:
+        logger.warning(f"User @{username} tried to access unauthorized bot {bot_name}")
+        bot.answer_callback_query(call.id, "❌ У вас нет доступа к этому боту.")
+        return
+
+    text, keyboard = open_log_view(call.message.chat.id, bot_name, num_lines)
+    if keyboard is None:
+        bot.answer_callback_query(call.id, text)
+        return
+
+    # Send log content as a quote, starting from the newest page
+    try:
+        bot.send_message(call.message.chat.id, text, parse_mode='HTML', reply_markup=keyboard)
+        bot.answer_callback_query(call.id, "✅ Логи получены")
+    except Exception as e:
+        logger.error(f"Error sending log message: {e}")
+        bot.answer_callback_query(call.id, "❌ Ошибка при отправке логов.")
+
+
+def open_log_view(chat_id: int, bot_name: str, num_lines: int) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """Keep the last lines of a bot's log as a paged result and render its newest page
+
+    The keyboard is None when the text is a refusal to answer the callback with.
+    """
+    backend = get_log_backend(bot_name)
+    source = None
+    if isinstance(backend, FileLogBackend):
+        # Get log lines, taking older ones from rotated segments if the current
+        # file is shorter than requested
+        snapshot = get_log_tail(bot_name, num_lines)
+        current = snapshot.lines if snapshot else []
+        older = LogSource(bot_name).rotated_tail(num_lines - len(current)) if len(current) < num_lines else []
+
+        # Pages of the current file are byte ranges, page turns re-read only their range
+        pages = paginate_lines(older) if older else []
+        if current:
+            pages += pack_line_ranges(snapshot)
+            source = (get_log_path(bot_name), snapshot.inode)
+    else:
+        lines = backend.tail(num_lines)
+        pages = paginate_lines(lines) if lines else []
+
+    if not pages:
+        return f"❌ Не удалось получить логи бота {bot_name}. Файл не найден или пуст.", None
+
+    result_id = store_paged_result(
+        chat_id,
+        bot_name,
+        f"📄 Логи бота {html.escape(bot_name)} (последние {num_lines} строк):",
+        pages,
+        source=source
+    )
+    rendered = render_paged_result(result_id, len(pages) - 1)
+    if rendered is None:
+        return "❌ Файл логов изменился, попробуйте ещё раз.", None
+    return rendered
+
+
+@callback_handler('filter')
+def handle_filter_callback(call, action: CallbackAction):
+    """Handle filtered log view callback"""
+    username = call.from_user.username
+
+    bot_name = action.bot_name
+    parsed = parse_log_filter([action.arg])
+    if parsed is None:
+        bot.answer_callback_query(call.id, "⌛ Кнопка устарела, откройте меню заново.")
+        return
+    count, log_filter = parsed
+
+    logger.info(f"User @{username} requested {log_filter.describe()} from {bot_name}")
+
+    # Check if user has access to this bot
+    user_bots = get_user_bots(username)
+    if bot_name not in user_bots:
+        logger.warning(f"User @{username} tried to access unauthorized bot {bot_name}")
+        bot.answer_callback_query(call.id, "❌ У вас нет доступа к этому боту.")
+        return
+
+    refusal = check_rate_limit(username, bot_name)
+    if refusal:
+        bot.answer_callback_query(call.id, refusal)
+        return
+
+    if not io_pool.submit(send_filtered_logs, call.message.chat.id, bot_name, count, log_filter):
+        refund_rate_limit(username, bot_name)
+        bot.answer_callback_query(call.id, BUSY_TEXT)
+        return
+    bot.answer_callback_query(call.id, "⏳ Чтение логов...")
+
+
+@message_handler(commands=['tail'])
+def handle_tail(message: Message):
+    """Handle /tail command"""
+    username = message.from_user.username
+    user_id = message.from_user.id
+
+    # Check if user is allowed
+    if not is_user_allowed(username, user_id):
+        bot.send_message(message.chat.id, "❌ У вас нет доступа к этому боту.")
+        return
+
+    args = message.text.split()
+    parsed = parse_log_filter(args[2:])
+    if len(args) < 2 or parsed is None:
+        bot.send_message(
+            message.chat.id,
+            "ℹ️ Использование: /tail <бот> [количество] [уровень] [окно] [логгер]\n\n"
+            f"Количество — от 1 до {FILTER_MAX_RECORDS} записей. Например: /tail mybot 30 error 2h app.db"
         )
         return
 
-    # Send log content as a quote
-    try:
-        # Truncate if too long for Telegram (4096 characters limit)
-        if len(log_content) > 4000:
-            log_content = log_content[-4000:]
-            logger.warning(f"Truncated log content for {bot_name}")
+    bot_name = args[1]
+    if bot_name not in get_user_bots(username):
+        logger.warning(f"User @{username} tried to access unauthorized bot {bot_name}")
+        bot.send_message(message.chat.id, f"❌ У вас нет доступа к логам бота {bot_name}.")
+        return
+
+    count, log_filter = parsed
+    logger.info(f"User @{username} requested {log_filter.describe()} from {bot_name}")
+
+    refusal = check_rate_limit(username, bot_name)
+    if refusal:
+        bot.send_message(message.chat.id, refusal)
+        return
+
+    if not io_pool.submit(send_filtered_logs, message.chat.id, bot_name, count, log_filter):
+        refund_rate_limit(username, bot_name)
+        bot.send_message(message.chat.id, BUSY_TEXT)
+
+
+@message_handler(commands=['export'])
+def handle_export(message: Message):
+    """Handle /export command"""
+    username = message.from_user.username
+    user_id = message.from_user.id
+
+    # Check if user is allowed
+    if not is_user_allowed(username, user_id):
+        bot.send_message(message.chat.id, "❌ У вас нет доступа к этому боту.")
+        return
 
+    args = message.text.split()
+    period = parse_export_range(args[2:]) if len(args) >= 3 else None
+    if period is None:
         bot.send_message(
-            call.message.chat.id,
-            f"📄 Логи бота {bot_name} (последние {num_lines} строк):\n\n"
-            f"<code>{log_content}</code>",
-            parse_mode='HTML'
+            message.chat.id,
+            "ℹ️ Использование: /export <бот> <окно> или /export <бот> <начало> [конец]\n\n"
+            "Например: /export mybot 6h или /export mybot 2024-01-30 2024-01-31T12:00"
         )
-        bot.answer_callback_query(call.id, "✅ Логи получены")
-    except Exception as e:
-        logger.error(f"Error sending log message: {e}")
-        bot.answer_callback_query(
-            call.id,
-            "❌ Ошибка при отправке логов. Возможно, логи слишком длинные."
+        return
+
+    bot_name = args[1]
+    if bot_name not in get_user_bots(username):
+        logger.warning(f"User @{username} tried to export logs of unauthorized bot {bot_name}")
+        bot.send_message(message.chat.id, f"❌ У вас нет доступа к логам бота {bot_name}.")
+        return
+
+    logger.info(f"User @{username} exported logs of {bot_name} for {args[2:]}")
+
+    refusal = check_rate_limit(username, bot_name)
+    if refusal:
+        bot.send_message(message.chat.id, refusal)
+        return
+
+    if not io_pool.submit(export_log_range, message.chat.id, bot_name, *period):
+        refund_rate_limit(username, bot_name)
+        bot.send_message(message.chat.id, BUSY_TEXT)
+        return
+    bot.send_message(message.chat.id, "⏳ Подготовка файла логов...")
+
+
+def render_top_errors(groups: List[dict]) -> List[str]:
+    """Render error groups as pages: count, title, first and last time and a sample"""
+    blocks = []
+    for group in groups:
+        first = time.strftime('%Y-%m-%d %H:%M', time.localtime(group['first_seen']))
+        last = time.strftime('%Y-%m-%d %H:%M', time.localtime(group['last_seen']))
+        blocks.append(
+            f"×{group['count']} {group['title']}\n"
+            f"первая: {first}, последняя: {last}\n"
+            f"{group['sample']}"
         )
+    return paginate_lines('\n\n'.join(blocks).split('\n'))
+
+
+@callback_handler('errors')
+def handle_errors_callback(call, action: CallbackAction):
+    """Handle top errors callback"""
+    username = call.from_user.username
+
+    bot_name = action.bot_name
+
+    logger.info(f"User @{username} requested top errors of {bot_name}")
+
+    # Check if user has access to this bot
+    user_bots = get_user_bots(username)
+    if bot_name not in user_bots:
+        logger.warning(f"User @{username} tried to access unauthorized bot {bot_name}")
+        bot.answer_callback_query(call.id, "❌ У вас нет доступа к этому боту.")
+        return
+
+    try:
+        groups, group_count, error_count = run_log_query('errors', bot_name)
+    except (sqlite3.Error, OSError, RuntimeError) as e:
+        logger.error(f"Error loading top errors of {bot_name}: {e}")
+        bot.answer_callback_query(call.id, "❌ Ошибка при загрузке ошибок.")
+        return
+
+    bot.answer_callback_query(call.id)
+    if not groups:
+        bot.send_message(call.message.chat.id, f"🧯 В логах бота {bot_name} пока не найдено ошибок.")
+        return
+
+    title = (
+        f"🧯 Топ ошибок бота {html.escape(bot_name)} "
+        f"({len(groups)} из {group_count} групп, всего ошибок: {error_count}):"
+    )
+    result_id = store_paged_result(call.message.chat.id, bot_name, title, render_top_errors(groups))
+    text, keyboard = render_paged_result(result_id, 0)
+    bot.send_message(call.message.chat.id, text, parse_mode='HTML', reply_markup=keyboard)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('download_'))
-def handle_download_callback(call):
+@callback_handler('download')
+def handle_download_callback(call, action: CallbackAction):
     """Handle log download callback"""
     username = call.from_user.username
     user_id = call.from_user.id
 
-    # Parse callback data
-    bot_name = call.data.split('_')[1]
+    bot_name = action.bot_name
 
     logger.info(f"User @{username} requested download logs from {bot_name}")
 
@@ -552,26 +4839,191 @@ def handle_download_callback(call):
         bot.answer_callback_query(call.id, "❌ У вас нет доступа к этому боту.")
         return
 
-    # Send log file
-    log_file = os.path.join(LOGS_DIR, f"{bot_name}.log")
+    # Send log file; logs of other backends or nodes are streamed whole
+    log_file = get_log_path(bot_name)
+    is_file = isinstance(get_log_backend(bot_name), FileLogBackend)
 
-    if os.path.exists(log_file):
-        try:
-            with open(log_file, 'rb') as f:
-                bot.send_document(
-                    call.message.chat.id,
-                    f,
-                    caption=f"📁 Логи бота {bot_name}"
-                )
-            bot.answer_callback_query(call.id, "✅ Файл логов отправлен")
-        except Exception as e:
-            logger.error(f"Error sending log file: {e}")
-            bot.answer_callback_query(call.id, "❌ Ошибка при отправке файла")
+    if is_file and not os.path.exists(log_file):
+        bot.answer_callback_query(call.id, "❌ Файл логов не найден")
+        return
+
+    refusal = check_rate_limit(username, bot_name)
+    if refusal:
+        bot.answer_callback_query(call.id, refusal)
+        return
+
+    # Compressing and uploading runs on the I/O pool, so answer the query now
+    if is_file:
+        submitted = io_pool.submit(deliver_log_file, call.message.chat.id, bot_name, log_file)
     else:
+        submitted = io_pool.submit(export_log_range, call.message.chat.id, bot_name, 0, time.time())
+    if not submitted:
+        refund_rate_limit(username, bot_name)
+        bot.answer_callback_query(call.id, BUSY_TEXT)
+        return
+    bot.answer_callback_query(call.id, "⏳ Подготовка файла логов...")
+
+
+@callback_handler('follow')
+def handle_follow_callback(call, action: CallbackAction):
+    """Handle live log follow callback"""
+    username = call.from_user.username
+    chat_id = call.message.chat.id
+
+    bot_name = action.bot_name
+
+    logger.info(f"User @{username} requested live logs from {bot_name}")
+
+    # Check if user has access to this bot
+    user_bots = get_user_bots(username)
+    if bot_name not in user_bots:
+        logger.warning(f"User @{username} tried to follow logs of unauthorized bot {bot_name}")
+        bot.answer_callback_query(call.id, "❌ У вас нет доступа к этому боту.")
+        return
+
+    if cluster.route(bot_name):
+        bot.answer_callback_query(call.id, "❌ Логи бота хранятся на другом узле, слежение за ними недоступно.")
+        return
+
+    if not os.path.exists(get_log_path(bot_name)):
         bot.answer_callback_query(call.id, "❌ Файл логов не найден")
+        return
+
+    session = log_follower.subscribe(chat_id, username, bot_name)
+    if session is None:
+        bot.answer_callback_query(
+            call.id,
+            f"❌ Можно следить не более чем за {FOLLOW_MAX_PER_CHAT} ботами одновременно."
+        )
+        return
+
+    try:
+        message = bot.send_message(
+            chat_id,
+            session.render(),
+            parse_mode='HTML',
+            reply_markup=create_follow_keyboard(bot_name)
+        )
+        session.message_id = message.message_id
+        bot.answer_callback_query(call.id, "▶️ Слежение запущено")
+    except Exception as e:
+        logger.error(f"Error starting log follow: {e}")
+        log_follower.unsubscribe(chat_id, bot_name)
+        bot.answer_callback_query(call.id, "❌ Ошибка при запуске слежения")
+
+
+@callback_handler('unfollow')
+def handle_unfollow_callback(call, action: CallbackAction):
+    """Handle live log follow stop callback"""
+    bot_name = action.bot_name
+
+    session = log_follower.unsubscribe(call.message.chat.id, bot_name)
+    if session is not None:
+        stop_follow_message(session, "⏹ Слежение остановлено.")
+    else:
+        bot.edit_message_reply_markup(call.message.chat.id, call.message.message_id)
+    bot.answer_callback_query(call.id, "⏹ Слежение остановлено")
+
+
+@message_handler(commands=['grep'])
+def handle_grep(message: Message):
+    """Handle /grep command"""
+    username = message.from_user.username
+    user_id = message.from_user.id
+
+    # Check if user is allowed
+    if not is_user_allowed(username, user_id):
+        bot.send_message(message.chat.id, "❌ У вас нет доступа к этому боту.")
+        return
+
+    args = message.text.split(maxsplit=2)
+    if len(args) < 3:
+        bot.send_message(
+            message.chat.id,
+            "ℹ️ Использование: /grep <бот> [окно] <текст>\n\n"
+            "Окно — необязательный период поиска, например 15m, 2h или 1d. "
+            "Текст ищется как есть, без учёта регистра."
+        )
+        return
+
+    start_search(message, args[1], args[2])
+
+
+@callback_handler('search')
+def handle_search_callback(call, action: CallbackAction):
+    """Handle log search button"""
+    username = call.from_user.username
+    bot_name = action.bot_name
+
+    if bot_name not in get_user_bots(username):
+        logger.warning(f"User @{username} tried to search logs of unauthorized bot {bot_name}")
+        bot.answer_callback_query(call.id, "❌ У вас нет доступа к этому боту.")
+        return
+
+    prompt = bot.send_message(
+        call.message.chat.id,
+        f"🔍 Введите текст для поиска в логах бота {bot_name}.\n\n"
+        "Можно указать период перед текстом, например: 15m Traceback"
+    )
+    bot.register_next_step_handler(prompt, handle_search_query, bot_name)
+    bot.answer_callback_query(call.id)
 
 
-@bot.message_handler(func=lambda message: True)
+def handle_search_query(message: Message, bot_name: str):
+    """Handle search pattern sent after the search button"""
+    if not message.text:
+        bot.send_message(message.chat.id, "❌ Отправьте текст для поиска.")
+        return
+    start_search(message, bot_name, message.text)
+
+
+@callback_handler('result')
+def handle_result_page_callback(call, action: CallbackAction):
+    """Handle result page turn"""
+    from telebot.apihelper import ApiTelegramException
+
+    username = call.from_user.username
+    user_id = call.from_user.id
+    result_id, page = action.params
+
+    if not is_user_allowed(username, user_id):
+        bot.answer_callback_query(call.id, "❌ У вас нет доступа к этому боту.")
+        return
+
+    text, keyboard = open_result_page(call.message.chat.id, username, get_user_bots(username), result_id, page)
+    if keyboard is None:
+        bot.answer_callback_query(call.id, text)
+        return
+
+    try:
+        bot.edit_message_text(
+            text, call.message.chat.id, call.message.message_id,
+            parse_mode='HTML', reply_markup=keyboard
+        )
+    except ApiTelegramException as e:
+        # Pressing the current page number leaves the message unchanged
+        if 'message is not modified' not in str(e):
+            raise
+    bot.answer_callback_query(call.id)
+
+
+def open_result_page(chat_id: int, username: str, bots, result_id: int,
+                     page: int) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """Render a page of a stored result for a chat, the keyboard is None when the text is a refusal"""
+    # Result ids are sequential, so check that the result was sent to this
+    # chat and that its bot is still accessible
+    result = get_paged_result(result_id)
+    if result is not None and (result.chat_id != chat_id or result.bot_name not in bots):
+        logger.warning(f"User @{username} tried to open result {result_id} of {result.bot_name} without access")
+        return "❌ У вас нет доступа к этим результатам.", None
+
+    rendered = render_paged_result(result_id, page)
+    if rendered is None:
+        return "⌛ Результаты устарели, повторите запрос.", None
+    return rendered
+
+
+@message_handler(func=lambda message: True)
 def handle_unknown(message: Message):
     """Handle unknown messages"""
     username = message.from_user.username
@@ -586,16 +5038,467 @@ def handle_unknown(message: Message):
     )
 
 
+class WebhookServer:
+    """Local HTTP endpoint receiving updates from Telegram into a bounded intake queue"""
+
+    def __init__(self, host: str, port: int, path: str, secret: str, queue_size: int):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from telebot.types import Update
+
+        self.intake: 'queue.Queue' = queue.Queue(maxsize=queue_size)
+        self.received = 0
+        self.rejected = 0
+        server = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != path:
+                    self.send_error(404)
+                    return
+                token = self.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+                if not hmac.compare_digest(token.encode(), secret.encode()):
+                    logger.warning(f"Webhook request with invalid secret token from {self.client_address[0]}")
+                    self.send_error(403)
+                    return
+                try:
+                    length = int(self.headers.get('Content-Length', ''))
+                except ValueError:
+                    length = -1
+                if length <= 0:
+                    self.send_error(400, "Missing or invalid Content-Length")
+                    return
+                if length > WEBHOOK_MAX_BODY:
+                    self.send_error(413)
+                    return
+
+                try:
+                    update = Update.de_json(self.rfile.read(length).decode('utf-8'))
+                except Exception as e:
+                    logger.warning(f"Invalid webhook update: {e}")
+                    self.send_error(400)
+                    return
+
+                try:
+                    server.intake.put_nowait(update)
+                except queue.Full:
+                    # Telegram retries failed deliveries later
+                    server.rejected += 1
+                    self.send_error(503)
+                    return
+                server.received += 1
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                logger.debug(f"Webhook {self.client_address[0]}: {format % args}")
+
+        self.httpd = ThreadingHTTPServer((host, port), RequestHandler)
+        self.httpd.daemon_threads = True
+        self._consumer = threading.Thread(target=self._consume, name='webhook-intake', daemon=True)
+
+    def _consume(self):
+        while True:
+            update = self.intake.get()
+            if update is None:
+                return
+            try:
+                bot.process_new_updates([update])
+            except Exception as e:
+                logger.error(f"Error dispatching webhook update: {e}")
+
+    def serve(self):
+        """Serve requests until stop() is called"""
+        self._consumer.start()
+        self.httpd.serve_forever()
+
+    def stop(self):
+        """Stop accepting requests; safe to call from a signal handler"""
+        threading.Thread(target=self.httpd.shutdown, daemon=True).start()
+
+    def drain(self, timeout: float = 10):
+        """Dispatch updates still in the intake queue"""
+        self.httpd.server_close()
+        self.intake.put(None)
+        self._consumer.join(timeout)
+
+
+def run_webhook():
+    """Register the webhook with Telegram and serve updates locally"""
+    from urllib.parse import urlparse
+
+    if not WEBHOOK_URL or not WEBHOOK_SECRET:
+        raise RuntimeError("NSL_RUNTIME=webhook requires WEBHOOK_URL and WEBHOOK_SECRET")
+
+    server = WebhookServer(
+        WEBHOOK_HOST, WEBHOOK_PORT, urlparse(WEBHOOK_URL).path or '/',
+        WEBHOOK_SECRET, WEBHOOK_QUEUE_SIZE
+    )
+    bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())
+
+    logger.info(f"Webhook listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}")
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info(f"Stopping webhook, {server.intake.qsize()} updates left to dispatch")
+        server.drain()
+
+
+def run_cluster_polling():
+    """Poll for updates while this node holds the leader lease, wait as a standby otherwise"""
+    if NSL_RUNTIME != 'sync':
+        raise RuntimeError("NSL_RPC works with NSL_RUNTIME=sync only")
+
+    stopping = threading.Event()
+
+    def stop(signum, frame):
+        stopping.set()
+        bot.stop_polling()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    cluster.start()
+    logger.info(f"Node {NSL_NODE} joined the cluster, RPC on {NSL_RPC}")
+
+    retry_delay = POLLING_RETRY_MIN
+    try:
+        while not stopping.is_set():
+            if not cluster.leader.wait(1):
+                continue
+            logger.info(f"Node {NSL_NODE} is polling for updates")
+            try:
+                # Long polls shorter than a lease renewal, so a node that lost the
+                # lease stops before another one takes over
+                bot.polling(non_stop=True, long_polling_timeout=max(int(LEADER_LEASE / 3), 1))
+                retry_delay = POLLING_RETRY_MIN
+            except Exception as e:
+                # Network errors are not retried by telebot itself
+                logger.error(f"Polling failed on node {NSL_NODE}, retrying in {retry_delay:.0f}s: {e}")
+                stopping.wait(retry_delay)
+                retry_delay = min(retry_delay * 2, POLLING_RETRY_MAX)
+    finally:
+        cluster.release()
+
+
+class AsyncDB:
+    """Awaitable queries, run on one thread with its own connection like aiosqlite does"""
+
+    def __init__(self):
+        self._executor = None
+
+    async def run(self, func: Callable, *args):
+        """Call a function using the database without blocking the event loop"""
+        import asyncio
+        if self._executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='async-db')
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def fetchall(self, name: str, params=()) -> List[sqlite3.Row]:
+        """Run a named statement and fetch its rows without blocking the event loop"""
+        return await self.run(lambda: db_execute(name, params).fetchall())
+
+    def close(self):
+        """Close the connection and stop the thread"""
+        if self._executor is not None:
+            self._executor.submit(close_thread_db_connection)
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+async_db = AsyncDB()
+
+
+async def resolve_user_access_async(username: str) -> Optional[UserAccess]:
+    """Get user's permissions like resolve_user_access, querying through async_db"""
+    now = time.monotonic()
+    access, generation = _cached_user_access(username, now)
+    if access is not None:
+        return access
+
+    try:
+        rows = await async_db.fetchall('user_access', {'username': username})
+    except Exception as e:
+        logger.error(f"Error resolving access for {username}: {e}")
+        return None
+    return _store_user_access(username, rows, generation, now)
+
+
+# Coroutine handlers of the async runtime by callback action; actions
+# without one run their sync handler on update_dispatcher
+ASYNC_CALLBACK_HANDLERS: Dict[str, Callable] = {}
+
+
+def async_callback_handler(action: str):
+    """Register a coroutine handler for a callback action"""
+    def decorator(func):
+        ASYNC_CALLBACK_HANDLERS[action] = func
+        return func
+    return decorator
+
+
+@async_callback_handler('log')
+async def handle_log_callback_async(api, call, action: CallbackAction):
+    """Handle log view callback on the event loop"""
+    import asyncio
+    username = call.from_user.username
+    bot_name = action.bot_name
+    num_lines = action.params[0]
+
+    logger.info(f"User @{username} requested {num_lines} lines from {bot_name}")
+
+    access = await resolve_user_access_async(username)
+    if access is None or bot_name not in access.bots:
+        logger.warning(f"User @{username} tried to access unauthorized bot {bot_name}")
+        await api.answer_callback_query(call.id, "❌ У вас нет доступа к этому боту.")
+        return
+
+    # File reads run on a thread, the loop keeps serving other users
+    text, keyboard = await asyncio.to_thread(open_log_view, call.message.chat.id, bot_name, num_lines)
+    if keyboard is None:
+        await api.answer_callback_query(call.id, text)
+        return
+
+    try:
+        await api.send_message(call.message.chat.id, text, parse_mode='HTML', reply_markup=keyboard)
+        await api.answer_callback_query(call.id, "✅ Логи получены")
+    except Exception as e:
+        logger.error(f"Error sending log message: {e}")
+        await api.answer_callback_query(call.id, "❌ Ошибка при отправке логов.")
+
+
+@async_callback_handler('result')
+async def handle_result_page_callback_async(api, call, action: CallbackAction):
+    """Handle result page turn on the event loop"""
+    import asyncio
+    from telebot.asyncio_helper import ApiTelegramException
+    username = call.from_user.username
+    user_id = call.from_user.id
+    result_id, page = action.params
+
+    access = await resolve_user_access_async(username) if username else None
+    if not check_user_allowed(username, user_id, access):
+        await api.answer_callback_query(call.id, "❌ У вас нет доступа к этому боту.")
+        return
+
+    text, keyboard = await asyncio.to_thread(
+        open_result_page, call.message.chat.id, username, access.bots, result_id, page
+    )
+    if keyboard is None:
+        await api.answer_callback_query(call.id, text)
+        return
+
+    try:
+        await api.edit_message_text(
+            text, call.message.chat.id, call.message.message_id,
+            parse_mode='HTML', reply_markup=keyboard
+        )
+    except ApiTelegramException as e:
+        # Pressing the current page number leaves the message unchanged
+        if 'message is not modified' not in str(e):
+            raise
+    await api.answer_callback_query(call.id)
+
+
+class AsyncRuntime:
+    """Update intake on an asyncio event loop, running handlers in order per user
+
+    Callbacks with a coroutine handler run on the loop; every other update
+    goes to the sync handlers on update_dispatcher, and the user's next
+    update waits until it is handled.
+    """
+
+    def __init__(self, api):
+        self.api = api  # AsyncTeleBot sending replies
+        self.latency = LatencyHistogram()
+        self.rejected = 0
+        self.offset = None
+        self._lanes: Dict[object, object] = {}  # Key -> last task of the key
+        self._pending = 0
+
+    def depth(self) -> int:
+        """Get number of queued and running updates"""
+        return self._pending
+
+    def submit(self, update: telebot.types.Update) -> bool:
+        """Handle update after earlier updates of the same user, False when full"""
+        import asyncio
+        user_id = get_update_user_id(update)
+        if self._pending >= HANDLER_QUEUE_SIZE:
+            self.rejected += 1
+            logger.warning(f"Handler queue is full ({self._pending}), rejected update from {user_id}")
+            # Kept in the lanes until the reply is sent, so drain() waits for it
+            key = ('update', update.update_id)
+            self._lanes[key] = task = asyncio.ensure_future(self.reject(update))
+            task.add_done_callback(lambda task: self._lanes.pop(key, None))
+            return False
+
+        key = user_id if user_id is not None else ('update', update.update_id)
+        self._pending += 1
+        self._lanes[key] = task = asyncio.ensure_future(self._handle(update, key, self._lanes.get(key)))
+        task.add_done_callback(lambda task: self._done(key, task))
+        return True
+
+    def _done(self, key, task):
+        self._pending -= 1
+        if self._lanes.get(key) is task:
+            del self._lanes[key]
+
+    async def _handle(self, update: telebot.types.Update, key, previous):
+        import asyncio
+        if previous is not None:
+            await asyncio.wait([previous])
+
+        started = time.perf_counter()
+        try:
+            call = update.callback_query
+            action = decode_callback(call.data) if call is not None and call.data else None
+            handler = ASYNC_CALLBACK_HANDLERS.get(action.action) if action else None
+            if handler is not None and check_callback_params(action):
+                await self._run_handler(handler, call, action)
+            else:
+                await self._run_sync(update, key)
+        except Exception as e:
+            logger.error(f"Unhandled error in handler: {e}", exc_info=True)
+        self.latency.observe(time.perf_counter() - started)
+
+    async def _run_handler(self, handler, call, action: CallbackAction):
+        started = time.perf_counter()
+        try:
+            await handler(self.api, call, action)
+        except Exception:
+            metrics.inc('nsl_handler_errors_total', handler=handler.__name__)
+            raise
+        finally:
+            handler_seconds[handler.__name__].observe(time.perf_counter() - started)
+
+    async def _run_sync(self, update: telebot.types.Update, key):
+        """Run the sync handlers of update on update_dispatcher and wait for them"""
+        import asyncio
+        import telebot
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+
+        def process():
+            try:
+                telebot.TeleBot.process_new_updates(bot, [update])
+            finally:
+                loop.call_soon_threadsafe(done.set_result, None)
+
+        if not update_dispatcher.submit(key, process):
+            logger.warning(f"Handler queue is full ({update_dispatcher.depth()}), rejected update {update.update_id}")
+            await self.reject(update)
+            return
+        await done
+
+    async def reject(self, update: telebot.types.Update):
+        """Tell the user the bot is busy"""
+        try:
+            if update.callback_query:
+                await self.api.answer_callback_query(update.callback_query.id, BUSY_TEXT)
+            elif update.message:
+                await self.api.send_message(update.message.chat.id, BUSY_TEXT)
+        except Exception as e:
+            logger.error(f"Error sending busy reply: {e}")
+
+    async def poll(self):
+        """Long poll for updates until cancelled"""
+        import asyncio
+        retry_delay = POLLING_RETRY_MIN
+        if self.offset is None:
+            self.offset = await async_db.run(load_update_offset)
+        while True:
+            try:
+                updates = await self.api.get_updates(offset=self.offset, timeout=20, request_timeout=30)
+                retry_delay = POLLING_RETRY_MIN
+            except Exception as e:
+                logger.error(f"Polling failed, retrying in {retry_delay:.0f}s: {e}")
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, POLLING_RETRY_MAX)
+                continue
+            if updates:
+                # Stored before handling, like the sync runtime does
+                self.offset = updates[-1].update_id + 1
+                await async_db.run(save_update_offset, self.offset)
+            for update in updates:
+                self.submit(update)
+
+    async def drain(self):
+        """Wait for updates already received"""
+        import asyncio
+        while self._lanes:
+            await asyncio.wait(list(self._lanes.values()))
+
+    async def run(self):
+        """Poll until SIGTERM or SIGINT, then finish the received updates"""
+        import asyncio
+        polling = asyncio.ensure_future(self.poll())
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, polling.cancel)
+        try:
+            await polling
+        except asyncio.CancelledError:
+            pass
+        finally:
+            logger.info(f"Stopping async runtime, {self._pending} updates left to handle")
+            await self.drain()
+            await self.api.close_session()
+
+
+def run_async_polling():
+    """Receive and handle updates on an asyncio event loop"""
+    import asyncio
+    try:
+        from telebot.async_telebot import AsyncTeleBot
+    except ImportError as e:
+        raise RuntimeError(f"NSL_RUNTIME=async requires aiohttp: {e}")
+
+    runtime = AsyncRuntime(AsyncTeleBot(TOKEN))
+    metrics.register('nsl_async_update_seconds', runtime.latency)
+    metrics.add_collector(lambda: [
+        ('gauge', 'nsl_queue_depth', {'pool': 'async'}, runtime.depth()),
+        ('counter', 'nsl_queue_rejected_total', {'pool': 'async'}, runtime.rejected),
+    ])
+    try:
+        asyncio.run(runtime.run())
+    finally:
+        async_db.close()
+
+
 if __name__ == "__main__":
+    setup()
+    if NSL_RUNTIME not in NSL_RUNTIMES:
+        logger.error(f"Unknown NSL_RUNTIME '{NSL_RUNTIME}', expected one of: {', '.join(NSL_RUNTIMES)}")
+        raise SystemExit(1)
     logger.info("Starting NS Logger bot...")
     logger.info(f"Data directory: {DATA_DIR}")
     logger.info(f"Logs directory: {LOGS_DIR}")
 
     # Initialize database
     init_database()
+    log_aggregator.start()
+    log_ingest.start()
+    log_shipping.start()
+    metrics_exporter.start()
 
     try:
-        bot.infinity_polling()
+        if NSL_RPC:
+            run_cluster_polling()
+        elif NSL_RUNTIME == 'webhook':
+            logger.info("Using webhook runtime")
+            run_webhook()
+        elif NSL_RUNTIME == 'async':
+            logger.info("Using async runtime")
+            run_async_polling()
+        else:
+            bot.infinity_polling()
     except Exception as e:
         logger.error(f"Bot crashed with error: {e}")
-        raise
\ No newline at end of file
+        raise
+    finally:
+        update_dispatcher.shutdown()
+        io_pool.shutdown()
\ No newline at end of file
@@ -0,0 +1,40 @@
+# PyInstaller spec for NS Logger bot.
+#
+#   pyinstaller nsl-bot.spec                 one-folder build in dist/nsl-bot/ (fast start)
+#   NSL_ONEFILE=1 pyinstaller nsl-bot.spec   single executable dist/nsl-bot(.exe)
+#
+# A single executable unpacks itself into a temporary directory on every
+# start, the one-folder build starts the interpreter directly. UPX is off in
+# both: compressed binaries are unpacked again each time they are loaded.
+import os
+
+onefile = os.getenv('NSL_ONEFILE') == '1'
+
+a = Analysis(
+    ['nsl-bot.py'],
+    datas=[('.env', '.')] if os.path.exists('.env') else [],
+    hookspath=['.'],
+    excludes=['tkinter'],
+)
+pyz = PYZ(a.pure)
+
+if onefile:
+    exe = EXE(
+        pyz, a.scripts, a.binaries, a.datas, [],
+        name='nsl-bot',
+        console=True,
+        upx=False,
+    )
+else:
+    exe = EXE(
+        pyz, a.scripts, [],
+        exclude_binaries=True,
+        name='nsl-bot',
+        console=True,
+        upx=False,
+    )
+    coll = COLLECT(
+        exe, a.binaries, a.datas,
+        name='nsl-bot',
+        upx=False,
+    )
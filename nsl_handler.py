@@ -0,0 +1,132 @@
+import json
+import queue
+import socket
+import struct
+import logging
+import threading
+import time
+from typing import List, Optional
+
+
+class NSLoggerHandler(logging.Handler):
+    """Logging handler that ships records to NS Logger in batches
+
+    Usage in a managed bot:
+
+        from nsl_handler import NSLoggerHandler
+        logging.getLogger().addHandler(NSLoggerHandler('mybot', '127.0.0.1:5141'))
+
+    The address is host:port of LOG_SHIP_TCP or the path of LOG_SHIP_SOCKET.
+    Records are queued without blocking the caller and sent by a background
+    thread; when the queue is full or NS Logger is unreachable they are dropped
+    and counted in `dropped`. `timeout` bounds connecting and sending,
+    `ack_timeout` the wait for a batch's answer; it is longer than the 30 s NS
+    Logger takes at most to answer, and a batch left unanswered is dropped
+    rather than sent twice.
+    """
+
+    def __init__(self, bot_name: str, address: str, batch_size: int = 200,
+                 flush_interval: float = 0.5, queue_size: int = 10000, timeout: float = 5,
+                 ack_timeout: float = 40):
+        super().__init__()
+        self.bot_name = bot_name
+        self.address = address
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.ack_timeout = ack_timeout
+        self.dropped = 0
+        self.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+        self._queue: 'queue.Queue' = queue.Queue(maxsize=queue_size)
+        self._sock: Optional[socket.socket] = None
+        self._retry_at = 0.0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='nsl-handler', daemon=True)
+        self._thread.start()
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            self._queue.put_nowait(self.format(record))
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        """Wait until records queued so far are sent or dropped"""
+        self._queue.join()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join(self.timeout)
+            if self._sock is not None:
+                self._sock.close()
+        super().close()
+
+    def _connect(self) -> socket.socket:
+        """Connect to NS Logger over TCP or a Unix socket"""
+        if ':' in self.address and not self.address.startswith('/'):
+            host, _, port = self.address.rpartition(':')
+            sock = socket.create_connection((host, int(port)), self.timeout)
+        else:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.address)
+        return sock
+
+    def _send(self, records: List[str]) -> bool:
+        """Send one batch and wait for its commit, reconnecting once on failure"""
+        frame = json.dumps({'bot': self.bot_name, 'records': records}).encode('utf-8')
+        for attempt in range(2):
+            try:
+                if self._sock is None:
+                    if time.monotonic() < self._retry_at:
+                        return False
+                    self._sock = self._connect()
+                self._sock.settimeout(self.timeout)
+                self._sock.sendall(struct.pack('>I', len(frame)) + frame)
+                self._sock.settimeout(self.ack_timeout)
+                status = self._sock.recv(1)
+                if not status:
+                    raise ConnectionError("connection closed by NS Logger")
+                return status == b'\x00'
+            except socket.timeout:
+                # The batch may still be committed, sending it again could duplicate it
+                self._close_socket()
+                return False
+            except OSError:
+                self._close_socket()
+                # Don't hammer a listener that is down, retry it a bit later
+                self._retry_at = time.monotonic() + (1 if attempt else 0)
+        return False
+
+    def _close_socket(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch = [item] if item is not None else []
+            stop = item is None
+            deadline = time.monotonic() + self.flush_interval
+            while not stop and len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                else:
+                    batch.append(item)
+
+            if batch and not self._send(batch):
+                self.dropped += len(batch)
+            for _ in range(len(batch) + (1 if stop else 0)):
+                self._queue.task_done()
+            if stop:
+                return
@@ -0,0 +1,278 @@
+import importlib.util
+import itertools
+import json
+import os
+import queue
+import socket
+import sys
+import tempfile
+import threading
+import time
+import types
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK_DIR = tempfile.mkdtemp(prefix='nsl-tests-')
+
+# nsl-bot.py reads its configuration on import
+os.environ['NSL_TOKEN'] = '123456:TEST'
+os.environ['DATA_DIR'] = os.path.join(WORK_DIR, 'data')
+os.environ['LOGS_DIR'] = os.path.join(WORK_DIR, 'logs')
+os.environ['NSL_RPC_SECRET'] = 'test-secret'
+sys.path.insert(0, ROOT)
+
+
+def load_bot_module():
+    """Import nsl-bot.py, whose file name is not a valid module name"""
+    module = sys.modules.get('nsl_bot')
+    if module is None:
+        spec = importlib.util.spec_from_file_location('nsl_bot', os.path.join(ROOT, 'nsl-bot.py'))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules['nsl_bot'] = module
+        spec.loader.exec_module(module)
+        module.setup()
+    return module
+
+
+def pytest_addoption(parser):
+    parser.addoption('--bench', action='store_true', help="run benchmarks")
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', "bench: benchmark, only runs with --bench")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--bench'):
+        return
+    skip = pytest.mark.skip(reason="benchmark, use --bench")
+    for item in items:
+        if 'bench' in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture(scope='session')
+def nsl():
+    return load_bot_module()
+
+
+@pytest.fixture
+def db(nsl):
+    """Migrated database of the session, emptied after each test"""
+    nsl.init_database()
+    yield nsl.get_db_connection()
+    conn = nsl.get_db_connection()
+    conn.rollback()
+    conn.execute("PRAGMA foreign_keys=OFF")
+    for (table,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+        conn.execute(f"DELETE FROM {table}")
+    conn.commit()
+    conn.execute("PRAGMA foreign_keys=ON")
+    nsl.invalidate_user_access()
+
+
+class FakeTelegram:
+    """Records Bot API calls made through the bot instead of sending them"""
+
+    METHODS = ('send_message', 'edit_message_text', 'edit_message_reply_markup',
+               'answer_callback_query', 'send_document', 'delete_message')
+
+    def __init__(self):
+        self.calls = []
+        self._ids = itertools.count(1000)
+
+    def method(self, name):
+        def call(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            message_id = next(self._ids)
+            return types.SimpleNamespace(
+                message_id=message_id,
+                document=types.SimpleNamespace(file_id=f'F{message_id}')
+            )
+        return call
+
+    def sent(self, name):
+        """Get calls of one method"""
+        return [(args, kwargs) for method, args, kwargs in self.calls if method == name]
+
+
+@pytest.fixture
+def telegram(nsl, monkeypatch):
+    fake = FakeTelegram()
+    for name in FakeTelegram.METHODS:
+        monkeypatch.setattr(nsl.bot, name, fake.method(name))
+    return fake
+
+
+class FakeBotAPI:
+    """Bot API stub answering the HTTP requests telebot makes"""
+
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.requests = []
+        self.updates = []
+        self._ids = itertools.count(1000)
+        self._lock = threading.Lock()
+
+    def __call__(self, method, url, params=None, files=None, **kwargs):
+        name = url.rsplit('/', 1)[1]
+        params = dict(params or {})
+        if self.delay:
+            time.sleep(self.delay)
+        with self._lock:
+            self.requests.append((time.perf_counter(), name, params))
+            if name == 'getUpdates':
+                result, self.updates = self.updates, []
+            elif name in ('answerCallbackQuery', 'setWebhook', 'deleteWebhook'):
+                result = True
+            else:
+                result = {'message_id': next(self._ids), 'date': 0,
+                          'chat': {'id': int(params.get('chat_id', 1)), 'type': 'private'},
+                          'document': {'file_id': 'F', 'file_unique_id': 'U'}}
+        if name == 'getUpdates' and not result:
+            # Long poll that ends without updates
+            time.sleep(0.05)
+        reply = {'ok': True, 'result': result}
+        return types.SimpleNamespace(status_code=200, text=json.dumps(reply), json=lambda: reply)
+
+    def called(self, name):
+        """Get params of requests to one method"""
+        with self._lock:
+            return [params for _, method, params in self.requests if method == name]
+
+
+@pytest.fixture
+def bot_api(monkeypatch):
+    import telebot.apihelper
+    api = FakeBotAPI()
+    monkeypatch.setattr(telebot.apihelper, 'CUSTOM_REQUEST_SENDER', api)
+    return api
+
+
+@pytest.fixture
+def add_user(db):
+    """Register a user with a rank and local admin access to bots"""
+    def add(username, rank='ladmin', bots=(), user_id=1):
+        db.execute("INSERT INTO users (username, user_id, first_name, rank) VALUES (?, ?, ?, ?)",
+                   (username, user_id, username, rank))
+        for bot_name in bots:
+            db.execute("INSERT OR IGNORE INTO bots (name, exe_path, username) VALUES (?, 'x', 'y')", (bot_name,))
+            db.execute("INSERT INTO bot_ladmins (bot_name, username) VALUES (?, ?)", (bot_name, username))
+        db.commit()
+    return add
+
+
+def make_call(data, username='alice', user_id=1, chat_id=1, message_id=1):
+    """Build a callback query like telebot passes it to handlers"""
+    return types.SimpleNamespace(
+        id='cb', data=data,
+        from_user=types.SimpleNamespace(username=username, id=user_id),
+        message=types.SimpleNamespace(chat=types.SimpleNamespace(id=chat_id), message_id=message_id)
+    )
+
+
+def update_json(update_id, user_id=1, username='alice', text=None, data=None):
+    """Build a Bot API update: a message with text, or a callback query with data"""
+    user = {'id': user_id, 'is_bot': False, 'first_name': username, 'username': username}
+    message = {'message_id': update_id, 'date': 0, 'chat': {'id': user_id, 'type': 'private'}, 'from': user}
+    if data is None:
+        return {'update_id': update_id, 'message': dict(message, text=text)}
+    return {'update_id': update_id, 'callback_query': {
+        'id': str(update_id), 'from': user, 'chat_instance': '1', 'data': data, 'message': message
+    }}
+
+
+# Runs nsl-bot.py as a script against a local Bot API
+LAUNCHER = '''
+import runpy, sys
+import telebot.apihelper, telebot.asyncio_helper
+telebot.apihelper.API_URL = sys.argv[1] + '/bot{0}/{1}'
+telebot.asyncio_helper.API_URL = sys.argv[1] + '/bot{0}/{1}'
+sys.argv = sys.argv[2:]
+runpy.run_path(sys.argv[0], run_name='__main__')
+'''
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(condition, timeout: float = 20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = condition()
+        if result:
+            return result
+        time.sleep(0.05)
+    raise AssertionError("timed out")
+
+
+class StubBotAPI:
+    """Local Bot API shared by all nodes: queued updates go out once, poll offsets and sent messages are recorded"""
+
+    def __init__(self, failing_polls: int = 0):
+        self.updates = queue.Queue()
+        self.messages = []
+        self.offsets = []
+        self.failing_polls = failing_polls
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.do_POST()
+
+            def do_POST(self):
+                method = urllib.parse.urlsplit(self.path).path.rsplit('/', 1)[1]
+                length = int(self.headers.get('Content-Length') or 0)
+                params = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(self.path).query))
+                params.update(urllib.parse.parse_qsl(self.rfile.read(length).decode()))
+                api.handle(self, method, params)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def handle(self, request, method, params):
+        if method == 'getUpdates':
+            self.offsets.append(int(params.get('offset', 0)))
+            if self.failing_polls > 0:
+                # Connection dropped without an answer, telebot raises ConnectionError
+                self.failing_polls -= 1
+                request.close_connection = True
+                return
+            result = []
+            while not self.updates.empty():
+                result.append(self.updates.get())
+            if not result:
+                time.sleep(0.05)
+        elif method == 'getMe':
+            result = {'id': 123456, 'is_bot': True, 'first_name': 'nsl', 'username': 'nsl_bot'}
+        elif method in ('sendMessage', 'editMessageText'):
+            self.messages.append(params.get('text', ''))
+            result = {'message_id': len(self.messages), 'date': 0, 'text': 'x',
+                      'chat': {'id': int(params.get('chat_id', 1)), 'type': 'private'}}
+        else:
+            result = True
+        body = json.dumps({'ok': True, 'result': result}).encode()
+        request.send_response(200)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        try:
+            request.wfile.write(body)
+        except OSError:
+            # A killed node does not read its answer
+            pass
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,46 @@
+import pytest
+
+
+@pytest.fixture
+def users(db, add_user):
+    add_user('alice', bots=['b1', 'b2'])
+    add_user('bob', rank='user', user_id=2)
+
+
+def test_resolve(nsl, users):
+    access = nsl.resolve_user_access('alice')
+    assert access.rank == 'ladmin' and not access.banned
+    assert sorted(access.bots) == ['b1', 'b2']
+    assert nsl.is_user_allowed('alice', 1)
+    assert not nsl.is_user_allowed('bob', 2)
+    assert not nsl.is_user_allowed('mallory', 3)
+
+
+def test_cached_until_invalidated(nsl, db, users):
+    assert nsl.resolve_user_access('alice').bots
+    db.execute("UPDATE users SET banned = 1 WHERE username = 'alice'")
+    db.commit()
+    assert nsl.is_user_allowed('alice', 1)
+    nsl.invalidate_user_access('alice')
+    assert not nsl.is_user_allowed('alice', 1)
+
+
+def test_cache_evicts_oldest(nsl, db, monkeypatch):
+    monkeypatch.setattr(nsl, 'ACCESS_CACHE_SIZE', 3)
+    for name in ('u1', 'u2', 'u3', 'u4'):
+        nsl.resolve_user_access(name)
+    assert list(nsl._access_cache) == ['u2', 'u3', 'u4']
+    # Resolving again refreshes an entry, it is no longer the oldest
+    nsl.invalidate_user_access('u2')
+    nsl.resolve_user_access('u2')
+    nsl.resolve_user_access('u5')
+    assert list(nsl._access_cache) == ['u4', 'u2', 'u5']
+
+
+def test_cache_drops_expired(nsl, db):
+    nsl.resolve_user_access('u1')
+    nsl.resolve_user_access('u2')
+    # u1 expired a while ago
+    nsl._access_cache['u1'] = (0, nsl._access_cache['u1'][1])
+    nsl.resolve_user_access('u3')
+    assert list(nsl._access_cache) == ['u2', 'u3']
@@ -0,0 +1,116 @@
+import os
+import time
+
+import pytest
+
+
+def append(nsl, bot_name: str, text: str):
+    with open(nsl.get_log_path(bot_name), 'a') as f:
+        f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')},000 - app - INFO - {text}\n")
+
+
+@pytest.fixture
+def aggregator(nsl, db, monkeypatch):
+    """Aggregator over bots 'busy' and 'quiet' that have seen their logs grow"""
+    monkeypatch.setattr(nsl, 'ALERT_SILENCE', 1)
+    for bot_name in ('busy', 'quiet'):
+        db.execute("INSERT INTO bots (name, exe_path, username) VALUES (?, 'x', 'y')", (bot_name,))
+        path = nsl.get_log_path(bot_name)
+        if os.path.exists(path):
+            os.unlink(path)
+        append(nsl, bot_name, 'start')
+    db.commit()
+    aggregator = nsl.LogAggregator(60)
+    aggregator.refresh()
+    for bot_name in ('busy', 'quiet'):
+        append(nsl, bot_name, 'running')
+    aggregator.refresh()
+    return aggregator
+
+
+def silence_alerts(nsl, monkeypatch, stats):
+    sent = []
+    monitor = nsl.AlertMonitor()
+    monkeypatch.setattr(monitor, 'send', sent.extend)
+    monitor.check(stats)
+    return [bot_name for bot_name, kind, _ in sent if kind == 'silence']
+
+
+def test_bots_over_budget_keep_fresh_times(nsl, aggregator, monkeypatch):
+    # 'quiet' was last refreshed an hour ago, and is written to again now
+    stats = aggregator.get('quiet')
+    stats.last_growth -= 3600
+    stats.mtime -= 3600
+    append(nsl, 'busy', 'x' * 1000)
+    append(nsl, 'quiet', 'still here')
+    # The budget runs out on 'busy', so the log of 'quiet' is not read
+    monkeypatch.setattr(nsl, 'SUMMARY_CYCLE_BUDGET', 1)
+    offset = stats.offset
+    aggregator._cursor = [row['name'] for row in nsl.db_execute('all_bots')].index('busy')
+    aggregator.refresh()
+    assert stats.offset == offset
+    assert time.time() - stats.last_growth < 60
+    assert stats.size == os.path.getsize(nsl.get_log_path('quiet'))
+    assert silence_alerts(nsl, monkeypatch, aggregator.stats) == []
+
+
+def test_silent_log(nsl, aggregator, monkeypatch):
+    aggregator.get('quiet').last_growth -= 3600
+    os.utime(nsl.get_log_path('quiet'), (time.time() - 3600,) * 2)
+    aggregator.refresh()
+    assert silence_alerts(nsl, monkeypatch, aggregator.stats) == ['quiet']
+
+
+def test_recurring_signatures_are_kept(nsl, monkeypatch):
+    monkeypatch.setattr(nsl, 'SIGNATURE_LIMIT', 3)
+    stats = nsl.LogStats()
+    error = "2026-01-01 00:00:00,000 - app - ERROR - {}\n"
+    stats.feed([error.format('recurring')])
+    for text in ('one', 'recurring', 'two', 'recurring', 'three'):
+        stats.feed([error.format(text)])
+    # 'one' was seen the longest ago and is forgotten, the recurring error is not reported again
+    assert list(stats.signatures) == ['app: two', 'app: recurring', 'app: three']
+    assert stats.new_signatures == ['app: recurring', 'app: one', 'app: two', 'app: three']
+    stats.feed([error.format('one')])
+    assert stats.new_signatures[-1] == 'app: one'
+
+
+@pytest.mark.bench
+def test_bench_scanner(nsl, db, monkeypatch):
+    monkeypatch.setattr(nsl, 'ALERT_SILENCE', 1)
+    aggregator = nsl.LogAggregator(60)
+    monitor = nsl.AlertMonitor()
+    monkeypatch.setattr(monitor, 'send', lambda alerts: None)
+    registered = 0
+    for count in (50, 200, 500):
+        for i in range(registered, count):
+            bot_name = f'scan{i:03d}'
+            db.execute("INSERT INTO bots (name, exe_path, username) VALUES (?, 'x', 'y')", (bot_name,))
+            path = nsl.get_log_path(bot_name)
+            if os.path.exists(path):
+                os.unlink(path)
+            append(nsl, bot_name, 'start')
+        db.commit()
+        registered = count
+        aggregator.refresh()
+        monitor.check(aggregator.stats)
+
+        # A quiet cycle: nothing appended, only stat calls
+        started = time.perf_counter()
+        aggregator.refresh()
+        monitor.check(aggregator.stats)
+        idle = time.perf_counter() - started
+        # A busy cycle: every log got a few records, a tenth of them a new error
+        stamp = time.strftime('%Y-%m-%d %H:%M:%S')
+        for i in range(count):
+            bot_name = f'scan{i:03d}'
+            with open(nsl.get_log_path(bot_name), 'a') as f:
+                f.write(f"{stamp},000 - app - INFO - running\n" * 20)
+                if i % 10 == 0:
+                    f.write(f"{stamp},000 - app - ERROR - failure in {bot_name} after {count}\n")
+        started = time.perf_counter()
+        aggregator.refresh()
+        monitor.check(aggregator.stats)
+        busy = time.perf_counter() - started
+        print(f"\n{count} bots: idle cycle {idle * 1000:.1f} ms ({idle / count * 1e6:.0f} us/bot), "
+              f"busy cycle {busy * 1000:.1f} ms ({busy / count * 1e6:.0f} us/bot)")
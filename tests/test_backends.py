@@ -0,0 +1,146 @@
+import os
+import socket
+import time
+
+import pytest
+
+BASE = time.mktime((2026, 1, 1, 12, 0, 0, 0, 0, -1))
+
+
+def make_records(count: int):
+    """Log records one second apart, every seventh one with a traceback"""
+    records = []
+    for i in range(count):
+        stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(BASE + i))
+        record = f"{stamp},{i % 1000:03d} - app - INFO - record {i}\n"
+        if i % 7 == 0:
+            record += "Traceback (most recent call last):\n  ValueError: ж\n"
+        records.append(record.encode())
+    return records
+
+
+_rpc_server = None
+
+
+def rpc_address(nsl) -> str:
+    """Address of an RPC listener of this process, started on first use"""
+    global _rpc_server
+    if _rpc_server is None:
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        _rpc_server = nsl.RPCServer()
+        _rpc_server.start(f'127.0.0.1:{port}')
+    return '127.0.0.1:%d' % _rpc_server.server.server_address[1]
+
+
+def make_backend(nsl, kind: str, records):
+    """Backend of a new bot holding the records"""
+    bot_name = f'conformance-{kind}-{len(records)}'
+    if kind in ('file', 'remote'):
+        with open(nsl.get_log_path(bot_name), 'wb') as f:
+            f.writelines(records)
+        if kind == 'remote':
+            # Another node serving the same file
+            return nsl.RemoteLogBackend(bot_name, rpc_address(nsl))
+        return nsl.FileLogBackend(bot_name, None)
+    if kind == 'shards':
+        directory = os.path.join(nsl.LOGS_DIR, bot_name)
+        os.makedirs(directory, exist_ok=True)
+        for shard in range(3):
+            with open(os.path.join(directory, f'worker-{shard}.log'), 'wb') as f:
+                f.writelines(records[shard::3])
+        return nsl.ShardLogBackend(bot_name, None)
+    backend = nsl.RingLogBackend(bot_name, None)
+    for i in range(0, len(records), 10):
+        backend.push(b''.join(records[i:i + 10]))
+    return backend
+
+
+BACKENDS = ['file', 'shards', 'ring', 'remote']
+
+
+@pytest.fixture(params=BACKENDS)
+def kind(request):
+    return request.param
+
+
+@pytest.fixture
+def records():
+    return make_records(300)
+
+
+@pytest.fixture
+def backend(nsl, kind, records):
+    return make_backend(nsl, kind, records)
+
+
+def all_lines(records):
+    return b''.join(records).decode().splitlines()
+
+
+@pytest.mark.parametrize('num_lines', [1, 2, 3, 20, 50, 1000])
+def test_tail(backend, records, num_lines):
+    assert backend.tail(num_lines) == all_lines(records)[-num_lines:]
+
+
+def test_range(backend, records):
+    start, end = BASE + 100, BASE + 110
+    assert b''.join(backend.iter_range(start, end)) == b''.join(records[100:111])
+
+
+def test_range_outside(backend):
+    assert list(backend.iter_range(BASE - 100, BASE - 10)) == []
+    assert list(backend.iter_range(BASE + 1000, BASE + 2000)) == []
+
+
+def test_all(nsl, kind, records):
+    # Lines before the first record are kept, unlike in a range
+    records = [b'starting up\n'] + records
+    backend = make_backend(nsl, kind, records)
+    assert b''.join(backend.iter_all()) == b''.join(records)
+
+
+def test_empty(nsl, kind):
+    backend = make_backend(nsl, kind, [])
+    assert backend.tail(20) == []
+    assert list(backend.iter_range(BASE, BASE + 100)) == []
+    assert list(backend.iter_all()) == []
+
+
+def test_incomplete_backend_fails_on_creation(nsl):
+    class TailOnly(nsl.LogBackend):
+        def tail(self, num_lines):
+            return []
+
+    with pytest.raises(TypeError):
+        TailOnly('b1', None)
+
+
+def test_backend_selection(nsl, db):
+    db.execute("INSERT INTO bots (name, exe_path, username, log_backend, log_target) "
+               "VALUES ('sel', 'x', 'y', 'shards', 'dir')")
+    db.execute("INSERT INTO bots (name, exe_path, username, log_backend) VALUES ('bad', 'x', 'y', 'journald')")
+    db.commit()
+    backend = nsl.get_log_backend('sel')
+    assert type(backend) is nsl.ShardLogBackend and backend.target == 'dir'
+    assert nsl.get_log_backend('sel') is backend
+    assert type(nsl.get_log_backend('bad')) is nsl.FileLogBackend
+    assert type(nsl.get_log_backend('unknown')) is nsl.FileLogBackend
+
+
+@pytest.mark.bench
+def test_bench_backends(nsl):
+    records = make_records(200000)
+    for kind in BACKENDS:
+        backend = make_backend(nsl, kind, records)
+        started = time.perf_counter()
+        for _ in range(100):
+            backend.tail(50)
+        tail_time = (time.perf_counter() - started) / 100
+        started = time.perf_counter()
+        # The newest records, so that they are still in the ring buffer
+        exported = sum(len(record) for record in backend.iter_range(BASE + 199000, BASE + 200000))
+        range_time = time.perf_counter() - started
+        print(f"\n{kind}: tail 50 {tail_time * 1000:.2f} ms, "
+              f"range of the last 1000 records ({exported // 1024} KiB) {range_time * 1000:.1f} ms")
@@ -0,0 +1,121 @@
+import random
+import time
+
+import pytest
+
+from conftest import make_call
+
+NAMES = ['b1', 'my_bot_name', 'ж' * 30, 'x' * 64, '', 'a.b~c']
+ARGS = ['', 'error', '15m', 'a_b', 'ж']
+
+
+def random_action(nsl, rng):
+    return nsl.CallbackAction(
+        rng.choice(nsl.CALLBACK_ACTIONS),
+        rng.choice(NAMES),
+        tuple(rng.randint(0, 2 ** rng.randint(0, 64)) for _ in range(rng.randint(0, 3))),
+        rng.choice(ARGS)
+    )
+
+
+def test_round_trip(nsl):
+    rng = random.Random(1)
+    for _ in range(20000):
+        action = random_action(nsl, rng)
+        data = nsl.encode_callback(action.action, action.bot_name, *action.params, arg=action.arg)
+        assert len(data.encode('utf-8')) <= nsl.CALLBACK_DATA_LIMIT
+        assert nsl.decode_callback(data) == action
+
+
+def test_long_payload_uses_token(nsl):
+    data = nsl.encode_callback('follow', 'x' * 64)
+    assert data.startswith(nsl.CALLBACK_TOKEN)
+    assert nsl.decode_callback(data) == nsl.CallbackAction('follow', 'x' * 64)
+    assert nsl.encode_callback('follow', 'x' * 64) == data
+
+
+def test_expired_token(nsl, monkeypatch):
+    tokens = nsl.CallbackTokens(ttl=60, max_size=2)
+    monkeypatch.setattr(nsl, 'callback_tokens', tokens)
+    first = nsl.encode_callback('follow', 'a' * 64)
+    nsl.encode_callback('follow', 'b' * 64)
+    nsl.encode_callback('follow', 'c' * 64)
+    # Evicted by size
+    assert nsl.decode_callback(first) is None
+
+
+def test_negative_param(nsl):
+    with pytest.raises(ValueError):
+        nsl.encode_callback('log', 'b1', -1)
+
+
+def test_fuzz_decode(nsl):
+    rng = random.Random(2)
+    alphabet = '.~abcXYZ_-=+/\x80ж09'
+    for _ in range(20000):
+        text = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 70)))
+        result = nsl.decode_callback(text)
+        assert result is None or isinstance(result, nsl.CallbackAction)
+
+        raw = bytes(rng.randint(0, 255) for _ in range(rng.randint(0, 40)))
+        for prefix in (nsl.CALLBACK_INLINE, nsl.CALLBACK_TOKEN):
+            result = nsl.decode_callback(prefix + nsl._b64encode(raw))
+            assert result is None or isinstance(result, nsl.CallbackAction)
+
+
+def test_legacy_data_is_stale(nsl):
+    assert nsl.decode_callback('log_b1_20') is None
+
+
+@pytest.mark.parametrize('action, valid', [
+    (('log', 'b1', (20,)), True),
+    (('log', 'b1', ()), False),
+    (('log', 'b1', (0,)), False),
+    (('log', 'b1', (10 ** 9,)), False),
+    (('log', 'b1', (20, 1)), False),
+    (('download', 'b1', ()), True),
+    (('download', 'b1', (1,)), False),
+    (('result', '', (1, 0)), True),
+    (('result', '', (1,)), False),
+    (('result', '', (0, 0)), False),
+])
+def test_check_callback_params(nsl, action, valid):
+    assert nsl.check_callback_params(nsl.CallbackAction(*action)) is valid
+
+
+def test_dispatch_rejects_bad_params(nsl, db, add_user, telegram):
+    add_user('alice', bots=['b1'])
+    for data in (nsl.encode_callback('log', 'b1'),
+                 nsl.encode_callback('log', 'b1', 10 ** 9),
+                 nsl.encode_callback('result', '', 1),
+                 'log_b1_20'):
+        nsl.handle_callback(make_call(data))
+        method, args, _ = telegram.calls[-1]
+        assert method == 'answer_callback_query' and 'устарела' in args[1]
+    assert telegram.sent('send_message') == []
+
+
+def test_dispatch_bot_name_with_underscores(nsl, db, add_user, telegram):
+    add_user('alice', bots=['my_bot_name'])
+    with open(nsl.get_log_path('my_bot_name'), 'w') as f:
+        f.write("2026-01-01 00:00:00,000 - app - INFO - hello\n")
+    nsl.handle_callback(make_call(nsl.encode_callback('log', 'my_bot_name', 20)))
+    (args, _), = telegram.sent('send_message')
+    assert 'hello' in args[1]
+
+
+@pytest.mark.bench
+def test_bench_dispatch(nsl, monkeypatch):
+    handled = []
+    monkeypatch.setitem(nsl.CALLBACK_HANDLERS, 'log', lambda call, action: handled.append(action))
+    inline = nsl.encode_callback('log', 'my_bot_name', 20)
+    token = nsl.encode_callback('log', 'x' * 64, 20)
+    rounds = 100000
+    for name, data in (('inline', inline), ('token', token)):
+        call = make_call(data)
+        started = time.perf_counter()
+        for _ in range(rounds):
+            nsl.handle_callback(call)
+        elapsed = time.perf_counter() - started
+        print(f"\n{name}: {rounds / elapsed:.0f} callbacks/s, {elapsed / rounds * 1e6:.1f} us per dispatch")
+    assert len(handled) == 2 * rounds
@@ -0,0 +1,266 @@
+import gzip
+import os
+import queue
+import signal
+import subprocess
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import LAUNCHER, ROOT, WORK_DIR, StubBotAPI, free_port, make_call, update_json, wait_for
+
+
+class Nodes:
+    """nsl-bot.py instances sharing the test database, each with its own logs"""
+
+    def __init__(self, nsl, api, tmp_path):
+        self.nsl = nsl
+        self.api = api
+        self.tmp_path = tmp_path
+        self.procs = {}
+
+    def start(self, name: str, bot_name: str):
+        logs = self.tmp_path / name
+        logs.mkdir()
+        with open(logs / f'{bot_name}.log', 'w') as f:
+            for i in range(100):
+                f.write(f"2026-01-01 00:00:00,000 - app - INFO - line {i} of {name}\n")
+        env = dict(os.environ, LOGS_DIR=str(logs), NSL_NODE=name, NSL_RPC=f'127.0.0.1:{free_port()}',
+                   LEADER_LEASE='1.5')
+        stderr = open(self.tmp_path / f'{name}.err', 'w')
+        self.procs[name] = subprocess.Popen(
+            [sys.executable, '-c', LAUNCHER, self.api.url, os.path.join(ROOT, 'nsl-bot.py')],
+            cwd=WORK_DIR, env=env, stdout=subprocess.DEVNULL, stderr=stderr
+        )
+        stderr.close()
+
+    def errors(self, name: str) -> str:
+        return (self.tmp_path / f'{name}.err').read_text()
+
+    def leader(self):
+        row = self.nsl.db_execute('lease_holder').fetchone()
+        return row['node'] if row and row['expires_at'] > time.time() else None
+
+    def holders(self) -> set:
+        return {tuple(row) for row in self.nsl.get_db_connection().execute("SELECT node, bot_name FROM cluster_bots")}
+
+    def stop(self):
+        for proc in self.procs.values():
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+
+
+@pytest.fixture
+def nodes(nsl, db, add_user, tmp_path):
+    add_user('op', bots=['b0', 'b1'], user_id=42)
+    api = StubBotAPI(failing_polls=1)
+    nodes = Nodes(nsl, api, tmp_path)
+    yield nodes
+    nodes.stop()
+    api.stop()
+
+
+def view_log(nsl, nodes, bot_name: str, update_id: int) -> str:
+    """Press the log button of a bot and return the text the leader sends"""
+    sent = len(nodes.api.messages)
+    nodes.api.updates.put(update_json(update_id, user_id=42, username='op',
+                                      data=nsl.encode_callback('log', bot_name, 20)))
+    wait_for(lambda: len(nodes.api.messages) > sent)
+    return nodes.api.messages[sent]
+
+
+def test_failover(nsl, nodes):
+    nodes.start('node0', 'b0')
+    assert wait_for(nodes.leader) == 'node0'
+    nodes.start('node1', 'b1')
+    wait_for(lambda: {('node0', 'b0'), ('node1', 'b1')} <= nodes.holders())
+
+    # The leader survived a failed long poll and reads the log of b1 from node1
+    assert 'line 99 of node1' in view_log(nsl, nodes, 'b1', 1)
+    assert 'line 99 of node0' in view_log(nsl, nodes, 'b0', 2)
+
+    # Killed without releasing the lease: node1 takes over once it expires
+    killed = time.monotonic()
+    nodes.procs['node0'].send_signal(signal.SIGKILL)
+    nodes.procs['node0'].wait()
+    polls = len(nodes.api.offsets)
+    assert wait_for(lambda: nodes.leader() == 'node1')
+    assert time.monotonic() - killed < 10
+    assert 'line 99 of node1' in view_log(nsl, nodes, 'b1', 3)
+    # node1 polls on from where node0 stopped, not from its own first update
+    assert min(nodes.api.offsets[polls:]) >= 3
+    assert nsl.db_execute('update_offset').fetchone()[0] == 4
+
+    # A stopped node gives the lease up on its way out
+    nodes.procs['node1'].send_signal(signal.SIGTERM)
+    assert nodes.procs['node1'].wait(20) == 0
+    assert nsl.db_execute('lease_holder').fetchone() is None
+    for name in ('node0', 'node1'):
+        assert 'Traceback' not in nodes.errors(name)
+    assert 'Polling failed on node node0' in nodes.errors('node0')
+
+
+def test_membership_errors_end_leadership(nsl, monkeypatch):
+    monkeypatch.setattr(nsl, 'LEADER_LEASE', 0.03)
+    monkeypatch.setattr(nsl.bot, 'stop_polling', lambda: None)
+    node = nsl.ClusterNode()
+    actions = queue.Queue()
+    done = queue.Queue()
+
+    def tick():
+        action = actions.get()
+        try:
+            action()
+        finally:
+            done.put(action)
+
+    def fail():
+        raise RuntimeError('scandir failed')
+
+    # Assigned for good: the thread parks in tick() once the test is over
+    node.tick = tick
+    node.leader.set()
+    node.lease_expires = time.time() + 60
+    threading.Thread(target=node._run, daemon=True).start()
+
+    actions.put(fail)
+    done.get(timeout=5)
+    wait_for(lambda: not node.leader.is_set(), 5)
+
+    # Renewal that did not happen in time
+    node.leader.set()
+    node.lease_expires = time.time() - 1
+    actions.put(lambda: None)
+    done.get(timeout=5)
+    wait_for(lambda: not node.leader.is_set(), 5)
+
+
+def test_handler_threads_close_connections(nsl, db):
+    with open(nsl.get_log_path('rpc-bot'), 'w') as f:
+        f.write("2026-01-01 00:00:00,000 - app - INFO - hello\n")
+    server = nsl.RPCServer()
+    server.start(f'127.0.0.1:{free_port()}')
+    address = '127.0.0.1:%d' % server.server.server_address[1]
+    try:
+        before = len(nsl._db_connections)
+        for _ in range(20):
+            assert nsl.RemoteLogBackend('rpc-bot', address).tail(1)[-1].endswith('hello')
+        wait_for(lambda: len(nsl._db_connections) <= before, 5)
+    finally:
+        server.server.shutdown()
+        server.server.server_close()
+
+
+@pytest.mark.bench
+def test_bench_routing(nsl, db):
+    with open(nsl.get_log_path('routed'), 'w') as f:
+        for i in range(200000):
+            f.write(f"2026-01-01 00:00:{i % 60:02d},000 - app - INFO - line {i}\n")
+    server = nsl.RPCServer()
+    server.start(f'127.0.0.1:{free_port()}')
+    address = '127.0.0.1:%d' % server.server.server_address[1]
+    try:
+        local = nsl.get_local_log_backend('routed')
+        remote = nsl.RemoteLogBackend('routed', address)
+        assert remote.tail(50) == local.tail(50)
+        for name, backend in (('local', local), ('rpc', remote)):
+            started = time.perf_counter()
+            for _ in range(200):
+                backend.tail(50)
+            tail_time = (time.perf_counter() - started) / 200
+            started = time.perf_counter()
+            size = sum(len(chunk) for chunk in backend.iter_range(0, time.time()))
+            print(f"\n{name}: tail 50 {tail_time * 1000:.2f} ms, "
+                  f"range of {size // 1024} KiB {(time.perf_counter() - started) * 1000:.0f} ms")
+    finally:
+        server.server.shutdown()
+        server.server.server_close()
+
+
+@pytest.fixture
+def remote(nsl, db, monkeypatch):
+    """Bot 'far' whose logs are served over RPC, as if by another node"""
+    with open(nsl.get_log_path('far'), 'w') as f:
+        f.write("starting up\n"
+                "2026-01-01 00:00:00,000 - app - INFO - hello\n"
+                "2026-01-01 00:00:01,000 - app - ERROR - failed\n"
+                "Traceback (most recent call last):\n"
+                "ValueError: x\n")
+    server = nsl.RPCServer()
+    server.start(f'127.0.0.1:{free_port()}')
+    monkeypatch.setattr(nsl.cluster, 'enabled', True)
+    monkeypatch.setattr(nsl.cluster, 'routes', {
+        'far': '127.0.0.1:%d' % server.server.server_address[1],
+        'gone': '127.0.0.1:%d' % server.server.server_address[1],
+    })
+    yield server
+    server.server.shutdown()
+    server.server.server_close()
+
+
+def test_log_queries_run_on_holding_node(nsl, remote, tmp_path, monkeypatch):
+    index = nsl.ErrorIndex(str(tmp_path / 'errors.db'))
+    monkeypatch.setattr(nsl, 'error_index', index)
+    index.add('far', ["2026-01-01 00:00:01,000 - app - ERROR - failed\nValueError: x\n"], 1, 1)
+
+    lines, complete = nsl.run_log_query('search', 'far', 'fail', None)
+    assert (lines, complete) == nsl.search_log('far', 'fail')
+    records = nsl.run_log_query('filter', 'far', 10, nsl.LogFilter('ERROR'))
+    assert records == nsl.get_filtered_records('far', 10, nsl.LogFilter('ERROR'))
+    assert records[0].endswith('ValueError: x')
+    groups, group_count, error_count = nsl.run_log_query('errors', 'far')
+    assert (groups, group_count, error_count) == nsl.top_errors('far')
+    assert groups[0]['title'] == 'ValueError'
+
+    # A missing log is reported as such, not as a failed request
+    with pytest.raises(FileNotFoundError):
+        nsl.run_log_query('filter', 'gone', 10, nsl.LogFilter())
+
+
+def test_download_of_remote_bot_is_raw(nsl, remote, monkeypatch):
+    exported = []
+
+    def send_spool(chat_id, spool, file_name, caption):
+        spool.seek(0)
+        exported.append(gzip.decompress(spool.read()))
+        return []
+
+    monkeypatch.setattr(nsl, 'send_spool', send_spool)
+    nsl.export_log_range(1, 'far', 0, time.time())
+    with open(nsl.get_log_path('far'), 'rb') as f:
+        assert exported == [f.read()]
+
+
+def test_follow_of_remote_bot_is_refused(nsl, remote, add_user, telegram):
+    add_user('alice', bots=['far'])
+    nsl.handle_callback(make_call(nsl.encode_callback('follow', 'far')))
+    (args, _), = [call for call in telegram.sent('answer_callback_query') if len(call[0]) > 1]
+    assert 'на другом узле' in args[1]
+    assert telegram.sent('send_message') == []
+
+
+def test_polling_resumes_from_stored_offset(nsl, db, monkeypatch):
+    import telebot
+    offsets = []
+
+    def get_updates(self, offset=None, *args, **kwargs):
+        offsets.append(offset)
+        return [SimpleNamespace(update_id=offset)] if offset > 0 else []
+
+    monkeypatch.setattr(telebot.TeleBot, 'get_updates', get_updates)
+    nsl.bot.get_updates(5)
+    assert nsl.load_update_offset() == 6
+
+    # Another node polled meanwhile
+    nsl.save_update_offset(10)
+    nsl.bot.get_updates(6)
+    assert offsets == [5, 10] and nsl.load_update_offset() == 11
+
+    # The offset never moves back, skipping pending updates still works
+    nsl.save_update_offset(3)
+    nsl.bot.get_updates(-1)
+    assert offsets[-1] == -1 and nsl.load_update_offset() == 11
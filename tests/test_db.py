@@ -0,0 +1,86 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+
+def in_thread(func):
+    """Run func on a new thread and return its result"""
+    result = []
+    thread = threading.Thread(target=lambda: result.append(func()))
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+def add_user(conn, username, rank='user', bots=()):
+    conn.execute("INSERT INTO users (username, user_id, first_name, rank) VALUES (?, 1, ?, ?)",
+                 (username, username, rank))
+    for bot_name in bots:
+        conn.execute("INSERT OR IGNORE INTO bots (name, exe_path, username) VALUES (?, 'x', 'y')", (bot_name,))
+        conn.execute("INSERT INTO bot_ladmins (bot_name, username) VALUES (?, ?)", (bot_name, username))
+    conn.commit()
+
+
+def test_connection_pragmas(nsl, db):
+    assert db.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    assert db.execute("PRAGMA synchronous").fetchone()[0] == 1
+    assert db.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+    assert db.execute("PRAGMA busy_timeout").fetchone()[0] == nsl.DB_BUSY_TIMEOUT
+
+
+def test_connection_per_thread(nsl, db):
+    assert nsl.get_db_connection() is db
+    other = in_thread(nsl.get_db_connection)
+    assert other is not db
+    assert other in nsl._db_connections
+
+
+def test_helpers_share_connection(nsl, db):
+    add_user(db, 'alice', 'ladmin', ['b1', 'b2'])
+    before = len(nsl._db_connections)
+    assert nsl.get_user_rank('alice') == 'ladmin'
+    assert nsl.get_user_bots('alice') == ['b1', 'b2']
+    assert nsl.is_user_allowed('alice', 1)
+    assert len(nsl._db_connections) == before
+
+
+def test_close_db_connections(nsl, db):
+    other = in_thread(nsl.get_db_connection)
+    nsl.close_db_connections()
+    assert nsl._db_connections == []
+    with pytest.raises(sqlite3.ProgrammingError):
+        other.execute("SELECT 1")
+    with pytest.raises(sqlite3.ProgrammingError):
+        db.execute("SELECT 1")
+
+    # Threads open a new connection on their next query
+    conn = nsl.get_db_connection()
+    assert conn is not db
+    assert conn.execute("SELECT 1").fetchone()[0] == 1
+
+
+@pytest.mark.bench
+def test_bench_request_latency(nsl, db, monkeypatch):
+    add_user(db, 'alice', 'ladmin', [f'b{i}' for i in range(20)])
+    monkeypatch.setattr(nsl, 'ACCESS_CACHE_TTL', 0)
+    query = nsl.STATEMENTS['user_access']
+    rounds = 2000
+
+    # Before: every helper opened and closed its own connection
+    started = time.perf_counter()
+    for _ in range(rounds):
+        conn = sqlite3.connect(nsl.DB_PATH)
+        conn.execute(query, {'username': 'alice'}).fetchall()
+        conn.close()
+    per_call = (time.perf_counter() - started) / rounds
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        nsl.db_execute('user_access', {'username': 'alice'}).fetchall()
+    pooled = (time.perf_counter() - started) / rounds
+
+    print(f"\naccess query: connect per call {per_call * 1e6:.0f} us, "
+          f"thread connection {pooled * 1e6:.0f} us")
+    assert pooled < per_call
@@ -0,0 +1,87 @@
+import random
+import threading
+import time
+
+import pytest
+import telebot
+
+from conftest import update_json
+
+
+def test_dispatcher_keeps_order_per_key(nsl):
+    dispatcher = nsl.UpdateDispatcher(4, 1000)
+    rng = random.Random(1)
+    done = []
+
+    def task(key, number):
+        time.sleep(rng.random() / 1000)
+        done.append((key, number))
+
+    for number in range(300):
+        assert dispatcher.submit(number % 5, task, number % 5, number)
+    dispatcher.shutdown()
+    assert len(done) == 300
+    for key in range(5):
+        numbers = [number for k, number in done if k == key]
+        assert numbers == sorted(numbers)
+
+
+def test_dispatcher_rejects_when_full(nsl):
+    dispatcher = nsl.UpdateDispatcher(1, 2)
+    release = threading.Event()
+    assert dispatcher.submit('a', release.wait)
+    assert dispatcher.submit('b', release.wait)
+    assert not dispatcher.submit('c', release.wait)
+    assert dispatcher.rejected == 1
+    assert dispatcher.depth() == 2
+    release.set()
+    dispatcher.shutdown()
+    assert dispatcher.depth() == 0
+
+
+def test_busy_reply(nsl, telegram, monkeypatch):
+    monkeypatch.setattr(nsl.update_dispatcher, 'max_pending', 0)
+    update = telebot.types.Update.de_json(update_json(1, text='/me'))
+    nsl.bot.process_new_updates([update])
+    assert telegram.sent('send_message') == [((1, nsl.BUSY_TEXT), {})]
+    assert nsl.bot.last_update_id >= 1
+
+
+@pytest.mark.bench
+def test_bench_callback_replay(nsl, db, add_user, bot_api):
+    """Replay callback updates from many users through polling intake against a stubbed API"""
+    users, presses = 50, 4000
+    bot_api.delay = 0.002  # Round trip to the Bot API
+    for user in range(users):
+        add_user(f'user{user}', bots=['b1'], user_id=user + 1)
+    with open(nsl.get_log_path('b1'), 'w') as f:
+        f.write(''.join(f"2026-01-01 00:00:00,000 - app - INFO - line {i}\n" for i in range(1000)))
+
+    data = nsl.encode_callback('log', 'b1', 20)
+    updates = [
+        telebot.types.Update.de_json(update_json(i, user_id=i % users + 1, username=f'user{i % users}', data=data))
+        for i in range(1, presses + 1)
+    ]
+    sent = {}
+    started = time.perf_counter()
+    for batch in range(0, presses, 100):
+        # getUpdates returns at most 100 updates
+        for update in updates[batch:batch + 100]:
+            sent[update.callback_query.id] = time.perf_counter()
+        nsl.bot.process_new_updates(updates[batch:batch + 100])
+    while nsl.update_dispatcher.depth():
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - started
+
+    answers = [params for _, method, params in bot_api.requests if method == 'answerCallbackQuery']
+    busy = [params for params in answers if params.get('text') == nsl.BUSY_TEXT]
+    latencies = sorted(
+        at - sent[params['callback_query_id']]
+        for at, method, params in bot_api.requests
+        if method == 'answerCallbackQuery' and params.get('text') != nsl.BUSY_TEXT
+    )
+    assert len(answers) == presses
+    print(f"\n{presses} presses from {users} users in {elapsed:.1f} s: "
+          f"{len(latencies)} served ({len(latencies) / elapsed:.0f}/s), {len(busy)} answered busy; "
+          f"served p50 {latencies[len(latencies) // 2] * 1000:.0f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.0f} ms")
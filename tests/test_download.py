@@ -0,0 +1,124 @@
+import gzip
+import itertools
+import json
+import os
+import re
+import tempfile
+import time
+import tracemalloc
+import types
+
+import pytest
+import requests
+import telebot.apihelper
+
+
+@pytest.fixture
+def uploads(monkeypatch):
+    """Documents uploaded through telebot and requests, as (file name, bytes) pairs"""
+    uploaded = []
+    ids = itertools.count(1)
+
+    def sender(method, url, params=None, files=None, **kwargs):
+        # Encode the multipart body the way requests sends it
+        body, content_type = requests.PreparedRequest._encode_files(files, params or {})
+        boundary = b'--' + content_type.split('boundary=')[1].encode()
+        name = next(iter(files.values()))[0]
+        for field in body.split(boundary):
+            headers, _, content = field.partition(b'\r\n\r\n')
+            if b'filename=' in headers:
+                uploaded.append((name, content[:-2]))
+        result = {'message_id': next(ids), 'date': 0, 'chat': {'id': 1, 'type': 'private'},
+                  'document': {'file_id': f'F{len(uploaded)}', 'file_unique_id': 'u'}}
+        reply = {'ok': True, 'result': result}
+        return types.SimpleNamespace(status_code=200, text=json.dumps(reply), json=lambda: reply)
+
+    monkeypatch.setattr(telebot.apihelper, 'CUSTOM_REQUEST_SENDER', sender)
+    return uploaded
+
+
+def test_send_spool_single(nsl, uploads):
+    with tempfile.TemporaryFile() as spool:
+        spool.write(b'x' * 100)
+        documents = nsl.send_spool(1, spool, 'b1.log.gz', 'caption')
+    assert documents == [('F1', 'caption')]
+    assert uploads == [('b1.log.gz', b'x' * 100)]
+
+
+def test_send_spool_parts(nsl, uploads, monkeypatch):
+    monkeypatch.setattr(nsl, 'TELEGRAM_UPLOAD_LIMIT', 1000)
+    data = os.urandom(2500)
+    with tempfile.TemporaryFile() as spool:
+        spool.write(data)
+        documents = nsl.send_spool(1, spool, 'b1.log.gz', 'caption')
+
+    assert [name for name, _ in uploads] == ['b1.log.gz.001', 'b1.log.gz.002', 'b1.log.gz.003']
+    assert [len(part) for _, part in uploads] == [1000, 1000, 500]
+    assert b''.join(part for _, part in uploads) == data
+    assert re.match(r'caption \(часть 1/3\)\nСоберите файл', documents[0][1])
+
+
+def test_file_part(nsl):
+    with tempfile.TemporaryFile() as f:
+        f.write(b'0123456789')
+        part = nsl.FilePart(f, 3, 4)
+        assert part.read(3) == b'345'
+        assert part.read() == b'6'
+        assert part.read() == b''
+
+
+def test_compress_log_file(nsl, tmp_path):
+    path = tmp_path / 'b1.log'
+    path.write_bytes(b'line\n' * 100000)
+    spool, suffix = nsl.compress_log_file(str(path))
+    with spool:
+        assert suffix == '.gz'
+        assert gzip.decompress(spool.read()) == path.read_bytes()
+
+
+@pytest.mark.bench
+def test_bench_download(nsl, tmp_path, monkeypatch):
+    sent = []
+
+    def sender(method, url, params=None, files=None, **kwargs):
+        # Read the upload the way requests streams it, counting bytes only
+        name, document = next(iter(files.values()))[:2]
+        size = 0
+        if isinstance(document, bytes):
+            size = len(document)
+        else:
+            while True:
+                chunk = document.read(1024 * 1024)
+                if not chunk:
+                    break
+                size += len(chunk)
+        sent.append(size)
+        result = {'message_id': len(sent), 'date': 0, 'chat': {'id': 1, 'type': 'private'},
+                  'document': {'file_id': f'F{len(sent)}', 'file_unique_id': 'u'}}
+        reply = {'ok': True, 'result': result}
+        return types.SimpleNamespace(status_code=200, text=json.dumps(reply), json=lambda: reply)
+
+    monkeypatch.setattr(telebot.apihelper, 'CUSTOM_REQUEST_SENDER', sender)
+    path = tmp_path / 'big.log'
+    with open(path, 'w') as f:
+        for i in range(1_500_000):
+            f.write(f"2026-01-01 12:{i // 60000 % 60:02d}:{i // 1000 % 60:02d},{i % 1000:03d} - app - "
+                    f"{'ERROR' if i % 50 == 0 else 'INFO'} - request {i} handled for user {i % 977}\n")
+    size = os.path.getsize(path)
+
+    def readlines():
+        # What downloads did before: the whole file in memory, uploaded as is
+        with open(path) as f:
+            data = ''.join(f.readlines()).encode()
+        nsl.bot.send_document(1, data, visible_file_name='big.log')
+
+    for name, download in (('readlines', readlines), ('streamed', lambda: nsl.send_log_file(1, 'big', str(path)))):
+        sent.clear()
+        tracemalloc.start()
+        started = time.perf_counter()
+        download()
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"\n{name}: {size / 2**20:.0f} MiB log, {sum(sent) / 2**20:.1f} MiB sent in {len(sent)} uploads, "
+              f"{elapsed:.2f} s, peak memory {peak / 2**20:.0f} MiB")
@@ -0,0 +1,154 @@
+import os
+import time
+
+import pytest
+
+from conftest import make_call
+
+
+def traceback(exception: str, line: int = 10, at: str = '2026-01-01 00:00:00', function: str = 'work') -> str:
+    return (
+        f"{at},000 - app - ERROR - Failed to handle update\n"
+        f"Traceback (most recent call last):\n"
+        f'  File "/srv/bot/app.py", line {line}, in main\n'
+        f"    run()\n"
+        f'  File "/srv/bot/jobs.py", line {line * 2}, in {function}\n'
+        f"    int(value)\n"
+        f"{exception}\n"
+    )
+
+
+@pytest.fixture
+def index(nsl, tmp_path, monkeypatch):
+    """Fresh error index in place of the global one"""
+    index = nsl.ErrorIndex(str(tmp_path / 'errors.db'))
+    monkeypatch.setattr(nsl, 'error_index', index)
+    return index
+
+
+def test_fingerprint_groups_tracebacks(nsl):
+    fingerprint, title = nsl.error_fingerprint(traceback("ValueError: invalid literal for int(): 'x'"))
+    assert title == 'ValueError в jobs.py:work'
+    # Other line numbers and messages, same exception in the same place
+    assert nsl.error_fingerprint(traceback("ValueError: invalid literal for int(): 'y'", line=42))[0] == fingerprint
+    assert nsl.error_fingerprint(traceback("TypeError: bad operand"))[0] != fingerprint
+    assert nsl.error_fingerprint(traceback("ValueError: x", function='other'))[0] != fingerprint
+
+
+def test_fingerprint_masks_messages(nsl):
+    one = nsl.error_fingerprint("2026-01-01 00:00:00,000 - db - ERROR - Timeout after 30 s for user 17\n")
+    two = nsl.error_fingerprint("2026-01-02 10:00:00,000 - db - ERROR - Timeout after 5 s for user 99\n")
+    assert one == two and one[1] == 'db: Timeout after * s for user *'
+    assert nsl.error_fingerprint("2026-01-01 00:00:00,000 - api - ERROR - Timeout after 30 s for user 17\n") != one
+
+
+def test_index_counts_groups(nsl, index):
+    index.add('b', [traceback('ValueError: a', at='2026-01-01 00:00:00'),
+                    traceback('ValueError: b', at='2026-01-01 00:05:00'),
+                    traceback('KeyError: c')], 1, 100)
+    index.add('b', [traceback('ValueError: latest', at='2026-01-01 00:10:00')], 1, 200)
+    index.add('other', [traceback('KeyError: c')], 2, 50)
+    (first, second), groups, total = index.top('b')
+    assert (groups, total) == (2, 4)
+    assert (first['title'], first['count']) == ('ValueError в jobs.py:work', 3)
+    assert first['first_seen'] == time.mktime((2026, 1, 1, 0, 0, 0, 0, 0, -1))
+    assert first['last_seen'] == time.mktime((2026, 1, 1, 0, 10, 0, 0, 0, -1))
+    # The newest record is the sample
+    assert first['sample'].endswith('ValueError: latest')
+    assert (second['title'], second['count']) == ('KeyError в jobs.py:work', 1)
+
+    # The position survives a restart
+    assert nsl.ErrorIndex(index.path).cursor('b') == (1, 200)
+
+
+def test_index_limits_groups(nsl, index, monkeypatch):
+    monkeypatch.setattr(nsl, 'ERROR_GROUPS_LIMIT', 2)
+    for minute, exception in enumerate(('AError', 'BError', 'CError')):
+        index.add('b', [traceback(f'{exception}: x', at=f'2026-01-01 00:0{minute}:00')], 1, minute)
+    rows, groups, _ = index.top('b')
+    # The group not seen for the longest time is forgotten
+    assert groups == 2 and {row['title'] for row in rows} == {'BError в jobs.py:work', 'CError в jobs.py:work'}
+
+
+def test_sample_is_cut(nsl, index):
+    record = traceback('ValueError: x').replace('    run()\n', '    run()\n' * 50)
+    index.add('b', [record], 1, 1)
+    (row,), _, _ = index.top('b')
+    assert len(row['sample'].split('\n')) == nsl.ERROR_SAMPLE_LINES
+
+
+def test_aggregator_indexes_appended_errors(nsl, db, index):
+    db.execute("INSERT INTO bots (name, exe_path, username) VALUES ('failing', 'x', 'y')")
+    db.commit()
+    path = nsl.get_log_path('failing')
+    with open(path, 'w') as f:
+        f.write(traceback('ValueError: one') + "2026-01-01 00:00:01,000 - app - INFO - recovered\n")
+    aggregator = nsl.LogAggregator(60)
+    aggregator.refresh()
+    with open(path, 'a') as f:
+        f.write(traceback('ValueError: two'))
+    aggregator.refresh()
+    # The last record is complete only once another one starts
+    assert index.top('failing')[1:] == (1, 1)
+    with open(path, 'a') as f:
+        f.write("2026-01-01 00:00:02,000 - app - INFO - recovered\n")
+    aggregator.refresh()
+    assert index.top('failing')[1:] == (1, 2)
+    assert index.cursor('failing') == (os.stat(path).st_ino, os.path.getsize(path))
+
+    # A restarted aggregator resumes where the index stopped
+    aggregator = nsl.LogAggregator(60)
+    aggregator.refresh()
+    assert index.top('failing')[1:] == (1, 2)
+
+
+def test_render_top_errors(nsl, index):
+    index.add('b', [traceback('ValueError: <bad> & worse')], 1, 1)
+    rows, _, _ = index.top('b')
+    pages = nsl.render_top_errors(rows)
+    assert len(pages) == 1
+    first_line, times, *sample = pages[0].split('\n')
+    assert first_line == '×1 ValueError в jobs.py:work'
+    assert times == 'первая: 2026-01-01 00:00, последняя: 2026-01-01 00:00'
+    assert sample[-1] == 'ValueError: &lt;bad&gt; &amp; worse'
+
+    # Many groups are spread over pages that fit a message
+    index.add('many', [traceback(f'E{i}Error: ' + 'x' * 300) for i in range(40)], 1, 1)
+    rows, _, _ = index.top('many', 40)
+    pages = nsl.render_top_errors(rows)
+    assert len(pages) > 1 and all(len(page) <= nsl.PAGE_LIMIT for page in pages)
+
+
+def test_errors_button(nsl, db, add_user, index, telegram):
+    add_user('alice', bots=['b'])
+    data = nsl.encode_callback('errors', 'b')
+    nsl.handle_callback(make_call(data))
+    (args, _), = telegram.sent('send_message')
+    assert 'пока не найдено ошибок' in args[1]
+
+    index.add('b', [traceback('ValueError: x'), traceback('ValueError: y'), traceback('KeyError: z')], 1, 1)
+    nsl.handle_callback(make_call(data))
+    args, kwargs = telegram.sent('send_message')[-1]
+    assert args[1].startswith('🧯 Топ ошибок бота b (2 из 2 групп, всего ошибок: 3):')
+    assert '×2 ValueError в jobs.py:work' in args[1] and kwargs['parse_mode'] == 'HTML'
+
+    # Bots of other users stay hidden
+    nsl.handle_callback(make_call(nsl.encode_callback('errors', 'secret')))
+    (args, _), = [call for call in telegram.sent('answer_callback_query') if len(call[0]) > 1]
+    assert 'нет доступа' in args[1]
+    assert len(telegram.sent('send_message')) == 2
+
+
+@pytest.mark.bench
+def test_bench_error_index(nsl, index):
+    records = [traceback(f'E{i % 50}Error: value {i}', line=i) for i in range(20000)]
+    started = time.perf_counter()
+    for start in range(0, len(records), 500):
+        index.add('bench', records[start:start + 500], 1, start)
+    add_time = time.perf_counter() - started
+    started = time.perf_counter()
+    for _ in range(100):
+        nsl.render_top_errors(index.top('bench')[0])
+    top_time = (time.perf_counter() - started) / 100
+    print(f"\n{len(records)} records in 50 groups: {len(records) / add_time:.0f} records/s, "
+          f"top with render {top_time * 1000:.2f} ms")
@@ -0,0 +1,39 @@
+import time
+
+import pytest
+import telebot
+
+from conftest import update_json
+
+
+def test_parse_log_filter(nsl):
+    assert nsl.parse_log_filter([]) == (nsl.FILTER_DEFAULT_RECORDS, nsl.LogFilter())
+    assert nsl.parse_log_filter(['30', 'error', '2h', 'app.db']) == (30, nsl.LogFilter('ERROR', 7200, 'app.db'))
+    assert nsl.parse_log_filter(['100000'])[0] == nsl.FILTER_MAX_RECORDS
+
+
+@pytest.mark.parametrize('count', ['0', '-5', '000'])
+def test_parse_log_filter_rejects_count(nsl, count):
+    assert nsl.parse_log_filter([count, 'error']) is None
+
+
+def test_tail_usage_on_bad_count(nsl, db, add_user, telegram):
+    add_user('alice', bots=['b1'])
+    message = telebot.types.Update.de_json(update_json(1, text='/tail b1 0 error')).message
+    nsl.handle_tail(message)
+    (args, _), = telegram.sent('send_message')
+    assert args[1].startswith("ℹ️ Использование: /tail")
+
+
+def test_filtered_records(nsl):
+    now = time.time()
+    with open(nsl.get_log_path('filtered'), 'w') as f:
+        for i in range(20):
+            level = 'ERROR' if i % 5 == 0 else 'INFO'
+            stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now - 60 * (20 - i)))
+            f.write(f"{stamp},000 - app.db - {level} - record {i}\n")
+            if level == 'ERROR':
+                f.write("Traceback (most recent call last):\n  boom\n")
+    records = nsl.get_filtered_records('filtered', 3, nsl.LogFilter(level='ERROR'))
+    assert [record.split('\n')[0].split(' - ')[-1] for record in records] == ['record 5', 'record 10', 'record 15']
+    assert all(record.endswith('boom') for record in records)
@@ -0,0 +1,120 @@
+import os
+
+import pytest
+
+from conftest import make_call
+
+
+def append(path: str, text: str):
+    with open(path, 'a') as f:
+        f.write(text)
+
+
+@pytest.fixture
+def follower(nsl, monkeypatch):
+    """Follower whose thread never wakes up, ticked by the tests themselves"""
+    monkeypatch.setattr(nsl, 'FOLLOW_INTERVAL', 3600)
+    follower = nsl.LogFollower()
+    monkeypatch.setattr(nsl, 'log_follower', follower)
+    return follower
+
+
+@pytest.fixture
+def followed(nsl, db, add_user, telegram):
+    """Log of bot 'followed' that alice may read"""
+    add_user('alice', bots=['followed', 'second'])
+    for bot_name in ('followed', 'second'):
+        with open(nsl.get_log_path(bot_name), 'w') as f:
+            f.write("2026-01-01 00:00:00,000 - app - INFO - old\n")
+    return nsl.get_log_path('followed')
+
+
+def test_watch_reads_appended_lines(nsl, tmp_path):
+    path = str(tmp_path / 'w.log')
+    append(path, "old\n")
+    watch = nsl.FollowWatch(path)
+    assert watch.poll() == []
+    append(path, "one\ntw")
+    assert watch.poll() == ["one\n"]
+    append(path, "o\n")
+    assert watch.poll() == ["two\n"]
+    assert watch.poll() == []
+
+
+def test_watch_follows_rotation(nsl, tmp_path):
+    path = str(tmp_path / 'w.log')
+    append(path, "old\n")
+    watch = nsl.FollowWatch(path)
+    watch.poll()
+    os.rename(path, path + '.1')
+    append(path, "new\n")
+    assert watch.poll() == ["new\n"]
+
+
+def test_render_keeps_newest_lines(nsl):
+    session = nsl.FollowSession(1, 'alice', 'b<1>')
+    assert 'Ожидание' in session.render()
+    session.lines.extend(f"<line {i}> {'x' * 300}\n" for i in range(30))
+    text = session.render()
+    assert len(text) <= 4096
+    assert 'b&lt;1&gt;' in text and '&lt;line 29&gt;' in text and '&lt;line 0&gt;' not in text
+
+
+def test_follow_button(nsl, follower, followed, telegram):
+    nsl.handle_callback(make_call(nsl.encode_callback('follow', 'followed')))
+    (args, kwargs), = telegram.sent('send_message')
+    assert 'в реальном времени' in args[1]
+    session = follower._sessions[(1, 'followed')]
+    assert session.message_id is not None
+
+
+def test_batches_lines_into_one_update(nsl, follower, followed, telegram):
+    first = follower.subscribe(1, 'alice', 'followed')
+    second = follower.subscribe(2, 'alice', 'followed')
+    first.message_id, second.message_id = 10, 20
+    # One watch for the file, whatever the number of sessions
+    assert len(follower._watches) == 1
+    follower.tick()
+    for i in range(100):
+        append(followed, f"2026-01-01 00:00:01,000 - app - INFO - line {i}\n")
+    follower.tick()
+    edits = telegram.sent('edit_message_text')
+    assert sorted(args[2] for args, _ in edits) == [10, 20]
+    assert all('line 99' in args[0] for args, _ in edits)
+    # Nothing new, nothing sent
+    follower.tick()
+    assert len(telegram.sent('edit_message_text')) == 2
+
+
+def test_chat_cap(nsl, follower, followed, monkeypatch):
+    monkeypatch.setattr(nsl, 'FOLLOW_MAX_PER_CHAT', 1)
+    assert follower.subscribe(1, 'alice', 'followed') is not None
+    assert follower.subscribe(1, 'alice', 'second') is None
+    assert follower.subscribe(2, 'alice', 'second') is not None
+
+
+def test_unsubscribe_drops_watch(nsl, follower, followed):
+    follower.subscribe(1, 'alice', 'followed')
+    assert follower.unsubscribe(1, 'followed') is not None
+    assert follower._watches == {}
+    assert follower.tick() is False
+
+
+def test_revoked_access_stops(nsl, db, follower, followed, telegram):
+    follower.subscribe(1, 'alice', 'followed').message_id = 10
+    db.execute("DELETE FROM bot_ladmins WHERE bot_name = 'followed'")
+    db.commit()
+    nsl.invalidate_user_access()
+    follower.tick()
+    (args, _), = telegram.sent('edit_message_text')
+    assert 'доступ к боту отозван' in args[0]
+    assert follower._sessions == {}
+
+
+def test_idle_session_times_out(nsl, follower, followed, telegram, monkeypatch):
+    follower.subscribe(1, 'alice', 'followed').message_id = 10
+    monkeypatch.setattr(nsl, 'FOLLOW_IDLE_TIMEOUT', -1)
+    follower.tick()
+    (args, _), = telegram.sent('edit_message_text')
+    assert 'по таймауту' in args[0]
+    assert follower._sessions == {}
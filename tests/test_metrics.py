@@ -0,0 +1,207 @@
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+import telebot
+
+from conftest import free_port, make_call, update_json
+
+# One sample of the Prometheus text format: name, optional labels, value
+SAMPLE_RE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{[a-zA-Z_]\w*="(?:[^"\\]|\\.)*"(?:,[a-zA-Z_]\w*="(?:[^"\\]|\\.)*")*\})? \S+$')
+
+
+@pytest.fixture
+def registry(nsl, monkeypatch):
+    """Fresh registry in place of the global one"""
+    registry = nsl.MetricsRegistry()
+    monkeypatch.setattr(nsl, 'metrics', registry)
+    return registry
+
+
+def test_histogram(nsl):
+    histogram = nsl.LatencyHistogram()
+    for seconds in (0.001, 0.005, 0.02, 0.02, 30):
+        histogram.observe(seconds)
+    snapshot = histogram.snapshot()
+    # Bounds are inclusive, like Prometheus' le
+    assert snapshot['buckets'][0.005] == 2 and snapshot['buckets'][0.025] == 2
+    assert snapshot['buckets'][float('inf')] == 1
+    assert snapshot['count'] == 5 and snapshot['sum'] == pytest.approx(30.046)
+    assert histogram.quantile(0.5) == 0.025
+    assert histogram.quantile(1) == float('inf')
+    assert nsl.LatencyHistogram().quantile(0.95) == 0.0
+
+
+def test_threads_record_apart(nsl):
+    histogram = nsl.LatencyHistogram()
+    threads = [threading.Thread(target=lambda: [histogram.observe(0.001) for _ in range(1000)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    histogram.observe(1)
+    assert histogram.count == 4001 and histogram.total == pytest.approx(5)
+    # Shards of finished threads are folded into one
+    assert len(histogram._shards._shards) == 1
+
+
+def test_family(nsl, registry):
+    family = registry.family('nsl_db_seconds', 'statement')
+    family['a'].observe(0.001)
+    assert family['a'] is registry.histogram('nsl_db_seconds', statement='a')
+    assert family['a'].count == 1
+
+
+def test_handlers_timed_by_name(nsl, db, add_user, telegram):
+    add_user('op', rank='operator')
+    before = nsl.handler_seconds['handle_stats'].count
+    update = telebot.types.Update.de_json(update_json(1, username='op', text='/stats'))
+    telebot.TeleBot.process_new_updates(nsl.bot, [update])
+    assert nsl.handler_seconds['handle_stats'].count == before + 1
+    assert '_run_middlewares_and_handler' not in nsl.handler_seconds
+
+
+def test_registry(nsl, registry):
+    registry.inc('requests_total', op='a', kind='x')
+    registry.inc('requests_total', 2, kind='x', op='a')
+    assert registry.counter_values('requests_total') == {(('kind', 'x'), ('op', 'a')): 3}
+
+    @registry.timed('call_seconds', op='f')
+    def f(fail):
+        """Doc"""
+        if fail:
+            raise ValueError
+        return 1
+
+    assert f(False) == 1
+    with pytest.raises(ValueError):
+        f(True)
+    assert (f.__name__, f.__doc__) == ('f', 'Doc')
+    (labels, histogram), = registry.histogram_values('call_seconds')
+    assert labels == (('op', 'f'),) and histogram.count == 2
+
+
+def test_prometheus_format(nsl, registry, caplog):
+    registry.inc('nsl_errors_total', level='error')
+    registry.inc('nsl_errors_total', level='warn"ing\n')
+    registry.observe('nsl_db_seconds', 0.003, statement='a\\b')
+    registry.observe('nsl_db_seconds', 0.2, statement='a\\b')
+    registry.add_collector(lambda: [('gauge', 'nsl_queue_depth', {'pool': 'io'}, 4)])
+    registry.add_collector(lambda: 1 / 0)
+    text = registry.render_prometheus()
+    lines = text.splitlines()
+
+    assert text.endswith('\n')
+    assert all(line.startswith('# TYPE ') or SAMPLE_RE.match(line) for line in lines)
+    assert [line for line in lines if line.startswith('#')] == [
+        '# TYPE nsl_errors_total counter', '# TYPE nsl_db_seconds histogram', '# TYPE nsl_queue_depth gauge'
+    ]
+    assert 'nsl_errors_total{level="warn\\"ing\\n"} 1' in lines
+    assert 'nsl_db_seconds_bucket{statement="a\\\\b",le="0.005"} 1' in lines
+    assert 'nsl_db_seconds_bucket{statement="a\\\\b",le="0.25"} 2' in lines
+    assert 'nsl_db_seconds_bucket{statement="a\\\\b",le="+Inf"} 2' in lines
+    assert 'nsl_db_seconds_count{statement="a\\\\b"} 2' in lines
+    assert 'nsl_queue_depth{pool="io"} 4' in lines
+    # A failing collector is logged and skipped
+    assert 'Error collecting metrics' in caplog.text
+
+
+def test_render_stats(nsl, registry):
+    registry.observe('nsl_handler_seconds', 0.002, handler='handle_<x>')
+    registry.inc('nsl_handler_errors_total', handler='handle_<x>')
+    text = nsl.render_stats()
+    assert 'handle_&lt;x&gt;: 1, ср. 2.0 мс, p95 ≤ 5.0 мс, ошибок 1' in text
+    # Sections without samples say so
+    assert '<b>🗄 База данных</b>:\nнет данных' in text
+
+
+def test_stats_command(nsl, db, add_user, telegram):
+    add_user('op', rank='operator', user_id=1)
+    add_user('alice', user_id=2)
+    nsl.handle_callback(make_call(nsl.encode_callback('result', '', 1, 0), username='op'))
+    for user_id, username in ((1, 'op'), (2, 'alice')):
+        message = telebot.types.Update.de_json(update_json(1, user_id=user_id, username=username, text='/stats')).message
+        nsl.handle_stats(message)
+    (op_args, kwargs), (alice_args, _) = telegram.sent('send_message')
+    assert 'handle_result_page_callback' in op_args[1] and kwargs['parse_mode'] == 'HTML'
+    assert alice_args[1].startswith('❌ Статистика доступна только')
+
+
+def test_metrics_file(nsl, registry, monkeypatch):
+    registry.inc('nsl_bytes_sent_total', 10)
+    monkeypatch.setattr(nsl, 'METRICS_FILE', 'metrics.prom')
+    nsl.MetricsExporter().write_file()
+    with open(f'{nsl.DATA_DIR}/metrics.prom') as f:
+        assert f.read() == registry.render_prometheus()
+
+
+def test_metrics_endpoint(nsl, registry, monkeypatch):
+    registry.inc('nsl_bytes_sent_total', 10)
+    monkeypatch.setattr(nsl, 'METRICS_PORT', free_port())
+    exporter = nsl.MetricsExporter()
+    exporter.start()
+    try:
+        url = f'http://{nsl.METRICS_HOST}:{nsl.METRICS_PORT}'
+        with urllib.request.urlopen(url + '/metrics', timeout=5) as response:
+            assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+            assert response.read().decode() == registry.render_prometheus()
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(url + '/other', timeout=5)
+        assert e.value.code == 404
+    finally:
+        exporter.stop()
+
+
+@pytest.mark.bench
+def test_bench_metrics_overhead(nsl, db, add_user, bot_api):
+    """Time spent in metrics calls while handling log views, as a share of the handler time"""
+    add_user('alice', bots=['b1'])
+    with open(nsl.get_log_path('b1'), 'w') as f:
+        f.write(''.join(f"2026-01-01 00:00:00,000 - app - INFO - line {i}\n" for i in range(1000)))
+    data = nsl.encode_callback('log', 'b1', 50)
+    update = telebot.types.Update.de_json(update_json(1, data=data))
+
+    def handle():
+        # What a dispatcher worker runs for the update, the Bot API answering at once
+        telebot.TeleBot.process_new_updates(nsl.bot, [update])
+
+    # Metric calls made by one view, with access and tail cached as in steady state
+    handle()
+    calls = {'inc': 0, 'lookup': 0, 'family lookup': 0, 'observe': 0}
+    with pytest.MonkeyPatch.context() as patch:
+        for cls, name, kind in ((nsl.MetricsRegistry, 'inc', 'inc'), (nsl.MetricsRegistry, 'histogram', 'lookup'),
+                                (nsl.HistogramFamily, '__getitem__', 'family lookup'),
+                                (nsl.LatencyHistogram, 'observe', 'observe')):
+            def counting(*args, original=getattr(cls, name), kind=kind, **kwargs):
+                calls[kind] += 1
+                return original(*args, **kwargs)
+            patch.setattr(cls, name, counting)
+        handle()
+
+    registry = nsl.MetricsRegistry()
+    histogram = registry.histogram('nsl_bench_seconds', handler='x')
+    family = registry.family('nsl_bench_seconds', 'handler')
+    timed = {'handler': (handle, 400),
+             'inc': (lambda: registry.inc('nsl_bench_total', handler='x'), 20000),
+             'lookup': (lambda: registry.histogram('nsl_bench_seconds', handler='x'), 20000),
+             'family lookup': (lambda: family['x'], 20000),
+             # Every observation also takes the time twice
+             'observe': (lambda: histogram.observe(time.perf_counter() - time.perf_counter()), 20000)}
+    # Best of interleaved batches, as timeit does, so that noise from other processes drops out
+    costs = dict.fromkeys(timed, float('inf'))
+    for _ in range(10):
+        for kind, (call, rounds) in timed.items():
+            started = time.perf_counter()
+            for _ in range(rounds):
+                call()
+            costs[kind] = min(costs[kind], (time.perf_counter() - started) / rounds)
+    handler_time = costs['handler']
+
+    overhead = sum(calls[kind] * costs[kind] for kind in calls)
+    print(f"\nlog view {handler_time * 1e6:.0f} us; "
+          + ', '.join(f"{calls[kind]} {kind} x {costs[kind] * 1e9:.0f} ns" for kind in calls)
+          + f": {overhead * 1e6:.1f} us = {overhead / handler_time:.2%} of the handler")
+    assert overhead / handler_time < 0.01
@@ -0,0 +1,109 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def fresh_db(nsl, tmp_path, monkeypatch):
+    """Path of an empty database used by run_on_db()"""
+    path = str(tmp_path / 'ns_system.db')
+    monkeypatch.setattr(nsl, 'DB_PATH', path)
+    yield path
+    nsl.close_db_connections()
+
+
+def run_on_db(func):
+    """Run func on a new thread, so it gets its own connection to DB_PATH"""
+    result = []
+    thread = threading.Thread(target=lambda: result.append(func()))
+    thread.start()
+    thread.join()
+    return result[0] if result else None
+
+
+def user_version(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_migrate_new_database(nsl, fresh_db):
+    run_on_db(nsl.init_database)
+    assert user_version(fresh_db) == len(nsl.SCHEMA_MIGRATIONS)
+    run_on_db(nsl.init_database)
+    assert user_version(fresh_db) == len(nsl.SCHEMA_MIGRATIONS)
+
+
+def test_migrate_legacy_database(nsl, fresh_db):
+    # Databases created before migrations have the base tables and user_version 0
+    conn = sqlite3.connect(fresh_db)
+    conn.executescript(nsl.SCHEMA_MIGRATIONS[0].replace(' IF NOT EXISTS', ''))
+    conn.execute("INSERT INTO users (username, user_id, first_name) VALUES ('alice', 1, 'A')")
+    conn.commit()
+    conn.close()
+
+    run_on_db(nsl.init_database)
+    assert user_version(fresh_db) == len(nsl.SCHEMA_MIGRATIONS)
+    conn = sqlite3.connect(fresh_db)
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {'idx_bot_ladmins_username', 'idx_bans_banned_at', 'idx_auth_codes_username'} <= indexes
+    assert conn.execute("SELECT username FROM users").fetchall() == [('alice',)]
+    conn.close()
+
+
+def test_failed_migration_rolls_back(nsl, fresh_db, monkeypatch):
+    monkeypatch.setattr(nsl, 'SCHEMA_MIGRATIONS', nsl.SCHEMA_MIGRATIONS + ['CREATE TABLE users (x);'])
+
+    def migrate():
+        with pytest.raises(sqlite3.OperationalError):
+            nsl.init_database()
+
+    run_on_db(migrate)
+    assert user_version(fresh_db) == len(nsl.SCHEMA_MIGRATIONS) - 1
+
+
+def test_statements_compile(nsl, db):
+    for name, sql in nsl.STATEMENTS.items():
+        params = {'username': 'x'} if ':username' in sql else (None,) * sql.count('?')
+        db.execute('EXPLAIN ' + sql, params)
+
+
+def ladmin_plan(conn):
+    sql = "EXPLAIN QUERY PLAN SELECT bot_name FROM bot_ladmins WHERE username = ?"
+    return ' '.join(row[3] for row in conn.execute(sql, ('user7',)))
+
+
+@pytest.mark.bench
+def test_bench_ladmin_lookup(nsl, fresh_db):
+    conn = sqlite3.connect(fresh_db)
+    conn.executescript(nsl.SCHEMA_MIGRATIONS[0])
+    conn.executemany("INSERT INTO users (username, user_id, first_name, rank) VALUES (?, ?, 'u', 'ladmin')",
+                     ((f'user{i}', i) for i in range(10000)))
+    conn.executemany("INSERT INTO bots (name, exe_path, username) VALUES (?, 'x', 'y')",
+                     ((f'bot{i}',) for i in range(10000)))
+    conn.executemany("INSERT INTO bot_ladmins (bot_name, username) VALUES (?, ?)",
+                     ((f'bot{i % 10000}', f'user{i // 5}') for i in range(50000)))
+    conn.commit()
+
+    def lookup_time():
+        started = time.perf_counter()
+        for i in range(200):
+            rows = conn.execute("SELECT bot_name FROM bot_ladmins WHERE username = ?", (f'user{i}',)).fetchall()
+            assert len(rows) == 5
+        return (time.perf_counter() - started) / 200
+
+    before_plan, before = ladmin_plan(conn), lookup_time()
+    conn.close()
+    run_on_db(nsl.init_database)
+    conn = sqlite3.connect(fresh_db)
+    after_plan, after = ladmin_plan(conn), lookup_time()
+    conn.close()
+
+    print(f"\nbefore: {before_plan}, {before * 1e6:.0f} us"
+          f"\nafter:  {after_plan}, {after * 1e6:.0f} us")
+    assert before_plan.startswith('SCAN')
+    assert 'idx_bot_ladmins_username' in after_plan
@@ -0,0 +1,90 @@
+import html
+import os
+import random
+
+import pytest
+
+from conftest import make_call
+
+
+def test_escape_to_fit(nsl):
+    assert nsl.escape_to_fit('a<b', 10) == 'a&lt;b'
+    # Cut before escaping: an entity is never split
+    assert nsl.escape_to_fit('<<<<', 10) == '&lt;&lt;…'
+    assert len(nsl.escape_to_fit('x' * 100, 10)) == 10
+
+
+def test_paginate_lines(nsl):
+    rng = random.Random(1)
+    for _ in range(200):
+        lines = [rng.choice(['<a>', '&', 'ж', 'x']) * rng.randint(0, 30) for _ in range(rng.randint(1, 40))]
+        pages = nsl.paginate_lines(lines, 50)
+        assert all(len(page) <= 50 for page in pages)
+        # Lines that fit stay whole and in order
+        assert '\n'.join(pages).split('\n') == [nsl.escape_to_fit(line, 50) for line in lines]
+
+
+@pytest.fixture
+def paged_log(nsl):
+    """Log of bot 'paged' with lines that need escaping"""
+    path = nsl.get_log_path('paged')
+    with open(path, 'w') as f:
+        for i in range(300):
+            f.write(f"2026-01-01 00:00:00,000 - app - INFO - <line {i}> & {'ж' * (i % 40)}\n")
+    return path
+
+
+def test_line_ranges_round_trip(nsl, paged_log):
+    snapshot = nsl.get_log_tail('paged', 200)
+    ranges = nsl.pack_line_ranges(snapshot, 1000)
+    # Contiguous ranges from the first line to the end, on line boundaries
+    assert ranges[0][0] == snapshot.lines[0][0] and ranges[-1][1] == snapshot.end
+    assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+    texts = [nsl.read_page_range((paged_log, snapshot.inode), start, end) for start, end in ranges]
+    assert all(len(text) + 1 <= 1000 for text in texts)
+    expected = [html.escape(line.rstrip('\n'), quote=False) for _, line in snapshot.lines]
+    assert '\n'.join(texts).split('\n') == expected
+    # The newest page, shown first, is a full one
+    assert len(texts[-1]) > 900
+
+
+def test_paged_result_round_trip(nsl, db, add_user, paged_log, telegram):
+    add_user('alice', bots=['paged'])
+    snapshot = nsl.get_log_tail('paged', 200)
+    ranges = nsl.pack_line_ranges(snapshot)
+    result_id = nsl.store_paged_result(1, 'paged', 'Title', ranges, source=(paged_log, snapshot.inode))
+    for page in range(len(ranges)):
+        text, keyboard = nsl.render_paged_result(result_id, page)
+        assert text == f"Title\n\n<code>{nsl.read_page_range((paged_log, snapshot.inode), *ranges[page])}</code>"
+        back, current, forward = (nsl.decode_callback(button.callback_data) for button in keyboard.keyboard[0])
+        assert (back.params, current.params, forward.params) == (
+            (result_id, max(page - 1, 0)), (result_id, page), (result_id, min(page + 1, len(ranges) - 1))
+        )
+    assert nsl.render_paged_result(result_id, len(ranges)) is None
+
+    # A page turn edits the message in place
+    nsl.handle_callback(make_call(nsl.encode_callback('result', '', result_id, 0)))
+    (args, _), = telegram.sent('edit_message_text')
+    assert '&lt;line 100&gt;' in args[0]
+    # Results of another chat are not shown
+    nsl.handle_callback(make_call(nsl.encode_callback('result', '', result_id, 0), chat_id=2))
+    assert telegram.sent('answer_callback_query')[-1][0][1] == "❌ У вас нет доступа к этим результатам."
+
+    # Rotation and truncation make byte ranges stale
+    os.rename(paged_log, paged_log + '.1')
+    with open(paged_log, 'w') as f:
+        f.write('x\n')
+    assert nsl.render_paged_result(result_id, 0) is None
+    os.rename(paged_log + '.1', paged_log)
+    with open(paged_log, 'r+') as f:
+        f.truncate(ranges[-1][0])
+    assert nsl.render_paged_result(result_id, 0) is not None
+    assert nsl.render_paged_result(result_id, len(ranges) - 1) is None
+
+
+def test_paged_result_expires(nsl, monkeypatch):
+    result_id = nsl.store_paged_result(1, 'paged', 'Title', ['one', 'two'])
+    assert nsl.render_paged_result(result_id, 1)[0] == "Title\n\n<code>two</code>"
+    monkeypatch.setattr(nsl, 'PAGED_RESULTS_TTL', -1)
+    result_id = nsl.store_paged_result(1, 'paged', 'Title', ['one'])
+    assert nsl.get_paged_result(result_id) is None
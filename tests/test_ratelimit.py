@@ -0,0 +1,71 @@
+import pytest
+
+from conftest import make_call
+
+
+@pytest.fixture
+def limiters(nsl, monkeypatch):
+    """Fresh limiters: one request per minute per user, no bot limit"""
+    monkeypatch.setattr(nsl, 'user_limiter', nsl.RateLimiter(1, 1))
+    monkeypatch.setattr(nsl, 'bot_limiter', nsl.RateLimiter(0, 1))
+
+
+def test_bucket_refills(nsl):
+    limiter = nsl.RateLimiter(6, 2)
+    assert limiter.wait_time('a', 0) == 0
+    limiter.take('a', 0)
+    limiter.take('a', 0)
+    assert limiter.wait_time('a', 0) == pytest.approx(10)
+    assert limiter.wait_time('a', 4) == pytest.approx(6)
+    assert limiter.wait_time('a', 10) == 0
+    # Buckets are per key, and fill up to the burst only
+    assert limiter.wait_time('b', 0) == 0
+    limiter.take('a', 1000)
+    limiter.take('a', 1000)
+    assert limiter.wait_time('a', 1000) > 0
+
+
+def test_refund(nsl):
+    limiter = nsl.RateLimiter(6, 2)
+    limiter.take('a', 0)
+    limiter.take('a', 0)
+    limiter.refund('a', 0)
+    assert limiter.wait_time('a', 0) == 0
+    limiter.refund('a', 0)
+    limiter.refund('a', 0)
+    assert limiter.buckets['a'] == (2, 0)
+    # Nothing to give back for a key that took nothing
+    limiter.refund('b', 0)
+    assert 'b' not in limiter.buckets
+
+
+def test_disabled_limit(nsl):
+    limiter = nsl.RateLimiter(0, 1)
+    for _ in range(10):
+        limiter.take('a', 0)
+    assert limiter.wait_time('a', 0) == 0
+
+
+def test_check_rate_limit(nsl, limiters):
+    assert nsl.check_rate_limit('alice', 'b1') is None
+    assert nsl.check_rate_limit('alice', 'b1').startswith('⏳ Слишком много запросов. Повторите через')
+    assert nsl.check_rate_limit('bob', 'b1') is None
+
+
+def test_busy_pool_refunds_token(nsl, db, add_user, telegram, limiters, monkeypatch):
+    add_user('alice', bots=['b1'])
+    with open(nsl.get_log_path('b1'), 'w') as f:
+        f.write("2026-01-01 00:00:00,000 - app - ERROR - boom\n")
+    monkeypatch.setattr(nsl.io_pool, 'submit', lambda task, *args: False)
+    data = nsl.encode_callback('filter', 'b1', arg='error')
+    nsl.handle_callback(make_call(data))
+    assert telegram.sent('answer_callback_query')[-1][0][1] == nsl.BUSY_TEXT
+
+    # The refused request did not use up the only token of the minute
+    submitted = []
+    monkeypatch.setattr(nsl.io_pool, 'submit', lambda task, *args: submitted.append(task) or True)
+    nsl.handle_callback(make_call(data))
+    assert telegram.sent('answer_callback_query')[-1][0][1] == "⏳ Чтение логов..."
+    nsl.handle_callback(make_call(data))
+    assert telegram.sent('answer_callback_query')[-1][0][1].startswith('⏳ Слишком много запросов')
+    assert len(submitted) == 1
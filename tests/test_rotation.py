@@ -0,0 +1,104 @@
+import gzip
+import os
+import time
+
+import pytest
+
+from conftest import make_call
+
+BASE = time.mktime((2026, 1, 1, 12, 0, 0, 0, 0, -1))
+
+
+def record(i: int, ms: int = 0) -> bytes:
+    stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(BASE + i))
+    text = f"{stamp},{ms:03d} - app - INFO - record {i}\n"
+    if i % 10 == 0:
+        text += "Traceback (most recent call last):\n  ValueError: ж\n"
+    return text.encode()
+
+
+@pytest.fixture
+def rotated(nsl):
+    """Log of bot 'rotated': records 0-99 in .2.gz, 100-199 in .1, 200-229 in the current file"""
+    path = nsl.get_log_path('rotated')
+    with gzip.open(path + '.2.gz', 'wb') as f:
+        f.writelines(record(i) for i in range(100))
+    with open(path + '.1', 'wb') as f:
+        f.writelines(record(i) for i in range(100, 200))
+    with open(path, 'wb') as f:
+        f.writelines(record(i) for i in range(200, 230))
+    yield path
+    for suffix in ('.2.gz', '.1', ''):
+        os.unlink(path + suffix)
+
+
+def lines_of(*ranges) -> list:
+    return b''.join(record(i) for r in ranges for i in r).decode().splitlines()
+
+
+def test_segment_order(nsl):
+    path = nsl.get_log_path('ordered')
+    names = [path + suffix for suffix in ('.1', '', '-20260102.gz', '.2.gz', '-20260101', '.bak')]
+    for name in names:
+        open(name, 'w').close()
+    try:
+        assert nsl.LogSource('ordered').segment_paths() == [
+            path + '-20260101', path + '-20260102.gz', path + '.2.gz', path + '.1', path
+        ]
+    finally:
+        for name in names:
+            os.unlink(name)
+
+
+def test_rotated_tail(nsl, rotated):
+    source = nsl.LogSource('rotated')
+    assert [segment.compressed for segment in source.rotated_segments()] == [True, False]
+    assert source.rotated_tail(3) == lines_of(range(100, 200))[-3:]
+    # Taken from the compressed segment as well once the newer one runs out
+    assert source.rotated_tail(130) == lines_of(range(100))[-10:] + lines_of(range(100, 200))
+
+
+def test_log_view_reads_older_segments(nsl, db, add_user, rotated, telegram):
+    add_user('alice', bots=['rotated'])
+    nsl.handle_callback(make_call(nsl.encode_callback('log', 'rotated', 50)))
+    (args, _), = telegram.sent('send_message')
+    assert 'record 229' in args[1]
+    result = nsl.get_paged_result(max(nsl._paged_results))
+    # Older lines are escaped text, lines of the current file byte ranges
+    assert isinstance(result.pages[0], str) and isinstance(result.pages[-1], tuple)
+    assert 'record 198' in result.pages[0]
+
+
+def test_range_across_rotations(nsl, rotated):
+    source = nsl.LogSource('rotated')
+    assert b''.join(source.iter_range(BASE + 95, BASE + 205)) == b''.join(record(i) for i in range(95, 206))
+    assert b''.join(source.iter_range(BASE, BASE + 1000)) == b''.join(record(i) for i in range(230))
+    assert list(source.iter_range(BASE + 500, BASE + 600)) == []
+
+
+def test_range_end_second_is_inclusive(nsl):
+    path = nsl.get_log_path('millis')
+    with open(path, 'wb') as f:
+        f.writelines([record(1, 0), record(1, 999), record(2, 0)])
+    try:
+        assert b''.join(nsl.LogSource('millis').iter_range(BASE + 1, BASE + 1)) == record(1, 0) + record(1, 999)
+    finally:
+        os.unlink(path)
+
+
+def test_export_across_rotations(nsl, db, rotated, telegram, monkeypatch):
+    exported = []
+
+    def send_spool(chat_id, spool, file_name, caption):
+        spool.seek(0)
+        exported.append((file_name, gzip.decompress(spool.read())))
+        return []
+
+    monkeypatch.setattr(nsl, 'send_spool', send_spool)
+    nsl.export_log_range(1, 'rotated', BASE + 150, BASE + 210)
+    (file_name, data), = exported
+    assert file_name == f"rotated-{time.strftime('%Y%m%d-%H%M', time.localtime(BASE + 150))}.log.gz"
+    assert data == b''.join(record(i) for i in range(150, 211))
+
+    nsl.export_log_range(1, 'rotated', BASE + 500, BASE + 600)
+    assert 'нет записей' in telegram.sent('send_message')[-1][0][1]
@@ -0,0 +1,350 @@
+import asyncio
+import http.client
+import json
+import os
+import queue
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import types
+
+import pytest
+import telebot
+
+from conftest import LAUNCHER, ROOT, WORK_DIR, StubBotAPI, update_json, wait_for
+
+
+def run_bot(tmp_path, **env):
+    """Start nsl-bot.py with extra environment and wait for it to exit"""
+    env = dict(os.environ, DATA_DIR=str(tmp_path / 'data'), LOGS_DIR=str(tmp_path / 'logs'), **env)
+    return subprocess.run([sys.executable, os.path.join(ROOT, 'nsl-bot.py')], cwd=WORK_DIR, env=env,
+                          capture_output=True, text=True, timeout=60)
+
+
+def test_unknown_runtime_refuses_to_start(tmp_path):
+    result = run_bot(tmp_path, NSL_RUNTIME='fibers')
+    assert result.returncode == 1
+    assert "Unknown NSL_RUNTIME 'fibers'" in result.stderr
+    assert not (tmp_path / 'data' / 'ns_system.db').exists()
+
+
+# Imports nsl-bot.py, then creates the bot, and prints what each step took
+IMPORT_PROBE = '''
+import importlib.util, json, sys, time
+started = time.perf_counter()
+spec = importlib.util.spec_from_file_location('nsl_bot', sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+imported = time.perf_counter()
+loaded = sorted(name for name in ('telebot', 'requests', 'dotenv') if name in sys.modules)
+module.get_bot()
+print(json.dumps({'modules': loaded, 'runtime': module.NSL_RUNTIME, 'import': imported - started,
+                  'bot': time.perf_counter() - imported}))
+'''
+
+
+def test_import_is_lazy(tmp_path):
+    shutil.copy(os.path.join(ROOT, 'nsl-bot.py'), tmp_path)
+    (tmp_path / '.env').write_text("NSL_RUNTIME=fibers\n")
+    env = dict(os.environ, DATA_DIR=str(tmp_path / 'data'), LOGS_DIR=str(tmp_path / 'logs'))
+    env.pop('NSL_RUNTIME', None)
+    probe = subprocess.run([sys.executable, '-c', IMPORT_PROBE, str(tmp_path / 'nsl-bot.py')], cwd=tmp_path,
+                           env=env, capture_output=True, text=True, timeout=60, check=True)
+    result = json.loads(probe.stdout)
+    # Importing neither reads .env nor loads telebot, and creates no directories
+    assert result['modules'] == [] and result['runtime'] == 'sync'
+    assert sorted(os.listdir(tmp_path)) == ['.env', 'nsl-bot.py']
+
+    # The bot itself reads .env
+    result = subprocess.run([sys.executable, str(tmp_path / 'nsl-bot.py')], cwd=tmp_path, env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 1 and "Unknown NSL_RUNTIME 'fibers'" in result.stderr
+
+
+@pytest.fixture
+def webhook(nsl):
+    """Webhook server on a free local port with room for two queued updates"""
+    server = nsl.WebhookServer('127.0.0.1', 0, '/hook', 's3cret', 2)
+    thread = threading.Thread(target=server.serve)
+    thread.start()
+    yield server
+    server.stop()
+    thread.join()
+    server.drain()
+
+
+def raw_request(server, request: bytes) -> int:
+    """Send a raw HTTP request and return the response status"""
+    with socket.create_connection(server.httpd.server_address[:2], timeout=5) as sock:
+        sock.sendall(request)
+        return int(sock.makefile('rb').readline().split()[1])
+
+
+def post(server, body: bytes, secret='s3cret', path='/hook') -> int:
+    return raw_request(server, (
+        f"POST {path} HTTP/1.1\r\nHost: x\r\nX-Telegram-Bot-Api-Secret-Token: {secret}\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n"
+    ).encode() + body)
+
+
+def test_webhook_accepts_update(nsl, webhook, monkeypatch):
+    dispatched = []
+    monkeypatch.setattr(nsl.bot, 'process_new_updates', dispatched.extend)
+    assert post(webhook, json.dumps(update_json(1, text='/me')).encode()) == 200
+    webhook.stop()
+    webhook.drain()
+    assert [update.update_id for update in dispatched] == [1]
+
+
+def test_webhook_rejects_bad_requests(webhook):
+    update = json.dumps(update_json(1, text='/me')).encode()
+    assert post(webhook, update, secret='wrong') == 403
+    assert post(webhook, update, path='/other') == 404
+    assert post(webhook, b'{not json') == 400
+    assert post(webhook, b'x' * 100 + b'\n' * (1024 * 1024)) == 413
+    headers = "POST /hook HTTP/1.1\r\nHost: x\r\nX-Telegram-Bot-Api-Secret-Token: s3cret\r\n"
+    assert raw_request(webhook, (headers + "\r\n").encode()) == 400
+    assert raw_request(webhook, (headers + "Content-Length: abc\r\n\r\n").encode()) == 400
+    assert raw_request(webhook, (headers + "Content-Length: -5\r\n\r\n").encode()) == 400
+    assert webhook.received == 0
+
+
+def test_webhook_queue_full(nsl, webhook, monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(nsl.bot, 'process_new_updates', lambda updates: release.wait(5))
+    statuses = [post(webhook, json.dumps(update_json(1, text='/me')).encode())]
+    while webhook.intake.qsize():
+        time.sleep(0.01)
+    # One update is being dispatched, two more fit in the queue
+    statuses += [post(webhook, json.dumps(update_json(i, text='/me')).encode()) for i in range(2, 6)]
+    release.set()
+    assert statuses == [200, 200, 200, 503, 503]
+    assert webhook.rejected == 2
+
+
+@pytest.mark.bench
+def test_bench_webhook(nsl, db, add_user, bot_api):
+    """POST recorded updates to the local endpoint and time them until the reply reaches the Bot API"""
+    count = 2000
+    bot_api.delay = 0.002
+    add_user('alice', bots=['b1'])
+    with open(nsl.get_log_path('b1'), 'w') as f:
+        f.write(''.join(f"2026-01-01 00:00:00,000 - app - INFO - line {i}\n" for i in range(1000)))
+    server = nsl.WebhookServer('127.0.0.1', 0, '/hook', 's3cret', 1000)
+    thread = threading.Thread(target=server.serve)
+    thread.start()
+
+    data = nsl.encode_callback('log', 'b1', 20)
+    bodies = [json.dumps(update_json(i, user_id=1 + i % 20, username='alice', data=data)).encode()
+              for i in range(1, count + 1)]
+    posted = {}
+    connection = http.client.HTTPConnection(*server.httpd.server_address[:2])
+    started = time.perf_counter()
+    for i, body in enumerate(bodies, start=1):
+        posted[str(i)] = time.perf_counter()
+        connection.request('POST', '/hook', body, {'X-Telegram-Bot-Api-Secret-Token': 's3cret'})
+        connection.getresponse().read()
+        connection.close()
+    server.stop()
+    thread.join()
+    server.drain()
+    while nsl.update_dispatcher.depth():
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(at - posted[params['callback_query_id']] for at, method, params in bot_api.requests
+                       if method == 'answerCallbackQuery' and params.get('text') != nsl.BUSY_TEXT)
+    print(f"\n{count} updates in {elapsed:.1f} s: {server.received / elapsed:.0f} accepted/s, "
+          f"{len(latencies)} served, p50 {latencies[len(latencies) // 2] * 1000:.0f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.0f} ms")
+
+
+class FakeAsyncAPI:
+    """AsyncTeleBot stand-in recording the replies, each taking delay seconds"""
+
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.calls = []
+
+    def __getattr__(self, name):
+        async def call(*args, **kwargs):
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            self.calls.append((time.perf_counter(), name, args, kwargs))
+            return types.SimpleNamespace(message_id=1)
+        return call
+
+    def sent(self, name):
+        """Get calls of one method"""
+        return [(at, args) for at, method, args, _ in self.calls if method == name]
+
+
+def run_async(runtime, updates):
+    """Submit updates to the async runtime and wait until they are handled"""
+    async def scenario():
+        accepted = [runtime.submit(telebot.types.Update.de_json(update)) for update in updates]
+        await runtime.drain()
+        return accepted
+    return asyncio.run(scenario())
+
+
+@pytest.fixture
+def log_b1(nsl, db, add_user):
+    """Log of bot 'b1' that alice may read"""
+    add_user('alice', bots=['b1'])
+    with open(nsl.get_log_path('b1'), 'w') as f:
+        f.write(''.join(f"2026-01-01 00:00:00,000 - app - INFO - line {i}\n" for i in range(1000)))
+
+
+def test_async_log_view(nsl, log_b1, telegram, monkeypatch):
+    api = FakeAsyncAPI()
+    runtime = nsl.AsyncRuntime(api)
+    replied = []
+
+    def slow_send(chat_id, text, **kwargs):
+        time.sleep(0.2)
+        replied.append(time.perf_counter())
+
+    # /me runs on the sync handlers, the log view on the loop, and in that order
+    monkeypatch.setattr(nsl.bot, 'send_message', slow_send)
+    data = nsl.encode_callback('log', 'b1', 20)
+    assert run_async(runtime, [update_json(1, text='/me'), update_json(2, data=data),
+                               update_json(3, data=nsl.encode_callback('log', 'other', 20))]) == [True] * 3
+    (sent_at, (chat_id, text)), = api.sent('send_message')
+    assert 'line 999' in text and sent_at > replied[0]
+    answers = [args[1] for _, args in api.sent('answer_callback_query')]
+    assert answers == ["✅ Логи получены", "❌ У вас нет доступа к этому боту."]
+    assert runtime.depth() == 0 and runtime._lanes == {}
+
+    # The page turn of the view is served on the loop as well
+    result_id = max(nsl._paged_results)
+    run_async(runtime, [update_json(4, data=nsl.encode_callback('result', '', result_id, 0))])
+    (_, (text, chat_id, message_id)), = api.sent('edit_message_text')
+    assert 'line 980' in text
+
+
+def test_async_queue_full(nsl, log_b1, monkeypatch):
+    monkeypatch.setattr(nsl, 'HANDLER_QUEUE_SIZE', 1)
+    api = FakeAsyncAPI(delay=0.05)
+    runtime = nsl.AsyncRuntime(api)
+    data = nsl.encode_callback('log', 'b1', 20)
+    assert run_async(runtime, [update_json(1, data=data), update_json(2, user_id=2, data=data)]) == [True, False]
+    assert sorted(args[1] for _, args in api.sent('answer_callback_query')) == [nsl.BUSY_TEXT, "✅ Логи получены"]
+    assert runtime.rejected == 1
+
+
+def test_async_polling(nsl, log_b1, tmp_path):
+    logs = tmp_path / 'logs'
+    logs.mkdir()
+    with open(logs / 'b1.log', 'w') as f:
+        f.write("2026-01-01 00:00:00,000 - app - INFO - from the async runtime\n")
+    api = StubBotAPI()
+    env = dict(os.environ, LOGS_DIR=str(logs), NSL_RUNTIME='async')
+    proc = subprocess.Popen([sys.executable, '-c', LAUNCHER, api.url, os.path.join(ROOT, 'nsl-bot.py')],
+                            cwd=WORK_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    try:
+        api.updates.put(update_json(1, data=nsl.encode_callback('log', 'b1', 20)))
+        assert 'from the async runtime' in wait_for(lambda: api.messages and api.messages[0])
+        proc.send_signal(signal.SIGTERM)
+        _, errors = proc.communicate(timeout=20)
+        assert proc.returncode == 0
+        assert 'Stopping async runtime' in errors and 'Traceback' not in errors
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        api.stop()
+
+
+@pytest.mark.bench
+def test_bench_runtimes(nsl, log_b1, bot_api, monkeypatch):
+    """Handler latency of both runtimes under bursts of concurrent log views against a slow Bot API"""
+    users, bursts, delay = 100, 10, 0.02
+    monkeypatch.setattr(nsl.update_dispatcher, 'max_pending', users * bursts)
+    monkeypatch.setattr(nsl, 'HANDLER_QUEUE_SIZE', users * bursts)
+    bot_api.delay = delay
+    data = nsl.encode_callback('log', 'b1', 20)
+    updates = [[update_json(burst * users + i, user_id=i, data=data) for i in range(1, users + 1)]
+               for burst in range(bursts)]
+
+    def report(name, submitted, answered, elapsed):
+        latencies = sorted(answered[key] - submitted[key] for key in submitted)
+        print(f"\n{name}: {len(latencies)} log views in {elapsed:.1f} s, "
+              f"p50 {latencies[len(latencies) // 2] * 1000:.0f} ms, "
+              f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.0f} ms")
+
+    submitted = {}
+    started = time.perf_counter()
+    for burst in updates:
+        for update in burst:
+            submitted[str(update['update_id'])] = time.perf_counter()
+            nsl.bot.process_new_updates([telebot.types.Update.de_json(update)])
+        time.sleep(0.1)
+    while nsl.update_dispatcher.depth():
+        time.sleep(0.01)
+    answered = {params['callback_query_id']: at for at, method, params in bot_api.requests
+                if method == 'answerCallbackQuery'}
+    report(f"sync, {nsl.HANDLER_WORKERS} workers", submitted, answered, time.perf_counter() - started)
+
+    api = FakeAsyncAPI(delay)
+    runtime = nsl.AsyncRuntime(api)
+    submitted = {}
+
+    async def scenario():
+        for burst in updates:
+            for update in burst:
+                submitted[str(update['update_id'])] = time.perf_counter()
+                runtime.submit(telebot.types.Update.de_json(update))
+            await asyncio.sleep(0.1)
+        await runtime.drain()
+
+    started = time.perf_counter()
+    asyncio.run(scenario())
+    answered = {args[0]: at for at, args in api.sent('answer_callback_query')}
+    report("async", submitted, answered, time.perf_counter() - started)
+
+
+@pytest.mark.bench
+def test_bench_startup(nsl, db, add_user):
+    """Import profile of the module and time from process start to the first reply"""
+    add_user('alice')
+    script = os.path.join(ROOT, 'nsl-bot.py')
+    probe = subprocess.run([sys.executable, '-X', 'importtime', '-c', IMPORT_PROBE, script], cwd=WORK_DIR,
+                           capture_output=True, text=True, timeout=60, check=True)
+    steps = json.loads(probe.stdout)
+    # "import time: self [us] | cumulative [us] | name", nested imports are indented
+    top = sorted(((int(cumulative), name.strip()) for _, cumulative, name in
+                  (line.split('|') for line in probe.stderr.splitlines() if line.startswith('import time:'))
+                  if cumulative.strip().isdigit() and not name[1:].startswith(' ')), reverse=True)
+    print(f"\nmodule import {steps['import'] * 1000:.0f} ms, bot creation {steps['bot'] * 1000:.0f} ms; "
+          "slowest imports: " + ', '.join(f"{name} {us / 1000:.0f} ms" for us, name in top[:5]))
+
+    api = StubBotAPI()
+    replies = queue.Queue()
+    handle = api.handle
+
+    def timed_handle(request, method, params):
+        handle(request, method, params)
+        if method == 'sendMessage':
+            replies.put(time.perf_counter())
+
+    api.handle = timed_handle
+    times = []
+    try:
+        for i in range(5):
+            api.updates.put(update_json(i + 1, text='/start'))
+            started = time.perf_counter()
+            proc = subprocess.Popen([sys.executable, '-c', LAUNCHER, api.url, script], cwd=WORK_DIR,
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                times.append(replies.get(timeout=30) - started)
+            finally:
+                proc.kill()
+                proc.wait()
+    finally:
+        api.stop()
+    times.sort()
+    print(f"first reply after start: median {times[len(times) // 2] * 1000:.0f} ms, best {times[0] * 1000:.0f} ms")
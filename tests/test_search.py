@@ -0,0 +1,127 @@
+import time
+
+import pytest
+
+from conftest import make_call
+
+
+def record(ts: float, text: str) -> str:
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts)) + f",000 - app - INFO - {text}\n"
+
+
+@pytest.fixture
+def log(nsl, monkeypatch):
+    """Write a log for bot 'searched', return its path"""
+    monkeypatch.setattr(nsl, 'LOG_INDEX_STEP', 10)
+    path = nsl.get_log_path('searched')
+    base = time.time() - 3600
+    with open(path, 'w') as f:
+        for i in range(100):
+            f.write(record(base + i * 30, f"request {i} done"))
+            if i == 42:
+                f.write("Traceback (most recent call last):\nValueError: bad (a+)+b input\n")
+    nsl._log_indexes.pop('searched', None)
+    return path
+
+
+def test_search_literal_with_context(nsl, log):
+    lines, complete = nsl.search_log('searched', '(A+)+B')
+    assert complete
+    assert lines[:2] == ['Traceback (most recent call last):', 'ValueError: bad (a+)+b input']
+    assert lines[2].endswith(' - request 43 done')
+    assert len(lines) == 3
+
+
+def test_search_regex_is_not_interpreted(nsl, log):
+    assert nsl.search_log('searched', 'request .* done') == ([], True)
+    lines, _ = nsl.search_log('searched', 'request 7 ')
+    assert len([line for line in lines if 'request 7 ' in line]) == 1
+
+
+def test_search_window(nsl, log):
+    lines, _ = nsl.search_log('searched', 'request', since=time.time() - 1200)
+    matched = [line for line in lines if 'request' in line]
+    assert 0 < len(matched) < 30
+
+
+def test_search_long_lines(nsl, log):
+    # Only the start of a line is searched, whatever its length
+    with open(log, 'a') as f:
+        f.write(record(time.time(), 'a' * 1_000_000 + 'needle'))
+    started = time.perf_counter()
+    assert nsl.search_log('searched', 'needle') == ([], True)
+    assert time.perf_counter() - started < 1
+
+
+@pytest.fixture
+def result_id(nsl, db, add_user, telegram, log):
+    """Search result of alice in chat 1"""
+    add_user('alice', bots=['searched'])
+    add_user('bob', bots=['other'], user_id=2)
+    nsl.run_search(1, 10, 'searched', 'request')
+    args, _ = telegram.sent('edit_message_text')[-1]
+    assert 'request' in args[0]
+    return max(nsl._paged_results)
+
+
+def page_turn(nsl, telegram, result_id, **call):
+    nsl.handle_callback(make_call(nsl.encode_callback('result', '', result_id, 0), **call))
+    return telegram.calls[-1]
+
+
+def test_result_page_owner(nsl, telegram, result_id):
+    edits = len(telegram.sent('edit_message_text'))
+    method, args, _ = page_turn(nsl, telegram, result_id)
+    assert (method, args) == ('answer_callback_query', ('cb',))
+    assert len(telegram.sent('edit_message_text')) == edits + 1
+
+
+def test_result_page_other_user(nsl, telegram, result_id):
+    edits = len(telegram.sent('edit_message_text'))
+    method, args, _ = page_turn(nsl, telegram, result_id, username='bob', user_id=2, chat_id=2)
+    assert method == 'answer_callback_query' and 'нет доступа' in args[1]
+    assert len(telegram.sent('edit_message_text')) == edits
+
+
+def test_result_page_other_chat(nsl, telegram, result_id):
+    # The owner may not move a result into another chat either
+    _, args, _ = page_turn(nsl, telegram, result_id, chat_id=99)
+    assert 'нет доступа' in args[1]
+
+
+def test_result_page_unregistered(nsl, telegram, result_id):
+    _, args, _ = page_turn(nsl, telegram, result_id, username='mallory', user_id=3, chat_id=1)
+    assert 'нет доступа' in args[1]
+
+
+def test_result_page_revoked(nsl, db, telegram, result_id):
+    db.execute("DELETE FROM bot_ladmins WHERE username = 'alice'")
+    db.commit()
+    nsl.invalidate_user_access()
+    _, args, _ = page_turn(nsl, telegram, result_id)
+    assert 'нет доступа' in args[1]
+
+
+def test_match_cap_within_block(nsl, log, monkeypatch):
+    monkeypatch.setattr(nsl, 'GREP_MAX_MATCHES', 5)
+    monkeypatch.setattr(nsl, 'GREP_CONTEXT', 0)
+    # All 100 records are in the newest blocks, the cap holds inside a block
+    lines, complete = nsl.search_log('searched', 'done')
+    assert len([line for line in lines if line != '--']) == 5 and not complete
+    assert lines[-1].endswith(' - request 99 done')
+
+
+def test_window_continuation_at_block_start(nsl, monkeypatch):
+    monkeypatch.setattr(nsl, 'LOG_INDEX_STEP', 10)
+    base = time.time() - 600
+    with open(nsl.get_log_path('continued'), 'w') as f:
+        for i in range(10):
+            f.write(record(base + i, f"request {i}"))
+        # Lines 10 and 11 open the second block but belong to record 9
+        f.write("Traceback (most recent call last):\nKeyError: 'needle'\n")
+        for i in range(10, 20):
+            f.write(record(base + i, f"request {i}"))
+    nsl._log_indexes.pop('continued', None)
+    lines, complete = nsl.search_log('continued', 'needle', since=base - 60)
+    assert complete and "KeyError: 'needle'" in lines
+    assert nsl.search_log('continued', 'needle', since=base + 15) == ([], True)
@@ -0,0 +1,217 @@
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from nsl_handler import NSLoggerHandler
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def shipping(nsl, db, monkeypatch):
+    """Running log shipping listeners for registered bot 'shipped'"""
+    db.execute("INSERT INTO bots (name, exe_path, username) VALUES ('shipped', 'x', 'y')")
+    db.commit()
+    monkeypatch.setattr(nsl, 'LOG_SHIP_TCP', f'127.0.0.1:{free_port()}')
+    monkeypatch.setattr(nsl, 'LOG_SHIP_SOCKET', os.path.join(nsl.LOGS_DIR, 'ship.sock'))
+    path = nsl.get_log_path('shipped')
+    if os.path.exists(path):
+        os.unlink(path)
+    server = nsl.LogShipServer()
+    server.start()
+    yield server
+    for listener in server.servers:
+        listener.shutdown()
+        listener.server_close()
+
+
+def ship(sock, frame) -> int:
+    payload = frame if isinstance(frame, bytes) else json.dumps(frame).encode()
+    sock.sendall(struct.pack('>I', len(payload)) + payload)
+    return sock.recv(1)[0]
+
+
+def connect(nsl):
+    host, _, port = nsl.LOG_SHIP_TCP.rpartition(':')
+    return socket.create_connection((host, int(port)))
+
+
+def read_log(nsl):
+    with open(nsl.get_log_path('shipped')) as f:
+        return f.read().splitlines()
+
+
+def test_frames(nsl, shipping):
+    with connect(nsl) as sock:
+        assert ship(sock, {'bot': 'shipped', 'records': ['one', 'two\n']}) == 0
+        assert ship(sock, {'bot': 'unknown', 'records': ['x']}) == 1
+        assert ship(sock, {'bot': 'shipped'}) == 1
+        assert ship(sock, b'{bad}') == 1
+        # The connection survives rejected frames
+        assert ship(sock, {'bot': 'shipped', 'records': ['three']}) == 0
+    assert read_log(nsl) == ['one', 'two', 'three']
+
+
+def test_rotation_within_batch(nsl, shipping, monkeypatch):
+    path = nsl.get_log_path('shipped')
+    writer = nsl.LogShipWriter()
+    entry = nsl.ShipEntry('shipped', b'before\n')
+    writer._commit([entry])
+    assert entry.committed
+    file = writer._file
+    calls = []
+
+    def rotating_file(bot_name):
+        # logrotate moves the log away between two entries of one batch
+        calls.append(bot_name)
+        if len(calls) == 2:
+            os.rename(path, path + '.1')
+        return file(bot_name)
+
+    monkeypatch.setattr(writer, '_file', rotating_file)
+    # Both entries are queued before the writer starts, so they form one batch
+    results = []
+    threads = [threading.Thread(target=lambda data=data: results.append(writer.write('shipped', data)))
+               for data in (b'old\n', b'new\n')]
+    for thread in threads:
+        thread.start()
+    while writer.queue.qsize() < 2:
+        time.sleep(0.01)
+    writer.thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert results == [True, True]
+    with open(path + '.1') as f:
+        assert f.read().splitlines() == ['before', 'old']
+    assert read_log(nsl) == ['new']
+    assert writer.write('shipped', b'after\n')
+    assert read_log(nsl) == ['new', 'after']
+
+
+def test_writer_survives_errors(nsl, shipping, monkeypatch):
+    writer = shipping.writer
+    commit = writer._commit
+
+    def failing_commit(batch):
+        raise RuntimeError('disk on fire')
+
+    monkeypatch.setattr(writer, '_commit', failing_commit)
+    assert not writer.write('shipped', b'lost\n')
+    monkeypatch.setattr(writer, '_commit', commit)
+    assert writer.write('shipped', b'kept\n')
+    assert writer.thread.is_alive()
+    assert read_log(nsl) == ['kept']
+
+
+def test_write_timeout(nsl, shipping, monkeypatch):
+    monkeypatch.setattr(nsl, 'LOG_SHIP_WRITE_TIMEOUT', 0.1)
+    # The writer thread is not started yet, so nothing is committed in time
+    writer = nsl.LogShipWriter()
+    started = time.monotonic()
+    assert not writer.write('shipped', b'late\n')
+    assert time.monotonic() - started < 2
+    # A batch answered as rejected is not written once the writer catches up
+    writer.thread.start()
+    assert writer.write('shipped', b'in time\n')
+    assert read_log(nsl) == ['in time']
+
+
+def test_claimed_entry_is_not_cancelled(nsl):
+    entry = nsl.ShipEntry('shipped', b'x\n')
+    assert entry.claim()
+    assert not entry.cancel()
+    entry = nsl.ShipEntry('shipped', b'x\n')
+    assert entry.cancel()
+    assert not entry.claim()
+
+
+def test_unanswered_batch_is_not_resent(nsl):
+    frames = []
+    listener = socket.create_server(('127.0.0.1', 0))
+
+    def accept():
+        # Reads frames but never answers them
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            while True:
+                data = conn.recv(65536)
+                if not data:
+                    break
+                frames.append(data)
+
+    threading.Thread(target=accept, daemon=True).start()
+    handler = NSLoggerHandler('shipped', '127.0.0.1:%d' % listener.getsockname()[1], ack_timeout=0.2)
+    try:
+        assert not handler._send(['one'])
+        assert len(frames) == 1
+    finally:
+        handler.close()
+        listener.close()
+
+
+@pytest.mark.bench
+def test_bench_shipping(nsl, shipping):
+    records, producers = 40000, 8
+    handlers = []
+
+    def produce(k):
+        log = logging.getLogger(f'nsl-bench-{k}')
+        log.propagate = False
+        log.setLevel(logging.INFO)
+        address = nsl.LOG_SHIP_TCP if k % 2 else nsl.LOG_SHIP_SOCKET
+        handler = NSLoggerHandler('shipped', address, queue_size=records)
+        log.addHandler(handler)
+        handlers.append(handler)
+        for i in range(records // producers):
+            log.info(f'record {k} {i}')
+        handler.flush()
+        handler.close()
+        log.removeHandler(handler)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=produce, args=(k,)) for k in range(producers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    dropped = sum(handler.dropped for handler in handlers)
+    assert len(read_log(nsl)) + dropped == records
+
+    # Ingest latency of one frame while the producers keep shipping
+    latencies = []
+    stop = threading.Event()
+
+    def load():
+        with connect(nsl) as sock:
+            while not stop.is_set():
+                ship(sock, {'bot': 'shipped', 'records': ['load'] * 50})
+
+    loaders = [threading.Thread(target=load) for _ in range(producers)]
+    for thread in loaders:
+        thread.start()
+    with connect(nsl) as sock:
+        for _ in range(500):
+            sent = time.perf_counter()
+            assert ship(sock, {'bot': 'shipped', 'records': ['x'] * 10}) == 0
+            latencies.append(time.perf_counter() - sent)
+    stop.set()
+    for thread in loaders:
+        thread.join()
+    latencies.sort()
+    print(f"\n{producers} producers: {records / elapsed:.0f} records/s, {dropped} dropped; "
+          f"frame latency p50 {latencies[len(latencies) // 2] * 1000:.2f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms")
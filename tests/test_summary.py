@@ -0,0 +1,130 @@
+import os
+import time
+
+import pytest
+
+
+def record(level: str, text: str, at: float = None) -> str:
+    return f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(at))},000 - app - {level} - {text}\n"
+
+
+def append(path: str, text: str):
+    with open(path, 'a') as f:
+        f.write(text)
+
+
+@pytest.fixture
+def bots(nsl, db):
+    """Register bots with fresh logs, return a function writing to them"""
+    def register(*bot_names):
+        for bot_name in bot_names:
+            db.execute("INSERT INTO bots (name, exe_path, username) VALUES (?, 'x', 'y')", (bot_name,))
+            path = nsl.get_log_path(bot_name)
+            if os.path.exists(path):
+                os.unlink(path)
+            append(path, record('INFO', 'start'))
+        db.commit()
+    return register
+
+
+@pytest.fixture
+def aggregator(nsl, monkeypatch):
+    aggregator = nsl.LogAggregator(60)
+    monkeypatch.setattr(nsl, 'log_aggregator', aggregator)
+    return aggregator
+
+
+def test_counts_appended_records(nsl, tmp_path):
+    path = str(tmp_path / 'a.log')
+    append(path, record('ERROR', 'before') + record('WARNING', 'before'))
+    stats = nsl.LogStats()
+    stats.update(path, os.stat(path))
+    # History within the window counts, old minutes do not
+    assert stats.counts() == (1, 1)
+    assert stats.last_growth is None
+
+    append(path, record('ERROR', 'old', time.time() - 7200) + record('ERROR', 'now') + 'Traceback (most')
+    stats.update(path, os.stat(path))
+    assert stats.counts() == (2, 1)
+    assert stats.last_line.endswith('ERROR - now')
+    assert stats.pending == b'Traceback (most'
+    assert stats.last_growth is not None
+
+    # Only appended bytes are read
+    append(path, ' recent call last):\n' + record('WARNING', 'again'))
+    assert stats.update(path, os.stat(path)) == len(' recent call last):\n' + record('WARNING', 'again'))
+    assert stats.counts() == (2, 2)
+    assert stats.offset == os.path.getsize(path)
+
+
+def test_rotation_starts_over(nsl, tmp_path):
+    path = str(tmp_path / 'a.log')
+    append(path, record('ERROR', 'one') * 3)
+    stats = nsl.LogStats()
+    stats.update(path, os.stat(path))
+    os.rename(path, path + '.1')
+    append(path, record('INFO', 'fresh'))
+    stats.update(path, os.stat(path))
+    assert stats.offset == os.path.getsize(path)
+    assert stats.last_line.endswith('INFO - fresh')
+    assert stats.size == os.path.getsize(path)
+
+
+def test_aggregator_follows_registered_bots(nsl, db, bots, aggregator):
+    bots('one', 'two')
+    aggregator.refresh()
+    assert set(aggregator.stats) == {'one', 'two'}
+    append(nsl.get_log_path('one'), record('ERROR', 'boom'))
+    aggregator.refresh()
+    assert aggregator.get('one').counts() == (1, 0)
+
+    db.execute("DELETE FROM bots WHERE name = 'two'")
+    db.commit()
+    aggregator.refresh()
+    assert set(aggregator.stats) == {'one'}
+
+
+def test_render_summary(nsl, bots, aggregator):
+    bots('calm', 'warned', 'failing', 'a<b>')
+    append(nsl.get_log_path('warned'), record('WARNING', 'careful'))
+    append(nsl.get_log_path('failing'), record('ERROR', '<oops> & more'))
+    aggregator.refresh()
+    text = nsl.render_summary(['calm', 'warned', 'failing', 'a<b>', 'unknown'])
+    rows = text.split('\n\n', 1)[1].splitlines()
+    # Bots with errors first, then warnings, then the rest
+    assert rows[0].startswith('🔴 <b>failing</b>') and '❗1 ⚠️0' in rows[0]
+    assert '&lt;oops&gt; &amp; more' in rows[1]
+    assert rows[2].startswith('🟡 <b>warned</b>')
+    assert '🟢 <b>a&lt;b&gt;</b>' in text
+    assert '⚪ <b>unknown</b> — нет данных' in text
+
+
+def test_render_summary_fits_one_message(nsl, bots, aggregator):
+    bot_names = [f'bot{i:03d}' for i in range(300)]
+    bots(*bot_names)
+    append(nsl.get_log_path('bot299'), record('ERROR', 'x' * 200))
+    aggregator.refresh()
+    text = nsl.render_summary(bot_names)
+    assert len(text) <= 4000
+    assert text.split('\n\n', 1)[1].startswith('🔴 <b>bot299</b>')
+    assert '… и ещё' in text
+
+
+@pytest.mark.bench
+def test_bench_summary(nsl, bots, aggregator):
+    bot_names = [f'bench{i:03d}' for i in range(500)]
+    bots(*bot_names)
+    started = time.perf_counter()
+    aggregator.refresh()
+    seed_time = time.perf_counter() - started
+    for bot_name in bot_names:
+        append(nsl.get_log_path(bot_name), record('ERROR', 'boom') + record('INFO', 'ok') * 20)
+    started = time.perf_counter()
+    aggregator.refresh()
+    refresh_time = time.perf_counter() - started
+    started = time.perf_counter()
+    for _ in range(100):
+        nsl.render_summary(bot_names)
+    render_time = (time.perf_counter() - started) / 100
+    print(f"\n{len(bot_names)} bots: first refresh {seed_time * 1000:.0f} ms, "
+          f"incremental refresh {refresh_time * 1000:.0f} ms, render {render_time * 1000:.2f} ms")
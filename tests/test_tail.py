@@ -0,0 +1,106 @@
+import io
+import random
+import shutil
+import time
+
+import pytest
+
+
+def readlines_tail(data: bytes, num_lines: int) -> str:
+    """Tail the way get_log_lines did before: decode the whole file and keep the end"""
+    lines = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8', errors='replace').readlines()
+    return ''.join(lines[-num_lines:])
+
+
+def tail(nsl, data: bytes, num_lines: int) -> str:
+    return nsl.decode_log_bytes(nsl.read_tail_bytes(io.BytesIO(data), len(data), num_lines))
+
+
+@pytest.fixture
+def small_blocks(nsl, monkeypatch):
+    # Tiny blocks so that lines and UTF-8 sequences cross block boundaries
+    monkeypatch.setattr(nsl, 'TAIL_BLOCK_SIZE', 7)
+
+
+def test_tail_lines(nsl, small_blocks):
+    data = b''.join(b'line %d\n' % i for i in range(100))
+    assert tail(nsl, data, 3) == 'line 97\nline 98\nline 99\n'
+    assert tail(nsl, data, 1000) == data.decode()
+
+
+def test_tail_empty(nsl, small_blocks):
+    assert tail(nsl, b'', 5) == ''
+    assert tail(nsl, b'abc\n', 0) == ''
+
+
+def test_tail_crlf(nsl, small_blocks):
+    data = b'one\r\ntwo\r\nthree\r\n'
+    assert tail(nsl, data, 2) == 'two\nthree\n'
+
+
+def test_tail_without_trailing_newline(nsl, small_blocks):
+    data = b'one\ntwo\nthree'
+    assert tail(nsl, data, 1) == 'three'
+    assert tail(nsl, data, 2) == 'two\nthree'
+
+
+def test_tail_split_utf8(nsl, small_blocks):
+    data = 'жжжжж\nпривет мир\nёлка\n'.encode()
+    assert tail(nsl, data, 2) == 'привет мир\nёлка\n'
+
+
+def test_tail_matches_readlines(nsl, small_blocks):
+    rng = random.Random(1)
+    for _ in range(2000):
+        parts = [
+            rng.choice(['abc', 'ж' * rng.randint(0, 5), 'x' * rng.randint(0, 20), ''])
+            + rng.choice(['\n', '\r\n'])
+            for _ in range(rng.randint(0, 12))
+        ]
+        if rng.random() < 0.5:
+            parts.append('tailé')
+        data = ''.join(parts).encode()
+        num_lines = rng.randint(1, 15)
+        assert tail(nsl, data, num_lines) == readlines_tail(data, num_lines).replace('\r\n', '\n')
+
+
+def test_get_log_tail(nsl):
+    with open(nsl.get_log_path('tail-bot'), 'wb') as f:
+        f.write(b''.join(b'2026-01-01 00:00:00,000 - app - INFO - %d\n' % i for i in range(500)))
+    snapshot = nsl.get_log_tail('tail-bot', 20)
+    assert [line[-4:] for _, line in snapshot.lines] == [f' {i}\n'[-4:] for i in range(480, 500)]
+    assert nsl.get_log_tail('missing-bot', 20) is None
+
+
+@pytest.mark.bench
+@pytest.mark.parametrize('size_mb', [10, 1024, 5120])
+def test_bench_tail(nsl, tmp_path, size_mb):
+    if shutil.disk_usage(tmp_path).free < (size_mb + 512) * 1024 * 1024:
+        pytest.skip("not enough free disk space")
+    path = tmp_path / 'bench.log'
+    block = b''.join(
+        b'2026-01-01 00:00:00,000 - app - INFO - request %06d handled in 12 ms \xd0\xb6\n' % i
+        for i in range(16384)
+    )
+    with open(path, 'wb') as f:
+        for _ in range(size_mb * 1024 * 1024 // len(block)):
+            f.write(block)
+
+    started = time.perf_counter()
+    with open(path, 'rb') as f:
+        size = f.seek(0, io.SEEK_END)
+        new = nsl.decode_log_bytes(nsl.read_tail_bytes(f, size, 50))
+    new_time = time.perf_counter() - started
+
+    # The old path holds the whole decoded file in memory, so it is only
+    # measured where that fits
+    old_time = None
+    if size_mb <= 1024:
+        started = time.perf_counter()
+        with open(path, encoding='utf-8', errors='replace') as f:
+            old = ''.join(f.readlines()[-50:])
+        old_time = time.perf_counter() - started
+        assert new == old
+
+    print(f"\n{size_mb} MB: seek tail {new_time * 1000:.2f} ms, "
+          f"readlines {'-' if old_time is None else f'{old_time * 1000:.0f} ms'}")